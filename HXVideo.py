@@ -1,8 +1,11 @@
 import argparse
+import json
 import sys
+from itertools import chain
 from rich.console import Console
 from rich.prompt import Prompt
 from rich.prompt import Confirm
+from rich.prompt import IntPrompt
 from rich.markdown import Markdown
 from rich.theme import Theme
 from rich.panel import Panel
@@ -11,10 +14,12 @@ from rich.text import Text
 from rich.layout import Layout
 from rich.logging import RichHandler
 from rich.progress import Progress, track
+from rich.table import Table
 import rich
 import os
 import logging
 from pathlib import Path
+from datetime import datetime
 
 import hxutil
 
@@ -27,41 +32,6 @@ def prompt_path(console, prompt_text):
     path = Prompt.ask(f'[magenta]{prompt_text}[/magenta]')
     return Path(path)
 
-def recurse_path(path, max_depth=6, current_depth=0):
-    """
-    Recursively searches a directory and returns its contents up to a specified depth.
-
-    Args:
-        directory (str): The path of the directory to search.
-        max_depth (int): The maximum depth to recurse.
-        current_depth (int): The current depth of recursion (used internally).
-
-    Returns:
-        list: A list of file and directory paths within the given directory.
-    """
-    if current_depth > max_depth:
-        return []
-
-    contents = []
-
-    try:
-        for item in path.iterdir():
-            if item.is_dir():
-                # If it's a directory, add it and recurse into it
-                contents.append(item)
-                contents.extend(recurse_path(item, max_depth, current_depth + 1))
-            else:
-                # If it's a file, add it to the list
-                contents.append(item)
-    except PermissionError:
-        print(f"Permission denied: {path}")
-    except FileNotFoundError:
-        print(f"Directory not found: {path}")
-    except Exception as e:
-        print(f"Error reading directory {path}: {e}")
-
-    return contents
-
 def show_main(console):
     os.system('cls' if os.name == 'nt' else 'clear')
 
@@ -76,7 +46,7 @@ def show_main(console):
     console.print(":file_folder: If a directory is provided, all files in the directory will be converted.")
     console.print(":repeat: Recursive mode processes subdirectories and their contents.")
     console.print(":pencil: Renaming mode renames the output file to easier sort files chronologically.")
-    console.print(":white_heavy_check_mark: Verify mode runs framehash on the input file and compares it to the output file.")
+    console.print(":white_heavy_check_mark: Verify mode hashes the video packets of the input file and compares them to the output file.")
     console.print("")
 
     while True:
@@ -89,22 +59,17 @@ def show_main(console):
     # If we recurse, we'll get a list of all files in the directory and its subdirectories.
     # If we don't recurse, we'll only get the files in the directory. 
     # If the input path is a file, we'll just use that file.
+    # Only files with the extensions we want and the supported magic words are kept.
     if input_path.is_dir():
         recurse = Confirm.ask("[magenta]Recurse into subdirectories?[magenta]")
-        if recurse:
-            all_files = recurse_path(input_path, max_depth=6)
-        else:
-            all_files = recurse_path(input_path, max_depth=0)
+        with console.status("[orange1]Searching for files...[/orange1]"):
+            allowed_files = list(hxutil.find_hx_files(input_path, max_depth=6 if recurse else 0))
     elif input_path.is_file():
-        all_files = [input_path]
+        allowed_files = [input_path] if input_path.suffix in hxutil.HX_SUFFIXES and hxutil.valid_file(input_path) else []
     else:
         console.print(f"[red]Error: {input_path.resolve()} is not a file or directory.[/red]")
         return
 
-    # Filter the list of files to only include files with the extensions we want.
-    # We'll also check for the supported magic words in the file to ensure it's a valid HX file
-    allowed_files = [f for f in all_files if f.suffix in ['.264', '.265']]
-    allowed_files = [f for f in allowed_files if hxutil.valid_file(f)]
     if len(allowed_files) == 0:
         console.print(f"[red]Error: No valid files found: {input_path.resolve()}[/red]")
         return
@@ -133,44 +98,350 @@ def show_main(console):
 
 
     file_format = Prompt.ask("[magenta]Output format (mkv or mp4)[/magenta]", default="mkv", choices=["mkv", "mp4"])
+    if len(allowed_files) > 1 and Confirm.ask("[magenta]Join all files into one output in recording order?[/magenta]", default=False):
+        first = min(allowed_files, key=lambda file: hxutil.get_newname(file).name)
+        concat_files(allowed_files, output_path / f"{hxutil.get_newname(first).stem}_joined.{file_format}", file_format)
+        return
     file_rename = Confirm.ask("[magenta]Rename output files to allow chronological sort?[/magenta]")
-    file_verify = Confirm.ask("[magenta]Verify output files with framehash?[/magenta]")    
+    file_verify = Confirm.ask("[magenta]Verify output files with packet hashes?[/magenta]")    
+    workers = IntPrompt.ask("[magenta]Number of files to convert at once[/magenta]", default=os.cpu_count() or 1)
+
+    # Clips only make sense for a single file, a directory of files won't share the same times.
+    start = end = None
+    if len(allowed_files) == 1 and Confirm.ask("[magenta]Only convert part of the file?[/magenta]", default=False):
+        start = prompt_time(console, "Clip start (HH:MM:SS)", "0")
+        end = prompt_time(console, "Clip end (HH:MM:SS, blank for end of file)", "")
+
+    jobs = []
+    for file in allowed_files:
+        # Check if we should rename the output file
+        if file_rename:
+            output_filename = hxutil.get_newname(file).with_suffix(f".{file_format}").name
+        else:
+            output_filename = file.with_suffix(f".{file_format}").name
+        jobs.append((file, output_path / output_filename))
+
+    convert_jobs(jobs, file_format, workers, file_verify, start=start, end=end)
+
+def prompt_time(console, prompt_text, default):
+    while True:
+        text = Prompt.ask(f'[magenta]{prompt_text}[/magenta]', default=default, show_default=bool(default))
+        if not text:
+            return None
+        try:
+            return hxutil.parse_time(text)
+        except ValueError as e:
+            console.print(f"[red]Error: {e}[/red]")
+
+def convert_jobs(jobs, file_format, workers, file_verify, overwrite=False, debug=False, start=None, end=None, stats=None, recover=False, audio_packet_ms=0, zero_copy=False):
+    """
+    Convert (input, output) path pairs with a progress bar, printing the result of each file.
+
+    Args:
+        jobs (iterable): (input, output) path pairs. Can be a generator still searching for files, the total on the
+            progress bar grows as they are found.
+        stats (str): 'table' to print where the time went in each conversion once done, 'json' to print it as JSON.
+            Default is None to not measure.
+        recover (bool): Skip corrupt parts of the files, printing what was skipped. Default is False.
+        audio_packet_ms (int): Join audio into packets of about this many milliseconds. Default is 0 for 20ms packets.
+        zero_copy (bool): Build packets straight from a memory map of each file. Default is False.
+
+    Returns:
+        bool: True if every file converted, and verified if file_verify is set.
+    """
+    progress = Progress(rich.progress.SpinnerColumn(), rich.progress.MofNCompleteColumn(), rich.progress.TimeRemainingColumn(), *Progress.get_default_columns())
+    all_ok = True
+    results = []
+
+    def counted(jobs):
+        # batch_rewrap pulls jobs as workers free up. Count them as they come.
+        for count, job in enumerate(jobs, 1):
+            progress.update(task, total=count)
+            yield job
+
+    with progress:
+        if isinstance(jobs, list):
+            task = progress.add_task("[orange1]Converting files...[/orange1]", total=len(jobs))
+        else:
+            task = progress.add_task("[orange1]Converting files...[/orange1]", total=None)
+            jobs = counted(jobs)
+
+        # Files are converted in parallel, results come back as each one finishes.
+        for result in hxutil.batch_rewrap(jobs, file_format, workers=workers, overwrite=overwrite, debug=debug, verify_output=file_verify, start=start, end=end, stats=stats is not None, recover=recover, audio_packet_ms=audio_packet_ms, zero_copy=zero_copy):
+            results.append(result)
+            input_name = result.input_file.name
+            output_filename = result.output_file.name
+            if not result.success:
+                all_ok = False
+                progress.console.print(f"[red]Error: {input_name} failed to convert to {output_filename} - {result.error}[/red]")
+            elif file_verify:
+                if result.verified:
+                    progress.console.print(f"[green]Success: {input_name} converted to {output_filename}[/green]")
+                else:
+                    # Should probably delete the output file here if verification failed
+                    all_ok = False
+                    progress.console.print(f"[red]Error: Verification of {input_name} / {output_filename} failed![/red]")
+            if result.skipped:
+                skipped_bytes = sum(end - start for start, end in result.skipped)
+                ranges = ', '.join(f"{start:#x}-{end:#x}" for start, end in result.skipped[:5]) + (', ...' if len(result.skipped) > 5 else '')
+                progress.console.print(f"[orange1]Recovered: {input_name} had {skipped_bytes:,} corrupt bytes in {len(result.skipped)} place(s) - {ranges}[/orange1]")
+            progress.update(task, advance=1)
+
+    if stats == 'json':
+        # Plain print so the output can be piped without any Rich markup.
+        print(json.dumps([{'input_file': str(result.input_file), 'output_file': str(result.output_file), 'success': result.success,
+                           'elapsed': round(result.elapsed, 6), 'skipped': result.skipped, **(result.stats or {})} for result in results], indent=2))
+    elif stats == 'table':
+        print_stats(progress.console, results)
+    return all_ok
 
+STAT_STAGES = ('index', 'read', 'order', 'packetize', 'open', 'mux')
+
+def print_stats(console, results):
+    """
+    Print a table of where the time went in each conversion. See hxutil.RewrapStats.
+    """
+    if not any(result.stats for result in results):
+        return
 
+    def copies(stats):
+        # Payload bytes copied per byte written.
+        return f"{stats['bytes_copied'] / stats['packet_bytes']:.2f}" if stats.get('packet_bytes') else '-'
+
+    table = Table(title='Conversion stats (wall seconds)', box=box.SIMPLE)
+    table.add_column('File')
+    for stage in STAT_STAGES:
+        table.add_column(stage, justify='right')
+    for column in ('total', 'CPU', 'MB read', 'copies', 'video', 'audio', 'skipped'):
+        table.add_column(column, justify='right')
+    for result in results:
+        if not result.stats:
+            continue
+        stages = result.stats['stages']
+        table.add_row(result.input_file.name,
+                      *(f"{stages[stage]['wall']:.3f}" if stage in stages else '-' for stage in STAT_STAGES),
+                      f"{result.stats['wall']:.3f}", f"{result.stats['cpu']:.3f}", f"{result.stats['bytes_read'] / 1e6:.1f}", copies(result.stats),
+                      f"{result.stats['video_packets']:,}", f"{result.stats['audio_packets']:,}", f"{result.stats['blocks_skipped']:,}")
+    total = hxutil.combine_stats(result.stats for result in results)
+    if total['files'] > 1:
+        table.add_section()
+        table.add_row(f"Total ({total['files']} files)",
+                      *(f"{total['stages'][stage]['wall']:.3f}" if stage in total['stages'] else '-' for stage in STAT_STAGES),
+                      f"{total['wall']:.3f}", f"{total['cpu']:.3f}", f"{total['bytes_read'] / 1e6:.1f}", copies(total),
+                      f"{total['video_packets']:,}", f"{total['audio_packets']:,}", f"{total['blocks_skipped']:,}")
+    console.print(table)
+
+def concat_files(files, output_file, file_format, overwrite=False, debug=False, audio_packet_ms=0):
+    """
+    Join files into one output with a progress bar, printing any gaps between them.
 
+    Returns:
+        bool: True if every file was added.
+    """
     progress = Progress(rich.progress.SpinnerColumn(), rich.progress.MofNCompleteColumn(), rich.progress.TimeRemainingColumn(), *Progress.get_default_columns())
+    all_ok = True
 
     with progress:
-        task = progress.add_task("[orange1]Converting files...[/orange1]", total=len(allowed_files))
+        task = progress.add_task(f"[orange1]Joining files into {output_file.name}...[/orange1]", total=len(files))
+        for segment in hxutil.concat_files(files, output_file, file_format, overwrite=overwrite, debug=debug, audio_packet_ms=audio_packet_ms):
+            if segment.error:
+                all_ok = False
+                progress.console.print(f"[red]Error: {segment.input_file.name} skipped - {segment.error}[/red]")
+            elif segment.gap is not None and segment.gap < 0:
+                progress.console.print(f"[orange1]Timestamps reset before {segment.input_file.name}[/orange1]")
+            elif segment.gap is not None and not segment.continuous:
+                progress.console.print(f"[orange1]Gap of {segment.gap / 1000:.1f}s before {segment.input_file.name}[/orange1]")
+            progress.update(task, advance=1)
+    return all_ok
 
-        for file in allowed_files:
-            # Check if we should rename the output file
-            if file_rename:
-                file_rename = hxutil.get_newname(file)
-                output_filename = file_rename.with_suffix(f".{file_format}").name
+def watch_files(console, input_path, output_path, file_format, max_depth=0, file_verify=False):
+    """
+    Convert new files in a directory as they arrive, printing the result of each, until Ctrl+C.
+
+    Returns:
+        int: The exit code.
+    """
+    console.print(f"[orange1]Watching {input_path.resolve()} for new files. Press Ctrl+C to stop.[/orange1]")
+    results = hxutil.watch_folder(input_path, output_path, file_format, max_depth=max_depth, verify_output=file_verify)
+    try:
+        for result in results:
+            if not result.success:
+                console.print(f"[red]Error: {result.input_file.name} failed to convert to {result.output_file.name} - {result.error}[/red]")
+            elif file_verify and not result.verified:
+                console.print(f"[red]Error: Verification of {result.input_file.name} / {result.output_file.name} failed![/red]")
             else:
-                output_filename = file.with_suffix(f".{file_format}").name
-
-            output_file_path = output_path / output_filename
-
-            # TODO: Need to rework this and the hxutil.rewrap_file function to better handle errors and check for success. Right now, I'm raising errors in some places and returning False in others. - Not good. 
-            if hxutil.rewrap_file(file, output_file_path, file_format, debug=False, overwrite=False):
-                #progress.console.print(f"[green]Success: {file.name} converted to {output_filename}[/green]")
-                if file_verify:
-                    if hxutil.verify(file, output_file_path):
-                        progress.console.print(f"[green]Success: {file.name} converted to {output_filename}[/green]")
-                    else:
-                        # Should probably delete the output file here if verification failed
-                        progress.console.print(f"[red]Error: Verification of {file.name} / {output_filename} failed![/red]")
+                console.print(f"[green]Success: {result.input_file.name} converted to {result.output_file.name} in {result.elapsed:.1f}s[/green]")
+    except KeyboardInterrupt:
+        console.print("[orange1]Stopped watching.[/orange1]")
+    finally:
+        results.close()
+    return 0
+
+def thumbnail_files(files, output_path, interval=None, sheet=False, workers=4):
+    """
+    Write key frame thumbnails, a contact sheet, or both for each file with a progress bar.
+
+    Returns:
+        bool: True if every file had at least one key frame decoded.
+    """
+    progress = Progress(rich.progress.SpinnerColumn(), rich.progress.MofNCompleteColumn(), rich.progress.TimeRemainingColumn(), *Progress.get_default_columns())
+    all_ok = True
+
+    with progress:
+        task = progress.add_task("[orange1]Writing thumbnails...[/orange1]", total=None)
+        for count, file in enumerate(files, 1):
+            progress.update(task, total=count)
+            written = []
+            if interval is not None:
+                written = hxutil.save_thumbnails(file, output_path, interval, workers=workers)
+            if sheet:
+                sheet_file = output_path / f"{file.stem}_sheet.jpg"
+                if hxutil.contact_sheet(file, sheet_file, workers=workers):
+                    written.append(sheet_file)
+            if written:
+                progress.console.print(f"[green]Success: {file.name} - {len(written)} image(s) written[/green]")
             else:
-                progress.console.print(f"[red]Error: {file.name} failed to convert to {output_filename}[/red]")
+                all_ok = False
+                progress.console.print(f"[red]Error: No key frames could be decoded from {file.name}[/red]")
             progress.update(task, advance=1)
+    return all_ok
 
+def format_ms(milliseconds):
+    seconds = milliseconds // 1000
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
 
+def show_activity(console, files, output='table'):
+    """
+    Print each file's bitrate, frame rate, key frame interval and high activity windows. See hxutil.activity_timeline.
 
-def main():
-    os.system('cls' if os.name == 'nt' else 'clear')
+    Returns:
+        bool: True if every file could be indexed.
+    """
+    all_ok = True
+    timelines = []
+    for file in files:
+        timeline = hxutil.activity_timeline(file)
+        if timeline is None:
+            all_ok = False
+            console.print(f"[red]Error: {file.name} could not be indexed.[/red]")
+            continue
+        timelines.append((file, timeline))
+
+    if output == 'json':
+        print(json.dumps([{'input_file': str(file), **timeline.as_dict()} for file, timeline in timelines]))
+        return all_ok
+    table = Table(title='Activity', box=box.SIMPLE)
+    for column in ('File', 'Duration', 'kbit/s', 'FPS', 'Key frame interval'):
+        table.add_column(column, justify='left' if column == 'File' else 'right')
+    table.add_column('Active')
+    for file, timeline in timelines:
+        seconds = max(timeline.duration, 1) / 1000
+        intervals = timeline.keyframe_intervals()
+        windows = timeline.active_windows()
+        table.add_row(file.name, format_ms(timeline.duration),
+                      f"{sum(timeline.video_bytes) * 8 / 1000 / seconds:,.0f}", f"{sum(timeline.frames) / seconds:.1f}",
+                      f"{sum(intervals) / len(intervals) / 1000:.1f}s" if intervals else '-',
+                      '\n'.join(f"{format_ms(start)}-{format_ms(end)} (x{peak:.1f})" for start, end, peak in windows) or '-')
+    console.print(table)
+    return all_ok
+
+def catalog_files(console, input_path, update=False, find=None, max_depth=6):
+    """
+    Update the catalog with a directory's files, list the cataloged files recorded in a time range, or both.
+    See hxutil.Catalog.
+
+    Returns:
+        int: The exit code.
+    """
+    with hxutil.Catalog() as catalog:
+        if update:
+            with console.status(f"[orange1]Cataloging {input_path.resolve()}...[/orange1]"):
+                counts = catalog.update(input_path, max_depth=max_depth)
+            console.print(f"[green]Catalog updated: {counts['added']:,} added, {counts['updated']:,} updated, "
+                          f"{counts['unchanged']:,} unchanged, {counts['removed']:,} removed, {counts['failed']:,} unreadable[/green]")
+        if find is None:
+            return 0
+        files = catalog.query(find[0], find[1], input_path)
+    if not files:
+        console.print("[orange1]No recordings found in that time range.[/orange1]")
+        return 1
+    table = Table(title=f"Recordings from {find[0]} to {find[1]}", box=box.SIMPLE)
+    for column in ('File', 'Start', 'End', 'Duration', 'Size'):
+        table.add_column(column, justify='right' if column in ('Duration', 'Size') else 'left')
+    for file in files:
+        table.add_row(str(file['path'].relative_to(input_path.resolve())), f"{file['start_time']:%Y-%m-%d %H:%M:%S}",
+                      f"{file['end_time']:%Y-%m-%d %H:%M:%S}", format_ms(file['duration']), f"{file['size'] / 1e6:,.1f} MB")
+    console.print(table)
+    return 0
+
+def run_args(console, args):
+    """
+    Convert files from the command line arguments without prompting.
+
+    Returns:
+        int: The exit code.
+    """
+    file_format = args.fmt or 'mkv'
+    try:
+        start = hxutil.parse_time(args.start) if args.start else None
+        end = hxutil.parse_time(args.end) if args.end else None
+        thumbs = hxutil.parse_time(args.thumbs) if args.thumbs else None
+        find = [datetime.fromisoformat(value) for value in args.find] if args.find else None
+    except ValueError as e:
+        console.print(f"[red]Error: {e}[/red]")
+        return 2
+
+    if args.watch and not args.indir:
+        console.print("[red]Error: Watch mode needs an input directory (-indir).[/red]")
+        return 2
+    if (args.catalog or find) and not args.indir:
+        console.print("[red]Error: Catalog and find modes need an input directory (-indir).[/red]")
+        return 2
+    if args.i:
+        input_file = Path(args.i)
+        if not input_file.is_file() or not hxutil.valid_file(input_file):
+            console.print(f"[red]Error: {input_file.resolve()} is not a valid HX file.[/red]")
+            return 1
+        if args.activity:
+            return 0 if show_activity(console, [input_file], args.activity) else 1
+        if thumbs is not None or args.sheet:
+            output_path = Path(args.outdir) if args.outdir else input_file.parent
+            output_path.mkdir(parents=True, exist_ok=True)
+            return 0 if thumbnail_files([input_file], output_path, thumbs, args.sheet, os.cpu_count() or 1) else 1
+        output_file = Path(args.o) if args.o else input_file.with_suffix(f".{file_format}")
+        jobs = [(input_file, output_file)]
+    else:
+        input_path = Path(args.indir)
+        if not input_path.is_dir():
+            console.print(f"[red]Error: {input_path.resolve()} is not a directory.[/red]")
+            return 1
+        if args.catalog or find:
+            return catalog_files(console, input_path, args.catalog, find, max_depth=6 if args.r else 0)
+        if args.activity:
+            return 0 if show_activity(console, list(hxutil.find_hx_files(input_path, max_depth=6 if args.r else 0)), args.activity) else 1
+        output_path = Path(args.outdir) if args.outdir else input_path
+        output_path.mkdir(parents=True, exist_ok=True)
+        if args.watch:
+            return watch_files(console, input_path, output_path, file_format, max_depth=6 if args.r else 0, file_verify=args.verify)
+        # Conversions start as soon as the first files are found.
+        found_files = hxutil.find_hx_files(input_path, max_depth=6 if args.r else 0)
+        first_file = next(found_files, None)
+        if first_file is None:
+            console.print(f"[red]Error: No valid files found: {input_path.resolve()}[/red]")
+            return 1
+        if thumbs is not None or args.sheet:
+            return 0 if thumbnail_files(chain((first_file,), found_files), output_path, thumbs, args.sheet, os.cpu_count() or 1) else 1
+        if args.concat:
+            # Joining needs every file up front to put them in order.
+            allowed_files = [first_file, *found_files]
+            first = min(allowed_files, key=lambda file: hxutil.get_newname(file).name)
+            output_file = Path(args.o) if args.o else output_path / f"{hxutil.get_newname(first).stem}_joined.{file_format}"
+            return 0 if concat_files(allowed_files, output_file, file_format, debug=args.v, audio_packet_ms=args.audioms) else 1
+        jobs = ((file, output_path / file.with_suffix(f".{file_format}").name) for file in chain((first_file,), found_files))
+
+    return 0 if convert_jobs(jobs, file_format, os.cpu_count() or 1, args.verify, debug=args.v, start=start, end=end, stats=args.stats, recover=args.recover, audio_packet_ms=args.audioms, zero_copy=args.zerocopy) else 1
 
+def main():
     custom_theme = Theme({
         "bright_green": "green bold",
         "red": "red",
@@ -179,20 +450,35 @@ def main():
 
     console = Console(theme=custom_theme, style="bright_green")
 
-    show_main(console)
-
-
+    if len(sys.argv) == 1:
+        show_main(console)
+        return
 
-    #parser = argparse.ArgumentParser(prog='new.py', description='Utility to convert HX IPCam video files to something useful')
-    #parser.add_argument('-i', '-input', help='Input file: The HX file you want to convert.')
-    
-    #args = parser.parse_args()
-    #if len(sys.argv) == 1:
-    #    console = Console()
-    #    console.print('Welcome to your application!')
-    #    console.print('Please provide an input file.')
-    #    args.i = Prompt.ask('Input file: ')
-    #print(args.i)
+    parser = argparse.ArgumentParser(prog='HXVideo.py', description='Utility to convert HX IPCam video files to something useful')
+    inputs = parser.add_mutually_exclusive_group(required=True)
+    inputs.add_argument('-i', '-input', help='Input file: The HX file you want to convert.')
+    parser.add_argument('-o', '-output', help='Output file: The output file you want to create.')
+    parser.add_argument('-fmt', choices=sorted(hxutil.OUTPUT_FORMATS), help='Output format: The format you want to convert to.')
+    inputs.add_argument('-indir', help='Input directory: The directory containing the HX files you want to convert.')
+    parser.add_argument('-outdir', help='Output directory: The directory where you want to save the converted files.')
+    parser.add_argument('-r', action='store_true', help='Recursive mode: Process subdirectories and their contents.')
+    parser.add_argument('-v', action='store_true', help='Verbose mode: Print debug information.')
+    parser.add_argument('-verify', action='store_true', help='Verify mode: Compare the video packets of the input and output.')
+    parser.add_argument('-concat', action='store_true', help='Concat mode: Join every file in the input directory into one output, in recording order.')
+    parser.add_argument('-start', help='Clip start: Only convert from this time into the file. Seconds, MM:SS, or HH:MM:SS.')
+    parser.add_argument('-end', help='Clip end: Only convert up to this time into the file. Seconds, MM:SS, or HH:MM:SS.')
+    parser.add_argument('-audioms', type=int, default=0, help='Audio packet size: Join audio into packets of about this many milliseconds, e.g. 250 or 1000. Default is 20ms packets.')
+    parser.add_argument('-zerocopy', action='store_true', help='Zero copy mode: Memory map the input and build each packet with a single copy. Faster, with less memory churn on high bitrate files.')
+    parser.add_argument('-recover', action='store_true', help='Recover mode: Skip over corrupt or truncated parts of the files instead of stopping at them.')
+    parser.add_argument('-watch', action='store_true', help='Watch mode: Keep running and convert new files in the input directory once they stop changing.')
+    parser.add_argument('-thumbs', nargs='?', const='10', help='Thumbnail mode: Write a JPEG from the nearest key frame about every this many seconds, MM:SS, or HH:MM:SS. Default is 10.')
+    parser.add_argument('-sheet', action='store_true', help='Contact sheet mode: Write a 4x4 grid of key frames spread over each file.')
+    parser.add_argument('-activity', nargs='?', const='table', choices=['table', 'json'], help='Activity mode: Print the bitrate, frame rate, key frame interval and high motion times of each file without converting, as a table or JSON.')
+    parser.add_argument('-catalog', action='store_true', help='Catalog mode: Add the files in the input directory to the catalog. Only new or changed files are read.')
+    parser.add_argument('-find', nargs=2, metavar=('FROM', 'TO'), help='Find mode: List the cataloged files in the input directory recorded between two times, e.g. "2024-01-02 02:00" "2024-01-02 02:30".')
+    parser.add_argument('-stats', nargs='?', const='table', choices=['table', 'json'], help='Stats mode: Print the time spent in each stage of each conversion, as a table or JSON.')
+    args = parser.parse_args()
+    sys.exit(run_args(console, args))
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG, handlers=[RichHandler()])
@@ -0,0 +1,389 @@
+"""
+Benchmarks for hxutil.
+
+Usage:
+    python benchmark.py alaw [-seconds SECONDS]
+    python benchmark.py open FILE [-n N]
+    python benchmark.py index FILE
+    python benchmark.py rewrap FILE [-fmt {mkv,mp4,ts}] [-streaming] [-audioms MS]
+    python benchmark.py suite [-durations DURATIONS] [-size WIDTHxHEIGHT] [-codec {hevc,h264}] [-dir DIR] [-keep]
+"""
+import argparse
+import io
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows. Peak memory is left out of the results.
+    resource = None
+
+import hxgen
+import hxutil
+
+def reference_alaw_to_pcm16(alaw_chunk):
+    """
+    The original per-byte A-law conversion. Kept to check the output of hxutil.alaw_to_pcm16 and to measure the speedup.
+
+    Args:
+        alaw_chunk (bytes): The ALAW data to convert.
+
+    Returns:
+        bytes: The converted PCM16 data.
+    """
+    result = bytearray()
+    for byte in alaw_chunk:
+        pcm_value = hxutil.ALAW_TO_PCM16[byte]
+        # Convert to little-endian bytes
+        result.extend(pcm_value.to_bytes(2, 'little', signed=True))
+    return bytes(result)
+
+def reference_open_output(output_file, format, width, height):
+    """
+    The original output setup, which adds the video stream with a libx265 encoder. Kept to measure the per-file
+    overhead of opening an encoder that is never used.
+    """
+    container = hxutil.av.open(output_file, 'w', format=hxutil.OUTPUT_FORMATS[format])
+    video_stream = container.add_stream('libx265', rate=15, options={'x265-params': 'log_level=none'})
+    audio_stream = container.add_stream('pcm_s16le', rate=8000, layout='mono', format='s16')
+    video_stream.time_base = Fraction(1, 1000)
+    video_stream.pix_fmt = "yuv420p"
+    video_stream.width = width
+    video_stream.height = height
+    audio_stream.time_base = Fraction(1, 1000)
+    return container, video_stream, audio_stream
+
+def best_time(func, repeat=5):
+    """
+    Run a function several times and return the fastest run in seconds.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def bench_alaw(seconds=600):
+    """
+    Compare hxutil.alaw_to_pcm16 against the original per-byte conversion.
+
+    Args:
+        seconds (int): Seconds of 8000Hz audio to convert. Default is 10 minutes.
+
+    Returns:
+        bool: True if the output of both functions is identical.
+    """
+    rng = random.Random(0)
+    block_count = seconds * 50 # 20ms blocks of 160 samples.
+    blocks = [bytes(rng.randrange(256) for _ in range(160)) for _ in range(min(block_count, 1000))]
+    blocks = [blocks[i % len(blocks)] for i in range(block_count)]
+    joined = b''.join(blocks)
+
+    # Every possible sample, every block, and the whole buffer at once must match the original.
+    exact = reference_alaw_to_pcm16(bytes(range(256))) == hxutil.alaw_to_pcm16(bytes(range(256)))
+    exact = exact and all(reference_alaw_to_pcm16(block) == hxutil.alaw_to_pcm16(block) for block in blocks[:1000])
+    exact = exact and reference_alaw_to_pcm16(joined) == hxutil.alaw_to_pcm16(joined)
+    print(f'A-law bit exact: {exact}')
+
+    samples = len(joined)
+    results = [
+        ('reference, per block', best_time(lambda: [reference_alaw_to_pcm16(block) for block in blocks], repeat=3)),
+        ('alaw_to_pcm16, per block', best_time(lambda: [hxutil.alaw_to_pcm16(block) for block in blocks])),
+        ('alaw_to_pcm16, whole file', best_time(lambda: hxutil.alaw_to_pcm16(joined))),
+    ]
+    print(f'A-law decode of {seconds}s of audio ({samples:,} samples in {block_count:,} blocks):')
+    for name, elapsed in results:
+        speedup = results[0][1] / elapsed
+        print(f'  {name:<28} {elapsed * 1000:10.2f} ms {samples / elapsed / 1e6:10.1f} Msamples/s {speedup:8.1f}x')
+    return exact
+
+def bench_open(file_path, count=200):
+    """
+    Compare the per-file cost of setting up an output with a libx265 encoder against the current stream setup.
+
+    Args:
+        file_path (pathlib.Path): A HX file to take the video size and parameter sets from.
+        count (int): Number of outputs to open per run. Default is 200.
+
+    Returns:
+        bool: True if the file could be read.
+    """
+    with file_path.open('rb') as f:
+        header = hxutil.read_header(f)
+        if not header:
+            print(f'Not a HX file: {file_path}')
+            return False
+        magic, width, height = header
+        codec = hxutil.VIDEO_CODECS.get(magic)
+        if codec is None:
+            print(f'Not a HX file: {file_path}')
+            return False
+        blocks = hxutil.order_blocks(hxutil.iter_blocks(f, codec=codec))
+        parameter_sets, _ = hxutil.peek_parameter_sets(hxutil.packetize(blocks, codec), codec)
+    if not parameter_sets:
+        print(f'No parameter sets found in {file_path}')
+        return False
+
+    def open_outputs(open_output, *args):
+        # Open, write the header and close, the fixed cost of every conversion.
+        for _ in range(count):
+            container, video_stream, audio_stream = open_output(io.BytesIO(), 'mkv', width, height, *args)
+            container.start_encoding()
+            container.close()
+
+    mode = 'stream copy' if hxutil.STREAM_COPY else f'idle {codec.encoder} encoder with camera parameter sets'
+    results = [
+        ('libx265 encoder (before)', best_time(lambda: open_outputs(reference_open_output), repeat=3)),
+        ('_open_output (after)', best_time(lambda: open_outputs(hxutil._open_output, parameter_sets, codec), repeat=3)),
+    ]
+    print(f'Output setup for a {width}x{height} file, {count} outputs per run. PyAV {hxutil.av.__version__}: {mode}.')
+    for name, elapsed in results:
+        speedup = results[0][1] / elapsed
+        print(f'  {name:<28} {elapsed / count * 1000:10.3f} ms per file {speedup:8.1f}x')
+    return True
+
+def peak_rss():
+    """
+    Return the peak resident memory of this process in bytes, or None if it can't be read on this platform.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes everywhere else.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def isolated(func, *args):
+    """
+    Run a function in a fresh process so its peak memory isn't mixed up with earlier runs.
+
+    Returns:
+        tuple: (result, peak resident memory in bytes or None)
+    """
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(_measured, func, *args).result()
+
+def _measured(func, *args):
+    return func(*args), peak_rss()
+
+def _format_rss(rss):
+    return f'{rss / 1e6:8.0f} MB' if rss else '       -'
+
+def time_index(file_path):
+    """
+    Time a full scan of the blocks in a file, without the index cache.
+
+    Returns:
+        tuple: (seconds, block count)
+    """
+    hxutil.index_cache = None
+    start = time.perf_counter()
+    blocks = hxutil.index_file(file_path)
+    return time.perf_counter() - start, len(blocks) if blocks else 0
+
+def cache_index(file_path, cache_dir):
+    """
+    Index a file into an index cache in cache_dir, so a later rewrap can be measured without the index build.
+
+    Returns:
+        int: The block count.
+    """
+    hxutil.index_cache = hxutil.IndexCache(cache_dir)
+    blocks = hxutil.get_index(file_path)
+    return len(blocks) if blocks else 0
+
+def time_rewrap(file_path, format='mkv', streaming=False, audio_packet_ms=0, zero_copy=False, cache_dir=None):
+    """
+    Time a rewrap of a file into a temporary output, which is deleted afterwards. format can be a list of formats to
+    write in one pass. The index is built as part of the rewrap unless cache_dir has it from cache_index.
+
+    Returns:
+        tuple: (seconds, input size in bytes, True if the rewrap succeeded)
+    """
+    hxutil.index_cache = hxutil.IndexCache(cache_dir) if cache_dir else None
+    with tempfile.TemporaryDirectory() as directory:
+        output_file = [Path(directory) / f'out.{name}' for name in format] if isinstance(format, list) else Path(directory) / f'out.{format}'
+        start = time.perf_counter()
+        success = hxutil.rewrap_file(file_path, output_file, format, overwrite=True, streaming=streaming, audio_packet_ms=audio_packet_ms, zero_copy=zero_copy)
+        return time.perf_counter() - start, file_path.stat().st_size, bool(success)
+
+def count_copies(file_path, format='mkv', streaming=False, audio_packet_ms=0, zero_copy=False):
+    """
+    Rewrap a file with RewrapStats to count the payload bytes copied. Kept apart from time_rewrap, as measuring
+    slows the rewrap down.
+
+    Returns:
+        tuple: (bytes copied, packet bytes written)
+    """
+    hxutil.index_cache = None
+    stats = hxutil.RewrapStats()
+    with tempfile.TemporaryDirectory() as directory:
+        output_file = [Path(directory) / f'out.{name}' for name in format] if isinstance(format, list) else Path(directory) / f'out.{format}'
+        hxutil.rewrap_file(file_path, output_file, format, overwrite=True, streaming=streaming, stats=stats, audio_packet_ms=audio_packet_ms, zero_copy=zero_copy)
+    return stats.bytes_copied, stats.packet_bytes
+
+def time_alaw(file_path):
+    """
+    Time the A-law conversion of every audio block in a file, one block at a time like a rewrap.
+
+    Returns:
+        tuple: (seconds, sample count)
+    """
+    with file_path.open('rb') as f:
+        magic, _, _ = hxutil.read_header(f)
+        payloads = [data[4:] for block, data in hxutil.iter_blocks(f, codec=hxutil.VIDEO_CODECS[magic]) if block.type == 'HXAF']
+    samples = sum(len(payload) for payload in payloads)
+    return best_time(lambda: [hxutil.alaw_to_pcm16(payload) for payload in payloads], repeat=3), samples
+
+def bench_index(file_path):
+    """
+    Measure block indexing speed on one file.
+    """
+    (elapsed, count), rss = isolated(time_index, file_path)
+    if not count:
+        print(f'Could not index {file_path}')
+        return False
+    print(f'Index {file_path.name}: {count:,} blocks in {elapsed:.3f}s, {count / elapsed:,.0f} blocks/s, peak {_format_rss(rss).strip()}')
+    return True
+
+def bench_rewrap(file_path, format='mkv', streaming=False, audio_packet_ms=0, zero_copy=False):
+    """
+    Measure rewrap speed on one file, and how many bytes are copied per byte of packet data written. With a list of
+    formats, they are all written in one pass and compared with a separate rewrap to each.
+
+    Unless streaming, the peak memory of building the index and of a rewrap from an already built index are also
+    measured on their own, as either can set the peak of the whole rewrap.
+    """
+    (elapsed, size, success), rss = isolated(time_rewrap, file_path, format, streaming, audio_packet_ms, zero_copy)
+    if not success:
+        print(f'Could not rewrap {file_path}')
+        return False
+    peak = _format_rss(rss).strip()
+    if not streaming:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            _, index_rss = isolated(cache_index, file_path, cache_dir)
+            _, packet_rss = isolated(time_rewrap, file_path, format, streaming, audio_packet_ms, zero_copy, cache_dir)
+        peak += f' (index {_format_rss(index_rss).strip()}, rewrap from the index {_format_rss(packet_rss).strip()})'
+    # Counted in this process, after the isolated runs, so its memory isn't inherited by them.
+    copied, written = count_copies(file_path, format, streaming, audio_packet_ms, zero_copy)
+    mode = 'streaming' if streaming else 'zero copy' if zero_copy else 'indexed'
+    if audio_packet_ms:
+        mode += f', {audio_packet_ms}ms audio packets'
+    if isinstance(format, list):
+        separate = sum(isolated(time_rewrap, file_path, name, streaming, audio_packet_ms, zero_copy)[0][0] for name in format)
+        print(f'Rewrap {file_path.name} to {"+".join(format)} in one pass ({mode}): {elapsed:.3f}s, separately {separate:.3f}s, '
+              f'{separate / elapsed:.2f}x faster, peak {peak}, {copied / max(written, 1):.2f} bytes copied per byte written')
+        return True
+    print(f'Rewrap {file_path.name} to {format} ({mode}): {size / 1e6:.1f} MB in {elapsed:.3f}s, {size / 1e6 / elapsed:.1f} MB/s, '
+          f'peak {peak}, {copied / max(written, 1):.2f} bytes copied per byte written')
+    return True
+
+def bench_suite(durations, width=1920, height=1080, codec='hevc', directory=None, keep=False, format='mkv'):
+    """
+    Generate synthetic files of each duration and measure indexing, rewrap and A-law decode on each. Every stage runs
+    in its own process to get its peak memory.
+
+    Args:
+        durations (list): Durations in milliseconds.
+        width (int): Video width. Default is 1920.
+        height (int): Video height. Default is 1080.
+        codec (str): 'hevc' or 'h264'. Default is 'hevc'.
+        directory (pathlib.Path): Where to write the generated files. Default is a temporary directory.
+        keep (bool): Keep the generated files and reuse them on the next run. Default is False.
+        format (str): Output format for the rewraps. Default is 'mkv'.
+
+    Returns:
+        bool: True if every stage succeeded.
+    """
+    temp_dir = None
+    if directory is None:
+        temp_dir = tempfile.TemporaryDirectory()
+        directory = Path(temp_dir.name)
+    directory.mkdir(parents=True, exist_ok=True)
+    extension = '265' if codec == 'hevc' else '264'
+    frames = None
+    all_ok = True
+
+    print(f'{codec} {width}x{height}, output {format}. PyAV {hxutil.av.__version__}.')
+    print(f'{"duration":>9} {"size":>10} | {"index":>14} {"peak":>11} | {"rewrap":>11} {"peak":>11} | {"streaming":>11} {"peak":>11} | {"zero copy":>11} {"peak":>11} | {"A-law":>16}')
+    try:
+        for duration in durations:
+            file_path = directory / f'synthetic_{codec}_{width}x{height}_{duration // 1000}s.{extension}'
+            if not file_path.exists():
+                if frames is None:
+                    frames = hxgen.encode_gop(codec, width, height)
+                hxgen.write_hx(file_path, duration, width, height, codec=codec, hxfi='end', frames=frames)
+            size = file_path.stat().st_size
+
+            (index_time, count), index_rss = isolated(time_index, file_path)
+            (rewrap_time, _, rewrap_ok), rewrap_rss = isolated(time_rewrap, file_path, format, False)
+            (stream_time, _, stream_ok), stream_rss = isolated(time_rewrap, file_path, format, True)
+            (mapped_time, _, mapped_ok), mapped_rss = isolated(time_rewrap, file_path, format, False, 0, True)
+            alaw_time, samples = time_alaw(file_path)
+            all_ok = all_ok and bool(count) and rewrap_ok and stream_ok and mapped_ok
+
+            print(f'{duration / 1000:8.0f}s {size / 1e6:7.1f} MB | {count / index_time:7,.0f} blk/s {_format_rss(index_rss)} | '
+                  f'{size / 1e6 / rewrap_time:6.1f} MB/s {_format_rss(rewrap_rss)} | '
+                  f'{size / 1e6 / stream_time:6.1f} MB/s {_format_rss(stream_rss)} | '
+                  f'{size / 1e6 / mapped_time:6.1f} MB/s {_format_rss(mapped_rss)} | '
+                  f'{samples / alaw_time / 1e6:7.1f} Msample/s')
+            if not keep:
+                file_path.unlink()
+    finally:
+        if temp_dir is not None:
+            temp_dir.cleanup()
+    return all_ok
+
+def main():
+    parser = argparse.ArgumentParser(prog='benchmark.py', description='Benchmarks for hxutil')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+    alaw_parser = subparsers.add_parser('alaw', help='A-law to PCM16 conversion.')
+    alaw_parser.add_argument('-seconds', type=int, default=600, help='Seconds of audio to convert.')
+    open_parser = subparsers.add_parser('open', help='Per-file output setup overhead.')
+    open_parser.add_argument('file', type=Path, help='HX file to take the video size and parameter sets from.')
+    open_parser.add_argument('-n', type=int, default=200, help='Outputs to open per run.')
+    index_parser = subparsers.add_parser('index', help='Block indexing speed.')
+    index_parser.add_argument('file', type=Path, help='HX file to index.')
+    rewrap_parser = subparsers.add_parser('rewrap', help='Rewrap speed.')
+    rewrap_parser.add_argument('file', type=Path, help='HX file to rewrap.')
+    rewrap_parser.add_argument('-fmt', choices=hxutil.OUTPUT_FORMATS.keys(), nargs='+', default=['mkv'], help='Output format. Give several to write them all in one pass.')
+    rewrap_parser.add_argument('-streaming', action='store_true', help='Rewrap in one pass without an index.')
+    rewrap_parser.add_argument('-audioms', type=int, default=0, help='Join audio into packets of about this many milliseconds.')
+    rewrap_parser.add_argument('-zerocopy', action='store_true', help='Build packets straight from a memory map of the input.')
+    suite_parser = subparsers.add_parser('suite', help='Index, rewrap and A-law speed on synthetic files of increasing size.')
+    suite_parser.add_argument('-durations', default='1m,10m,1h', help='Comma separated file durations, e.g. 1m,10m,1h,24h. Default is 1m,10m,1h.')
+    suite_parser.add_argument('-size', default='1920x1080', help='Video size in pixels. Default is 1920x1080.')
+    suite_parser.add_argument('-codec', choices=['hevc', 'h264'], default='hevc', help='Video codec. Default is hevc.')
+    suite_parser.add_argument('-fmt', choices=hxutil.OUTPUT_FORMATS.keys(), default='mkv', help='Output format.')
+    suite_parser.add_argument('-dir', type=Path, help='Directory for the generated files. Default is a temporary directory.')
+    suite_parser.add_argument('-keep', action='store_true', help='Keep the generated files and reuse them on the next run.')
+    args = parser.parse_args()
+
+    if args.benchmark == 'alaw':
+        if not bench_alaw(args.seconds):
+            raise SystemExit(1)
+    elif args.benchmark == 'open':
+        if not bench_open(args.file, args.n):
+            raise SystemExit(1)
+    elif args.benchmark == 'index':
+        if not bench_index(args.file):
+            raise SystemExit(1)
+    elif args.benchmark == 'rewrap':
+        if not bench_rewrap(args.file, args.fmt if len(args.fmt) > 1 else args.fmt[0], args.streaming, args.audioms, args.zerocopy):
+            raise SystemExit(1)
+    elif args.benchmark == 'suite':
+        width, height = (int(value) for value in args.size.lower().split('x'))
+        durations = [hxgen.parse_duration(text) for text in args.durations.split(',')]
+        if not bench_suite(durations, width, height, args.codec, args.dir, args.keep, args.fmt):
+            raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,23 @@
-from flask import Flask, render_template, url_for, request
+from flask import Flask, render_template, url_for, request, Response
 import webview
 import os
 from pathlib import Path
 import uuid
 import hxutil
 import threading
+import queue
+import json
+from collections import deque, OrderedDict
+from datetime import datetime
 
-number = 100
-output = 'Processing ...'
-progress = 0
-task_list = {}
+# Jobs waiting to start. Further requests are turned away until one finishes.
+MAX_QUEUED_JOBS = 16
+# Jobs run one at a time. Each job already converts its files in parallel.
+JOB_WORKERS = 1
+# Finished jobs kept around for their status and log.
+MAX_FINISHED_JOBS = 100
+# Lines of output kept per job.
+JOB_LOG_LINES = 1000
 
 class Api():
     def get_dir(self):
@@ -28,97 +36,204 @@ def get_file():
     print(result)
     return result
 
-def convert_files(task_id, files, output_dir, format='mkv', overwrite=False):
-    print(f'Thread started?')
-    global task_list
-    output = ''
-    num_files = len(files)
-    count = 1
-    task_list[task_id] = {'status': 'running', 'progress': 0, 'output': output}
-    for file in files:
-        pct = (count / num_files) * 100
-        output = output + f'{count}/{num_files} - Processing {file}\n'
-        task_list[task_id] = {'status': 'running', 'progress': pct, 'output': output}
-        #output_file = os.path.join(output_dir, f'{os.path.basename(file)}.{format}')
-        output_file = output_dir / f'{file.stem}.{format}'
-        print(f'Converted {output_file}')
-        hxutil.rewrap_file(file, output_file, format, overwrite)
-        count += 1
-        output = output + f'Converted {output_file}\n'
-        pct = (count / num_files) * 100
-        task_list[task_id] = {'status': 'running', 'progress': pct, 'output': output}
-        print(task_list)
-        print(f'Converted {file} to {output_file}')
-    task_list[task_id] = {'status': 'complete', 'progress': 100, 'output': output}
-
-def recurse_path(path, max_depth=6, current_depth=0):
-    """
-    Recursively searches a directory and returns its contents up to a specified depth.
-
-    Args:
-        directory (str): The path of the directory to search.
-        max_depth (int): The maximum depth to recurse.
-        current_depth (int): The current depth of recursion (used internally).
-
-    Returns:
-        list: A list of file and directory paths within the given directory.
-    """
-    if current_depth > max_depth:
-        return []
-
-    contents = []
+class Job():
+    """
+    A batch conversion queued or running in the background.
+
+    Notes:
+        The log is an append-only, bounded buffer. Each line gets an increasing id so Server-Sent Events clients can
+        pick up where they left off.
+    """
+    def __init__(self, files, output_dir, format='mkv', overwrite=False, filename=None, start=None, end=None, concat=False, stats=False):
+        self.id = str(uuid.uuid4())
+        self.files = files
+        self.output_dir = output_dir
+        self.format = format
+        self.overwrite = overwrite
+        self.filename = filename    # Output name for a single file. Default is the input name.
+        self.start = start          # Clip start and end in milliseconds, None for the whole file.
+        self.end = end
+        self.concat = concat        # Join every file into one output.
+        # Where the time went, added up over the files converted so far. None when not measured.
+        self.stats = hxutil.combine_stats([]) if stats else None
+        self.status = 'queued'
+        self.completed = 0
+        self.log = deque(maxlen=JOB_LOG_LINES)
+        self.last_id = 0
+        self.cancel_requested = threading.Event()
+        self.changed = threading.Condition()
+
+    @property
+    def progress(self):
+        if not self.files:
+            return 100
+        return round((self.completed / len(self.files)) * 100, 1)
+
+    @property
+    def finished(self):
+        return self.status in ('complete', 'cancelled', 'error')
+
+    def update(self, line=None, status=None, completed=None, stats=None):
+        with self.changed:
+            if stats is not None and self.stats is not None:
+                self.stats = hxutil.combine_stats([self.stats, stats])
+            if line is not None:
+                self.last_id += 1
+                self.log.append((self.last_id, line))
+            if status is not None:
+                self.status = status
+            if completed is not None:
+                self.completed = completed
+            self.changed.notify_all()
 
+    def lines_since(self, last_id):
+        with self.changed:
+            return [(line_id, line) for line_id, line in self.log if line_id > last_id]
+
+    def to_dict(self):
+        with self.changed:
+            return {'id': self.id, 'status': self.status, 'progress': self.progress, 'completed': self.completed,
+                    'total': len(self.files), 'output': '\n'.join(line for _, line in self.log), 'stats': self.stats}
+
+def run_job(job):
+    """
+    Convert the files of a job, logging each result as it finishes.
+    """
+    if job.cancel_requested.is_set():
+        job.update('Cancelled before starting.', status='cancelled')
+        return
+    if job.concat:
+        return run_concat_job(job)
+    job.update(f'Converting {len(job.files)} file(s)', status='running')
+    jobs = [(file, job.output_dir / f'{job.filename or file.stem}.{job.format}') for file in job.files]
+    count = 0
+    results = hxutil.batch_rewrap(jobs, job.format, overwrite=job.overwrite, start=job.start, end=job.end, stats=job.stats is not None)
     try:
-        for item in path.iterdir():
-            if item.is_dir():
-                # If it's a directory, add it and recurse into it
-                contents.append(item)
-                contents.extend(recurse_path(item, max_depth, current_depth + 1))
+        # Files are converted in parallel, results come back as each one finishes.
+        for result in results:
+            count += 1
+            if result.success:
+                line = f'{count}/{len(jobs)} - Converted {result.output_file}'
             else:
-                # If it's a file, add it to the list
-                contents.append(item)
-        #with os.scandir(path) as entries:
-        #    for entry in entries:
-        #        if entry.is_dir(follow_symlinks=False):
-        #            # If it's a directory, add it and recurse into it
-        #            contents.append(entry)
-        #            contents.extend(recurse_path(entry.path, max_depth, current_depth + 1))
-        #        else:
-        #            # If it's a file, add it to the list
-        #            contents.append(entry)
-    except PermissionError:
-        print(f"Permission denied: {path}")
-    except FileNotFoundError:
-        print(f"Directory not found: {path}")
+                line = f'{count}/{len(jobs)} - Error converting {result.input_file}: {result.error}'
+            job.update(line, completed=count, stats=result.stats)
+            if job.cancel_requested.is_set():
+                break
+    except Exception as e:
+        job.update(f'Error: {e}', status='error')
+        return
+    finally:
+        # Cancels any conversions that have not started yet.
+        results.close()
+    if job.stats and job.stats['files']:
+        stages = ', '.join(f"{name} {times['wall']:.2f}s" for name, times in job.stats['stages'].items())
+        job.update(f"Stats: {job.stats['bytes_read'] / 1e6:.1f} MB read in {job.stats['wall']:.2f}s - {stages}")
+    if job.cancel_requested.is_set() and count < len(jobs):
+        job.update(f'Cancelled after {count} of {len(jobs)} file(s).', status='cancelled')
+    else:
+        job.update('Complete', status='complete')
+
+def run_concat_job(job):
+    """
+    Join the files of a job into one output, logging each file as it is added.
+    """
+    first = min(job.files, key=lambda file: hxutil.get_newname(file).name)
+    output_file = job.output_dir / f'{hxutil.get_newname(first).stem}_joined.{job.format}'
+    job.update(f'Joining {len(job.files)} file(s) into {output_file}', status='running')
+    count = 0
+    try:
+        segments = hxutil.concat_files(job.files, output_file, job.format, overwrite=job.overwrite)
+        try:
+            for segment in segments:
+                count += 1
+                if segment.error:
+                    line = f'{count}/{len(job.files)} - Skipped {segment.input_file}: {segment.error}'
+                elif segment.gap is not None and segment.gap < 0:
+                    line = f'{count}/{len(job.files)} - Added {segment.input_file} after a timestamp reset'
+                elif segment.gap is not None and not segment.continuous:
+                    line = f'{count}/{len(job.files)} - Added {segment.input_file} after a gap of {segment.gap / 1000:.1f}s'
+                else:
+                    line = f'{count}/{len(job.files)} - Added {segment.input_file}'
+                job.update(line, completed=count)
+                if job.cancel_requested.is_set():
+                    break
+        finally:
+            # Finishes the output with the files added so far.
+            segments.close()
     except Exception as e:
-        print(f"Error reading directory {path}: {e}")
+        job.update(f'Error: {e}', status='error')
+        return
+    if job.cancel_requested.is_set() and count < len(job.files):
+        job.update(f'Cancelled after {count} of {len(job.files)} file(s).', status='cancelled')
+    else:
+        job.update('Complete', status='complete')
 
-    return contents
+class JobQueue():
+    """
+    Bounded queue of conversion jobs run by a fixed number of background threads.
+    """
+    def __init__(self, max_queued=MAX_QUEUED_JOBS, workers=JOB_WORKERS):
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.workers = workers
+        self.threads = []
 
-def index_files(path, recurse=False):
-    files = []
-    if not recurse:
-        recurse_depth = 0
-    #try:
-        #for file in os.scandir(dir):
-    for item in recurse_path(path, recurse_depth):
-        if (item.suffix == '.264' or item.suffix == '.265') and item.is_file():
-            if hxutil.valid_file(item):
-                files.append(item)
-    return files
-    #except FileNotFoundError:
-    #    print('Directory not found')
-    #except PermissionError:
-    #    print('Permission denied')
-    #except OSError:
-    #    print('OS Error')
-    #except Exception as e:
-    #    print(f"Error reading directory : {e}")
-    
-    #return files
+    def _start_workers(self):
+        while len(self.threads) < self.workers:
+            thread = threading.Thread(target=self._worker, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _worker(self):
+        while True:
+            job = self.queue.get()
+            try:
+                run_job(job)
+            except Exception as e:
+                job.update(f'Error: {e}', status='error')
+            finally:
+                self.queue.task_done()
+
+    def submit(self, job):
+        """
+        Queue a job. Returns False if the queue is full.
+        """
+        with self.lock:
+            self._start_workers()
+            try:
+                self.queue.put_nowait(job)
+            except queue.Full:
+                return False
+            self.jobs[job.id] = job
+            # Forget the oldest finished jobs.
+            finished = [job_id for job_id, old_job in self.jobs.items() if old_job.finished]
+            for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+                del self.jobs[job_id]
+        return True
 
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
 
+    def cancel(self, job_id):
+        """
+        Ask a job to stop. Queued jobs never start, running jobs stop after the files in progress.
+        """
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job.cancel_requested.set()
+        if job.status == 'queued':
+            job.update('Cancel requested.')
+        elif not job.finished:
+            job.update('Cancel requested. Waiting for files in progress to finish.')
+        return job
 
+job_queue = JobQueue()
+
+def index_files(path, recurse=False):
+    return list(hxutil.find_hx_files(path, max_depth=6 if recurse else 0))
 
 server = Flask(__name__, static_folder='./assets', template_folder='./templates')
 
@@ -130,6 +245,68 @@ def hello_world():
 def batch_convert():
     return render_template('batch.html')
 
+@server.route("/single", methods=['GET'])
+def single_convert():
+    return render_template('single.html')
+
+@server.route("/view", methods=['GET'])
+def view_file():
+    return render_template('view.html')
+
+@server.route("/stream")
+def stream():
+    """
+    Remux a HX file on the fly and stream it to a <video> element. See hxutil.stream_file.
+
+    Query args are file, format (mp4 or ts, default mp4) and start (seconds, MM:SS or HH:MM:SS).
+    """
+    input_file = request.args.get('file', '')
+    format = request.args.get('format', 'mp4')
+    if format not in hxutil.STREAM_FORMATS:
+        return {'error': 'Invalid format'}, 400
+    try:
+        start = hxutil.parse_time(request.args['start']) if request.args.get('start') else None
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    if not os.path.isfile(input_file) or not hxutil.valid_file(Path(input_file)):
+        return {'error': 'Input file is not a valid HX file.'}, 404
+    mimetype = hxutil.STREAM_FORMATS[format][0]
+    return Response(hxutil.stream_file(Path(input_file), format, start), mimetype=mimetype, headers={'Cache-Control': 'no-cache'})
+
+@server.route("/find", methods=['GET'])
+def find_recordings():
+    return render_template('find.html')
+
+@server.route("/catalog", methods=['GET'])
+def catalog():
+    """
+    Return the cataloged files recorded between two times as JSON. See hxutil.Catalog.query.
+
+    Query args are from and to (ISO dates and times, either can be left out) and dir to only search one folder.
+    """
+    try:
+        start = datetime.fromisoformat(request.args['from']) if request.args.get('from') else None
+        end = datetime.fromisoformat(request.args['to']) if request.args.get('to') else None
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    under = Path(request.args['dir']) if request.args.get('dir') else None
+    with hxutil.Catalog() as files:
+        found = files.query(start, end, under)
+    return {'files': [{**file, 'path': str(file['path']),
+                       'start_time': file['start_time'].isoformat() if file['start_time'] else None,
+                       'end_time': file['end_time'].isoformat() if file['end_time'] else None} for file in found]}
+
+@server.route("/catalog/update", methods=['POST'])
+def update_catalog():
+    """
+    Add a folder's new and changed files to the catalog and return the counts as JSON.
+    """
+    input_dir = request.form.get('dir', '')
+    if not input_dir or not os.path.isdir(input_dir):
+        return {'error': 'Input directory does not exist.'}, 400
+    with hxutil.Catalog() as files:
+        return files.update(Path(input_dir), 6 if request.form.get('recurse') else 0)
+
 @server.route("/batch_contents", methods=['POST'])
 def batch_contents():
     try:
@@ -149,22 +326,46 @@ def batch_contents():
     return render_template('batch_contents.html', input_dir=input_dir, output_dir=output_dir, found_files=found_files)
 @server.route("/convert", methods=['POST'])
 def convert():
+    filename = start = end = None
     try:
         convert_type = request.form['convert_type']
         if convert_type == 'single':
             input_file = request.form['input_file']
             output_dir = request.form['output_dir']
-            filename = request.form['filename']
+            filename = request.form.get('filename') or None
             format = request.form['format']
+            overwrite = False
+            start = hxutil.parse_time(request.form['start']) if request.form.get('start') else None
+            end = hxutil.parse_time(request.form['end']) if request.form.get('end') else None
         elif convert_type == 'batch':
             input_dir = request.form['input_dir']
             output_dir = request.form['output_dir']
             overwrite = request.form.get('overwrite') == 1
             recurse = request.form.get('recurse')
             concat = request.form.get('concat')
+            stats = request.form.get('stats')
             format = request.form.get('format')
     except KeyError:
         return render_template('index.html', error='Please complete required fields.')
+    except ValueError as e:
+        return render_template('index.html', error=str(e))
+
+    if convert_type == 'single':
+        if not input_file or not output_dir:
+            return render_template('index.html', error='Please specify both an input file and output directory.')
+        if not os.path.isfile(input_file) or not hxutil.valid_file(Path(input_file)):
+            return render_template('index.html', error='Input file is not a valid HX file.')
+        if not os.path.exists(output_dir):
+            return render_template('index.html', error='Output directory does not exist.')
+        input_path = Path(input_file)
+        output_path = Path(output_dir)
+        found_files = [input_path]
+        filename = Path(filename).stem if filename else None
+        job = Job(found_files, output_path, format, overwrite, filename, start, end)
+        if not job_queue.submit(job):
+            return render_template('index.html', error='Too many conversions queued. Please try again later.')
+        print(f'Queued job {job.id} - {input_path.name}')
+        return render_template('convert.html', input_dir=input_path.parent, output_dir=output_dir, found_files=found_files, task_id=job.id)
 
     if not input_dir or not output_dir:
         return render_template('index.html', error='Please specify both input and output directories.')
@@ -177,32 +378,57 @@ def convert():
     output_path = Path(output_dir)
     found_files = index_files(input_path, recurse is not None)
 
-    task_id = str(uuid.uuid4())
-    # Maybe create thread or track differently so it can be controlled/stopped if needed?
-    print(f'Creating task {task_id}')
-    task = threading.Thread(target=convert_files, args=(task_id, found_files, output_path, format, overwrite))
-    task.start()
-    print(found_files)
+    job = Job(found_files, output_path, format, overwrite, concat=concat is not None, stats=stats is not None)
+    if not job_queue.submit(job):
+        return render_template('index.html', error='Too many conversions queued. Please try again later.')
+    print(f'Queued job {job.id} - {len(found_files)} file(s)')
 
-    return render_template('convert.html', input_dir=input_dir, output_dir=output_dir, found_files=found_files, task_id=task_id)
+    return render_template('convert.html', input_dir=input_dir, output_dir=output_dir, found_files=found_files, task_id=job.id)
 
 @server.route("/status/<string:jobid>")
 def status(jobid):
+    job = job_queue.get(jobid)
+    if job is None:
+        return {'error': 'Unknown job'}, 404
+    return job.to_dict()
+
+@server.route("/cancel/<string:jobid>", methods=['POST'])
+def cancel(jobid):
+    job = job_queue.cancel(jobid)
+    if job is None:
+        return {'error': 'Unknown job'}, 404
+    return job.to_dict()
+
+@server.route("/events/<string:jobid>")
+def events(jobid):
+    """
+    Stream a job's log and progress as Server-Sent Events until it finishes.
+    """
+    job = job_queue.get(jobid)
+    if job is None:
+        return {'error': 'Unknown job'}, 404
+    try:
+        last_id = int(request.headers.get('Last-Event-ID', 0))
+    except ValueError:
+        last_id = 0
+
+    def stream(last_id):
+        while True:
+            with job.changed:
+                # Wake up when there is something new, or send a keep-alive comment.
+                if not job.changed.wait_for(lambda: job.last_id > last_id or job.finished, timeout=15):
+                    yield ': keep-alive\n\n'
+                    continue
+            for line_id, line in job.lines_since(last_id):
+                yield f'id: {line_id}\nevent: log\ndata: {json.dumps(line)}\n\n'
+                last_id = line_id
+            state = {'status': job.status, 'progress': job.progress, 'completed': job.completed, 'total': len(job.files)}
+            yield f'event: progress\ndata: {json.dumps(state)}\n\n'
+            if job.finished and last_id >= job.last_id:
+                return
+
+    return Response(stream(last_id), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
 
-    global task_list
-    #return {'status': 'running', 'progress': '20', 'output': 'Some text'}
-    return task_list[jobid]
-    #global progress
-    #global output
-    #global number
-    #progress += 1
-    #status = 'running'
-    #if progress >= number:
-    #    status = 'complete'
-    #pct = (progress // number) * 100
-    #output = output + f'\nProcessing file {progress} of 1000'
-    #status = {'status': status, 'progress': progress, 'output': output}
-    #return status
 if __name__ == '__main__':
     window = webview.create_window('HXVideo', server)
     window.expose(get_dir, get_file)
@@ -0,0 +1,232 @@
+"""
+Write synthetic HX files for testing and benchmarks. No camera needed.
+
+Usage:
+    python hxgen.py OUTPUT [-duration DURATION] [-size WIDTHxHEIGHT] [-fps FPS] [-gop GOP] [-codec {hevc,h264}]
+                           [-noaudio] [-hxfi {start,end}] [-noise NOISE] [-seed SEED]
+
+One GOP is encoded and then repeated with increasing timestamps, so hours of video take seconds to write. The
+blocks are laid out like the camera files: parameter sets before each key frame in their own blocks, and audio
+trailing video by a fixed lag.
+"""
+import argparse
+import random
+import struct
+from fractions import Fraction
+from pathlib import Path
+
+import av
+
+import hxutil
+
+# Audio blocks trail video blocks with the same timestamp by about this many milliseconds in camera files.
+AUDIO_LAG = 200
+# Each audio block is 20ms of 8000Hz A-law, with a 4 byte prefix.
+AUDIO_BLOCK_MS = 20
+AUDIO_PREFIX = b'\x00\x01\x50\x00'
+# HXFI blocks in camera files are always this size.
+HXFI_SIZE = 200000
+
+_ENCODERS = {
+    'hevc': ('libx265', b'HXVT', lambda gop: {'preset': 'ultrafast', 'x265-params': f'log_level=none:keyint={gop}:min-keyint={gop}:bframes=0:open-gop=0:scenecut=0:repeat-headers=1'}),
+    'h264': ('libx264', b'HXVS', lambda gop: {'preset': 'ultrafast', 'g': str(gop), 'bf': '0', 'x264-params': 'scenecut=0:repeat-headers=1'}),
+}
+
+def parse_duration(text):
+    """
+    Parse a duration like 90s, 10m, 2h or 1h30m into milliseconds. A plain number is seconds.
+    """
+    text = text.strip().lower()
+    total = 0
+    number = ''
+    for char in text:
+        if char.isdigit() or char == '.':
+            number += char
+        elif char in 'hms' and number:
+            total += float(number) * {'h': 3600, 'm': 60, 's': 1}[char]
+            number = ''
+        else:
+            raise ValueError(f'Invalid duration: {text}')
+    if number:
+        total += float(number)
+    return round(total * 1000)
+
+def encode_gop(codec='hevc', width=1920, height=1080, fps=15, gop=30, noise=0.1, seed=0):
+    """
+    Encode one GOP of synthetic video.
+
+    Args:
+        codec (str): 'hevc' or 'h264'. Default is 'hevc'.
+        width (int): Frame width in pixels. Default is 1920.
+        height (int): Frame height in pixels. Default is 1080.
+        fps (int): Frame rate. Default is 15.
+        gop (int): Frames per GOP, starting with a key frame. Default is 30.
+        noise (float): Fraction of each frame filled with random pixels, 0 to 1. Raises the bitrate. Default is 0.1.
+        seed (int): Random seed. Default is 0.
+
+    Returns:
+        list: The NAL units of each frame, in order. Each NAL unit is Annex B with a 4 byte start code.
+    """
+    encoder, magic, options = _ENCODERS[codec]
+    ctx = av.CodecContext.create(encoder, 'w')
+    ctx.width = width
+    ctx.height = height
+    ctx.pix_fmt = 'yuv420p'
+    ctx.time_base = Fraction(1, fps)
+    ctx.framerate = fps
+    ctx.options = options(gop)
+    rng = random.Random(seed)
+
+    # A diagonal gradient that scrolls each frame, with a band of noise. Built from slices, not per pixel.
+    y_size = width * height
+    gradient = bytes(range(256)) * (y_size // 256 + width // 256 + 2)
+    noise_rows = int(height * max(0.0, min(noise, 1.0)))
+    chroma = bytes([128]) * ((width // 2) * (height // 2))
+    frames = []
+    for i in range(gop):
+        frame = av.VideoFrame(width, height, 'yuv420p')
+        shift = (i * 5) % 256
+        luma = bytearray(gradient[shift:shift + y_size])
+        if noise_rows:
+            luma[:noise_rows * width] = rng.randbytes(noise_rows * width)
+        frame.planes[0].update(_pad_plane(luma, width, frame.planes[0].line_size, height))
+        frame.planes[1].update(_pad_plane(chroma, width // 2, frame.planes[1].line_size, height // 2))
+        frame.planes[2].update(_pad_plane(chroma, width // 2, frame.planes[2].line_size, height // 2))
+        frame.pts = i
+        frames.extend(bytes(packet) for packet in ctx.encode(frame))
+    frames.extend(bytes(packet) for packet in ctx.encode(None))
+
+    codec_info = hxutil.VIDEO_CODECS[magic]
+    result = []
+    for data in frames:
+        units = []
+        for unit in hxutil.split_nal_units(data):
+            if not unit or codec_info.unit_type(unit) == codec_info.aud_type:
+                continue
+            if codec == 'hevc' and codec_info.unit_type(unit) == 20:
+                # x265 writes IDR_N_LP key frames. The cameras write IDR_W_RADL, type 19.
+                unit = bytes([(19 << 1) | (unit[0] & 0x81)]) + unit[1:]
+            units.append(b'\x00\x00\x00\x01' + unit)
+        result.append(units)
+    return result
+
+def _pad_plane(data, width, line_size, height):
+    # Planes can be padded to a wider line size than the image.
+    if line_size == width:
+        return bytes(data)
+    padding = bytes(line_size - width)
+    return b''.join(bytes(data[row * width:(row + 1) * width]) + padding for row in range(height))
+
+def write_hx(output_file, duration=60000, width=1920, height=1080, fps=15, gop=30, codec='hevc', audio=True, hxfi=None, noise=0.1, seed=0, start_timestamp=1000000, frames=None):
+    """
+    Write a synthetic HX file.
+
+    Args:
+        output_file (pathlib.Path): The file to write.
+        duration (int): Length in milliseconds. Default is 1 minute.
+        width (int): Frame width in pixels. Default is 1920.
+        height (int): Frame height in pixels. Default is 1080.
+        fps (int): Frame rate. Default is 15.
+        gop (int): Frames per GOP. Default is 30.
+        codec (str): 'hevc' for a HXVT file or 'h264' for a HXVS file. Default is 'hevc'.
+        audio (bool): Write audio blocks. Default is True.
+        hxfi (str): Write a HXFI key frame index at the 'start' or 'end' of the file. Default is None for no HXFI.
+        noise (float): Fraction of each frame filled with random pixels. See encode_gop. Default is 0.1.
+        seed (int): Random seed. Default is 0.
+        start_timestamp (int): Timestamp of the first block. Default is 1000000.
+        frames (list): A GOP from encode_gop to reuse instead of encoding a new one. Default is None.
+
+    Returns:
+        dict: Keys 'blocks', 'video_blocks', 'audio_blocks', 'keyframes', 'size'.
+
+    Notes:
+        The HXFI block is written as hxutil.read_hxfi reads it: 32-bit offset and timestamp of the first block of
+        each key frame. Only the first HXFI_SIZE / 8 key frames fit.
+    """
+    _, magic, _ = _ENCODERS[codec]
+    codec_info = hxutil.VIDEO_CODECS[magic]
+    if frames is None:
+        frames = encode_gop(codec, width, height, fps, gop, noise, seed)
+    rng = random.Random(seed)
+    audio_payloads = [AUDIO_PREFIX + rng.randbytes(160) for _ in range(50)]
+
+    frame_count = duration * fps // 1000
+    audio_count = duration // AUDIO_BLOCK_MS if audio else 0
+    keyframes = []
+    stats = {'blocks': 0, 'video_blocks': 0, 'audio_blocks': 0, 'keyframes': 0, 'size': 0}
+    block_header = struct.Struct('<4sIII')
+
+    with open(output_file, 'wb', buffering=hxutil.STREAM_BUFFER_SIZE) as f:
+        f.write(magic + struct.pack('<III', width, height, 0))
+        offset = 16
+        if hxfi == 'start':
+            # Filled in at the end, once the key frame offsets are known.
+            f.write(b'HXFI' + struct.pack('<I', HXFI_SIZE) + bytes(HXFI_SIZE))
+            offset += 8 + HXFI_SIZE
+
+        audio_index = 0
+        for i in range(frame_count):
+            timestamp = start_timestamp + i * 1000 // fps
+            # Audio up to this frame, minus the lag.
+            while audio_index < audio_count and start_timestamp + audio_index * AUDIO_BLOCK_MS + AUDIO_LAG <= timestamp:
+                payload = audio_payloads[audio_index % len(audio_payloads)]
+                f.write(block_header.pack(b'HXAF', len(payload), start_timestamp + audio_index * AUDIO_BLOCK_MS, 0))
+                f.write(payload)
+                offset += 16 + len(payload)
+                audio_index += 1
+                stats['audio_blocks'] += 1
+            units = frames[i % len(frames)]
+            if codec_info.nalu_type(units[-1][:5]) == codec_info.keyframe_type:
+                keyframes.append((offset, timestamp))
+            for unit in units:
+                f.write(block_header.pack(b'HXVF', len(unit), timestamp, 0))
+                f.write(unit)
+                offset += 16 + len(unit)
+                stats['video_blocks'] += 1
+        while audio_index < audio_count:
+            payload = audio_payloads[audio_index % len(audio_payloads)]
+            f.write(block_header.pack(b'HXAF', len(payload), start_timestamp + audio_index * AUDIO_BLOCK_MS, 0))
+            f.write(payload)
+            offset += 16 + len(payload)
+            audio_index += 1
+            stats['audio_blocks'] += 1
+
+        if hxfi:
+            entries = bytearray(HXFI_SIZE)
+            for k, (key_offset, timestamp) in enumerate(keyframes[:HXFI_SIZE // 8]):
+                if key_offset > 0xFFFFFFFF:
+                    break
+                struct.pack_into('<II', entries, k * 8, key_offset, timestamp)
+            if hxfi == 'start':
+                f.seek(16 + 8)
+                f.write(entries)
+            else:
+                f.write(b'HXFI' + struct.pack('<I', HXFI_SIZE) + entries)
+                offset += 8 + HXFI_SIZE
+
+    stats['blocks'] = stats['video_blocks'] + stats['audio_blocks']
+    stats['keyframes'] = len(keyframes)
+    stats['size'] = offset
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(prog='hxgen.py', description='Write synthetic HX files for testing and benchmarks')
+    parser.add_argument('output', type=Path, help='The HX file to write.')
+    parser.add_argument('-duration', default='1m', help='Length, e.g. 90s, 10m, 2h. Default is 1m.')
+    parser.add_argument('-size', default='1920x1080', help='Video size in pixels. Default is 1920x1080.')
+    parser.add_argument('-fps', type=int, default=15, help='Frame rate. Default is 15.')
+    parser.add_argument('-gop', type=int, default=30, help='Frames per GOP. Default is 30.')
+    parser.add_argument('-codec', choices=sorted(_ENCODERS), default='hevc', help='hevc for HXVT, h264 for HXVS. Default is hevc.')
+    parser.add_argument('-noaudio', action='store_true', help='Leave out audio blocks.')
+    parser.add_argument('-hxfi', choices=['start', 'end'], help='Write a HXFI key frame index.')
+    parser.add_argument('-noise', type=float, default=0.1, help='Fraction of each frame that is noise, raises the bitrate. Default is 0.1.')
+    parser.add_argument('-seed', type=int, default=0, help='Random seed.')
+    args = parser.parse_args()
+
+    width, height = (int(value) for value in args.size.lower().split('x'))
+    stats = write_hx(args.output, parse_duration(args.duration), width, height, args.fps, args.gop, args.codec,
+                     not args.noaudio, args.hxfi, args.noise, args.seed)
+    print(f'Wrote {args.output}: {stats["size"] / 1e6:.1f} MB, {stats["blocks"]:,} blocks, {stats["keyframes"]:,} key frames')
+
+if __name__ == '__main__':
+    main()
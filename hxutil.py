@@ -2,24 +2,79 @@ import av
 import struct
 from fractions import Fraction
 import os
+import mmap
+import operator
+import heapq
+import bisect
+import re
+from array import array
+from itertools import chain, compress, islice, repeat
+from collections import deque
 from dataclasses import dataclass
 from typing import Optional
 import csv
 from pathlib import Path
 import hashlib
+import io
+import functools
 import logging
 import subprocess
+import tempfile
+import threading
+import time
+import sqlite3
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager, nullcontext
 
 av.logging.set_level(None)
 
 logger = logging.getLogger(__name__)
 
+# enable_debug and disable_logging change global libav state. Count the callers that want debug output so
+# concurrent conversions don't switch it off for each other.
+_libav_logging_lock = threading.Lock()
+_libav_debug_users = 0
+
 def enable_debug():
-    av.logging.set_libav_level(av.logging.TRACE)
-    av.logging.restore_default_callback()
+    """
+    Turn on raw FFmpeg trace output.
+
+    Notes:
+        Calls are counted. Output stays on until disable_logging has been called the same number of times.
+    """
+    global _libav_debug_users
+    with _libav_logging_lock:
+        _libav_debug_users += 1
+        if _libav_debug_users == 1:
+            av.logging.set_libav_level(av.logging.TRACE)
+            av.logging.restore_default_callback()
+
 def disable_logging():
-    av.logging.set_level(None)
-    #av.logging.set_libav_level(av.logging.PANIC)
+    """
+    Undo one call to enable_debug, and turn off FFmpeg output if nothing else still wants it.
+    """
+    global _libav_debug_users
+    with _libav_logging_lock:
+        if _libav_debug_users > 0:
+            _libav_debug_users -= 1
+        if _libav_debug_users == 0:
+            av.logging.set_level(None)
+            #av.logging.set_libav_level(av.logging.PANIC)
+
+@contextmanager
+def debug_logging(debug: bool = True):
+    """
+    Context manager that enables FFmpeg trace output for its duration if debug is True.
+    """
+    if not debug:
+        yield
+        return
+    enable_debug()
+    try:
+        yield
+    finally:
+        disable_logging()
 
 @dataclass
 class Block:
@@ -31,360 +86,3030 @@ class Block:
     relative_ts: Optional[int] = -1
     nalu_type: Optional[int] = None
 
-def h265_nalu_type(data):
-    """ 
-    Decode raw H.265 data to find NAL unit type.
+# Block header: magic word, data size and timestamp. Followed by 4 unknown bytes.
+_BLOCK_HEADER = struct.Struct('<4sII')
+# Finds candidate block headers when resyncing.
+_BLOCK_MAGIC = re.compile(b'HX(?:VF|AF|FI)')
+# Block type codes used by the columnar index.
+_BLOCK_TYPES = ('HXVF', 'HXAF')
+# Columns of the BlockIndex and their array type codes, in serialized order.
+_INDEX_COLUMNS = (('types', 'B'), ('offsets', 'Q'), ('sizes', 'I'), ('timestamps', 'I'),
+                  ('nalu_types', 'b'), ('relative_ts', 'q'), ('durations', 'q'))
+
+# Output formats and the FFmpeg muxer used for each. Add more after testing. Currently represented as file extension.
+OUTPUT_FORMATS = {'mkv': 'matroska', 'mp4': 'mp4', 'ts': 'mpegts'}
+# How far audio may trail video in the file, in milliseconds, when reordering blocks in a single pass.
+REORDER_WINDOW = 5000
+# Read buffer for sequential passes over a file.
+STREAM_BUFFER_SIZE = 1024 * 1024
+# Pages of a memory mapped file more than this far behind where it is being read are dropped from the process, so a
+# long file doesn't build up in memory. See _release_pages.
+MAPPED_WINDOW = 64 * 1024 * 1024
+
+class _StreamColumns:
+    # The blocks of one stream in file order, collected into arrays while indexing so no per block objects are kept.
+    __slots__ = ('offsets', 'sizes', 'timestamps', 'nalu_types')
+
+    def __init__(self):
+        self.offsets = array('Q')
+        self.sizes = array('I')
+        self.timestamps = array('I')
+        self.nalu_types = array('b')
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def append(self, offset, size, timestamp, nalu_type):
+        self.offsets.append(offset)
+        self.sizes.append(size)
+        self.timestamps.append(timestamp)
+        self.nalu_types.append(nalu_type)
+
+    def ordered(self):
+        # The same blocks in timestamp order, ties kept in file order.
+        timestamps = self.timestamps
+        if not any(map(operator.gt, timestamps, islice(timestamps, 1, None))):
+            return self
+        # Stream is out of order. Shouldn't happen, so the cost of a full sort is fine.
+        order = sorted(range(len(self)), key=timestamps.__getitem__)
+        stream = _StreamColumns()
+        for name in self.__slots__:
+            column = getattr(self, name)
+            setattr(stream, name, array(column.typecode, map(column.__getitem__, order)))
+        return stream
+
+class BlockIndex:
+    """
+    Compact, array backed index of the blocks in a HX file.
+
+    Each attribute is a column with one entry per block, ordered by timestamp:
+        types (array): 0 for HXVF, 1 for HXAF.
+        offsets (array): Offset of the block header in the file.
+        sizes (array): Data size from the block header.
+        timestamps (array): Timestamp from the block header.
+        nalu_types (array): NAL unit type of video blocks, -1 if none.
+        relative_ts (array): Timestamp relative to the first block.
+        durations (array): Time until the next block of the same type, -1 for the last one.
+
+    Notes:
+        Indexing or iterating returns Block objects so existing code can keep treating this like a list of blocks.
+        The Block objects are views built on demand. Changing them does not change the index.
+    """
+    def __init__(self, types=None, offsets=None, sizes=None, timestamps=None, nalu_types=None, relative_ts=None, durations=None):
+        self.types = types if types is not None else array('B')
+        self.offsets = offsets if offsets is not None else array('Q')
+        self.sizes = sizes if sizes is not None else array('I')
+        self.timestamps = timestamps if timestamps is not None else array('I')
+        self.nalu_types = nalu_types if nalu_types is not None else array('b')
+        self.relative_ts = relative_ts if relative_ts is not None else array('q')
+        self.durations = durations if durations is not None else array('q')
+
+    @classmethod
+    def from_streams(cls, video, audio):
+        """
+        Build an index from the video and audio blocks collected in file order.
+
+        Args:
+            video (_StreamColumns): The HXVF blocks.
+            audio (_StreamColumns): The HXAF blocks.
+
+        Returns:
+            BlockIndex: The merged index.
+
+        Notes:
+            Audio blocks trail video blocks in the file, but each stream is already in timestamp order. The two runs
+            are merged by finding, with a binary search, how far one stream can be copied before the other's next
+            block, and copying that run a slice at a time. Nothing is held per block except the array columns.
+            Ties are broken by file offset so blocks sharing a timestamp keep their file order.
+        """
+        streams = [stream.ordered() for stream in (video, audio)]
+        # Duration of each block is the time until the next block of the same type. Needed to mux video packets.
+        # Audio blocks are constant 20ms, but calculate them the same way.
+        durations = []
+        for stream in streams:
+            timestamps = stream.timestamps
+            stream_durations = array('q', map(operator.sub, islice(timestamps, 1, None), timestamps))
+            if timestamps:
+                stream_durations.append(-1)
+            durations.append(stream_durations)
+
+        index = cls()
+        def take(code, start, end):
+            stream = streams[code]
+            index.types.extend(array('B', [code]) * (end - start))
+            index.offsets.extend(stream.offsets[start:end])
+            index.sizes.extend(stream.sizes[start:end])
+            index.timestamps.extend(stream.timestamps[start:end])
+            index.nalu_types.extend(stream.nalu_types[start:end])
+            index.durations.extend(durations[code][start:end])
+
+        def run_end(stream, start, timestamp, offset):
+            # End of the run of blocks from start that come before a block of the other stream.
+            timestamps, offsets = stream.timestamps, stream.offsets
+            end = bisect.bisect_left(timestamps, timestamp, start)
+            while end < len(timestamps) and timestamps[end] == timestamp and offsets[end] < offset:
+                end += 1
+            return end
+
+        video, audio = streams
+        i = j = 0
+        while i < len(video) and j < len(audio):
+            end = run_end(video, i, audio.timestamps[j], audio.offsets[j])
+            take(0, i, end)
+            i = end
+            if i == len(video):
+                break
+            end = run_end(audio, j, video.timestamps[i], video.offsets[i])
+            take(1, j, end)
+            j = end
+        take(0, i, len(video))
+        take(1, j, len(audio))
+
+        # Timestamps appear to be universal across block types, so everything is relative to the first block.
+        initial_ts = index.timestamps[0] if index.timestamps else 0
+        index.relative_ts = array('q', map(operator.sub, index.timestamps, repeat(initial_ts)))
+        return index
+
+    def block(self, i):
+        """
+        Return a Block view of a single entry.
+
+        Args:
+            i (int): The position of the block in the index.
+
+        Returns:
+            Block: The block at that position.
+        """
+        nalu_type = self.nalu_types[i]
+        return Block(_BLOCK_TYPES[self.types[i]], self.offsets[i], self.sizes[i], self.timestamps[i],
+                     self.durations[i], self.relative_ts[i], None if nalu_type == -1 else nalu_type)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return BlockIndex(self.types[i], self.offsets[i], self.sizes[i], self.timestamps[i],
+                              self.nalu_types[i], self.relative_ts[i], self.durations[i])
+        return self.block(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.block(i)
+
+    def __repr__(self):
+        return f'<BlockIndex {len(self)} blocks>'
+
+    def tobytes(self):
+        """
+        Serialize the index.
+
+        Returns:
+            bytes: The block count followed by each column's raw array data.
+
+        Notes:
+            Arrays are written in native byte order. Only load the data on the same type of machine.
+        """
+        return struct.pack('<Q', len(self)) + b''.join(getattr(self, name).tobytes() for name, _ in _INDEX_COLUMNS)
+
+    @classmethod
+    def frombytes(cls, data):
+        """
+        Load an index serialized with tobytes.
+
+        Args:
+            data (bytes): The serialized index.
+
+        Returns:
+            BlockIndex: The loaded index.
+
+        Raises:
+            ValueError: If the data is not the expected length.
+        """
+        count = struct.unpack_from('<Q', data)[0]
+        offset = 8
+        columns = {}
+        for name, code in _INDEX_COLUMNS:
+            column = array(code)
+            length = count * column.itemsize
+            column.frombytes(data[offset:offset + length])
+            if len(column) != count:
+                raise ValueError('Serialized index is truncated.')
+            columns[name] = column
+            offset += length
+        if offset != len(data):
+            raise ValueError('Serialized index has unexpected trailing data.')
+        return cls(**columns)
+
+class IndexCache:
+    """
+    On disk cache of BlockIndex objects so a file is only indexed once.
+
+    Args:
+        directory (pathlib.Path): Where to store the cache. Default is a HXVideo folder in the user's cache directory.
+        max_size (int): Maximum total size of the cache in bytes. Default is 512 MiB.
+
+    Notes:
+        Entries are keyed on the resolved path of the file and store its size and mtime. If either changes the entry is
+        ignored and replaced, so edited or replaced recordings are re-indexed automatically.
+        Each entry's mtime is touched when it is used. When the cache grows over max_size the least recently used
+        entries are deleted.
+        Any problem reading or writing the cache is treated as a cache miss. The cache is only ever an optimization.
+    """
+    MAGIC = b'HXIX'
+    VERSION = 1
+    # Magic, version, byte order, file size, file mtime, length of the path that follows.
+    _HEADER = struct.Struct('<4sHcQqH')
+
+    def __init__(self, directory: Optional[Path] = None, max_size: int = 512 * 1024 * 1024):
+        self.directory = directory if directory else self.default_directory()
+        self.max_size = max_size
+        self._total_size = None # Running total of the cache size. Only scanned from disk when needed.
+
+    @staticmethod
+    def default_directory():
+        """
+        Return the default cache directory for this platform.
+
+        Returns:
+            pathlib.Path: HXVIDEO_CACHE_DIR if set, otherwise a folder under LOCALAPPDATA or XDG_CACHE_HOME (~/.cache).
+        """
+        if os.environ.get('HXVIDEO_CACHE_DIR'):
+            return Path(os.environ['HXVIDEO_CACHE_DIR'])
+        if os.name == 'nt' and os.environ.get('LOCALAPPDATA'):
+            return Path(os.environ['LOCALAPPDATA']) / 'HXVideo' / 'index'
+        return Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'hxvideo' / 'index'
+
+    def _entry_path(self, file_path):
+        key = hashlib.sha1(os.fsencode(file_path)).hexdigest()
+        return self.directory / f'{key}.hxidx'
+
+    def _header(self, file_path, stat):
+        path = os.fsencode(file_path)
+        byteorder = b'<' if struct.pack('=H', 1) == struct.pack('<H', 1) else b'>'
+        return self._HEADER.pack(self.MAGIC, self.VERSION, byteorder, stat.st_size, stat.st_mtime_ns, len(path)) + path
+
+    def get(self, file_path: Path):
+        """
+        Return the cached index of a file.
+
+        Args:
+            file_path (pathlib.Path): The path to the HX file.
+
+        Returns:
+            BlockIndex: The cached index, or None if there is no valid entry.
+        """
+        try:
+            file_path = file_path.resolve()
+            header = self._header(file_path, file_path.stat())
+            entry = self._entry_path(file_path)
+            with entry.open('rb') as f:
+                if f.read(len(header)) != header:
+                    # Different size, mtime, path or version. Stale entry, will be replaced on put.
+                    return None
+                index = BlockIndex.frombytes(f.read())
+            os.utime(entry)
+            return index
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.debug(f'Could not read index cache for {file_path}: {e}')
+            return None
+
+    def put(self, file_path: Path, index: BlockIndex):
+        """
+        Store the index of a file.
+
+        Args:
+            file_path (pathlib.Path): The path to the HX file.
+            index (BlockIndex): The index to store.
+
+        Returns:
+            bool: True if stored, False otherwise.
+        """
+        try:
+            file_path = file_path.resolve()
+            data = self._header(file_path, file_path.stat()) + index.tobytes()
+            if len(data) > self.max_size:
+                return False
+            self.directory.mkdir(parents=True, exist_ok=True)
+            entry = self._entry_path(file_path)
+            # Write to a temporary file and rename so readers never see a partial entry. The name is unique to this
+            # write, as threads and processes can store the same entry at once.
+            fd, temp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                try:
+                    replaced_size = entry.stat().st_size
+                except FileNotFoundError:
+                    replaced_size = 0
+                os.replace(temp, entry)
+            except BaseException:
+                os.unlink(temp)
+                raise
+        except Exception as e:
+            logger.debug(f'Could not write index cache for {file_path}: {e}')
+            return False
+        if self._total_size is not None:
+            self._total_size += len(data) - replaced_size
+        if self._total_size is None or self._total_size > self.max_size:
+            self.evict()
+        return True
+
+    def evict(self):
+        """
+        Delete the least recently used entries until the cache is within max_size.
+        """
+        try:
+            entries = []
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.endswith('.hxidx'):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        except FileNotFoundError:
+            self._total_size = 0
+            return
+        total = sum(size for _, size, _ in entries)
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._total_size = total
+
+    def clear(self):
+        """
+        Delete every entry in the cache.
+        """
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.endswith('.hxidx'):
+                        os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+        self._total_size = 0
+
+# Index cache used by file_info, csv_report and rewrap_file. Set to None to disable caching.
+index_cache: Optional[IndexCache] = IndexCache()
+
+def get_index(file_path: Path):
+    """
+    Return the index of a HX file, from the index cache if possible.
+
+    Args:
+        file_path (pathlib.Path): The path to the file to index.
+
+    Returns:
+        BlockIndex: The file's index, or None if problem.
+
+    Notes:
+        Files that fail to index are not cached.
+    """
+    if index_cache is None:
+        return index_file(file_path)
+    index = index_cache.get(file_path)
+    if index is None:
+        index = index_file(file_path)
+        if index:
+            index_cache.put(file_path, index)
+    return index
+
+def h265_nalu_type(data):
+    """ 
+    Decode raw H.265 data to find NAL unit type.
+
+    Args:
+        data (bytes): The data to decode.
+
+    Returns:
+        int: The type of the NALU.
+    """
+    if data[0:3] == b'\x00\x00\x01':
+        unit_type = (data[3] >> 1) & 0x3F
+        return unit_type
+    elif data[0:4] == b'\x00\x00\x00\x01':
+        # This seems to be the expected format in the video files I have examined.
+        unit_type = (data[4] >> 1) & 0x3F
+        return unit_type
+    else:
+        # Return -1 or None if valid NALU padding not found.Not sure which is best yet
+        return None
+
+def h264_nalu_type(data):
+    """
+    Decode raw H.264 data to find NAL unit type.
+
+    Args:
+        data (bytes): The data to decode.
+
+    Returns:
+        int: The type of the NALU, or None if the data doesn't start with a start code.
+    """
+    if data[0:3] == b'\x00\x00\x01':
+        return data[3] & 0x1F
+    elif data[0:4] == b'\x00\x00\x00\x01':
+        return data[4] & 0x1F
+    else:
+        return None
+
+@dataclass(frozen=True, eq=False)
+class VideoCodec:
+    """
+    The NAL unit types that matter for indexing and remuxing one video codec.
+
+    Attributes:
+        name (str): FFmpeg codec and raw format name.
+        encoder (str): Encoder to add the video stream with on PyAV versions that can't stream copy.
+        encoder_options (dict): Options to open the encoder with. It is never used to encode.
+        nalu_type (callable): Gets the NAL unit type from data starting with a start code.
+        frame_types (tuple): NAL unit types that complete an access unit. Anything else is buffered into the next one.
+        keyframe_type (int): The IRAP/IDR NAL unit type.
+        parameter_set_types (tuple): VPS, SPS and PPS NAL unit types, or SPS and PPS for H.264.
+        aud_type (int): Access unit delimiter NAL unit type. Some muxers add these.
+    """
+    name: str
+    encoder: str
+    encoder_options: dict
+    nalu_type: callable
+    frame_types: tuple
+    keyframe_type: int
+    parameter_set_types: tuple
+    aud_type: int
+
+    def unit_type(self, unit):
+        # Type of a NAL unit without its start code.
+        return (unit[0] >> 1) & 0x3F if self.name == 'hevc' else unit[0] & 0x1F
+
+    @property
+    def seek_types(self):
+        # NAL units a key frame can start with.
+        return self.parameter_set_types + (self.keyframe_type,)
+
+HEVC = VideoCodec('hevc', 'libx265', {'x265-params': 'log_level=none:pools=none:frame-threads=1'}, h265_nalu_type, (1, 19), 19, (32, 33, 34), 35)
+H264 = VideoCodec('h264', 'libx264', {'threads': '1'}, h264_nalu_type, (1, 5), 5, (7, 8), 9)
+# Video codec of each HX file type.
+VIDEO_CODECS = {b'HXVT': HEVC, b'HXVS': H264}
+
+def file_codec(file_path: Path):
+    """
+    Return the video codec of a HX file from its magic word.
+
+    Args:
+        file_path (pathlib.Path): The path to the HX file.
+
+    Returns:
+        VideoCodec: HEVC for HXVT files, H264 for HXVS files, or None for anything else.
+    """
+    with file_path.open('rb') as f:
+        return VIDEO_CODECS.get(f.read(4))
+
+# A-law sample value to signed 16-bit PCM.
+ALAW_TO_PCM16 = (
+    -5504, -5248, -6016, -5760, -4480, -4224, -4992, -4736,
+    -7552, -7296, -8064, -7808, -6528, -6272, -7040, -6784,
+    -2752, -2624, -3008, -2880, -2240, -2112, -2496, -2368,
+    -3776, -3648, -4032, -3904, -3264, -3136, -3520, -3392,
+    -22016, -20992, -24064, -23040, -17920, -16896, -19968, -18944,
+    -30208, -29184, -32256, -31232, -26112, -25088, -28160, -27136,
+    -11008, -10496, -12032, -11520, -8960, -8448, -9984, -9472,
+    -15104, -14592, -16128, -15616, -13056, -12544, -14080, -13568,
+    -344, -328, -376, -360, -280, -264, -312, -296,
+    -472, -456, -504, -488, -408, -392, -440, -424,
+    -88, -72, -120, -104, -24, -8, -56, -40,
+    -216, -200, -248, -232, -152, -136, -184, -168,
+    -1376, -1312, -1504, -1440, -1120, -1056, -1248, -1184,
+    -1888, -1824, -2016, -1952, -1632, -1568, -1760, -1696,
+    -688, -656, -752, -720, -560, -528, -624, -592,
+    -944, -912, -1008, -976, -816, -784, -880, -848,
+    5504, 5248, 6016, 5760, 4480, 4224, 4992, 4736,
+    7552, 7296, 8064, 7808, 6528, 6272, 7040, 6784,
+    2752, 2624, 3008, 2880, 2240, 2112, 2496, 2368,
+    3776, 3648, 4032, 3904, 3264, 3136, 3520, 3392,
+    22016, 20992, 24064, 23040, 17920, 16896, 19968, 18944,
+    30208, 29184, 32256, 31232, 26112, 25088, 28160, 27136,
+    11008, 10496, 12032, 11520, 8960, 8448, 9984, 9472,
+    15104, 14592, 16128, 15616, 13056, 12544, 14080, 13568,
+    344, 328, 376, 360, 280, 264, 312, 296,
+    472, 456, 504, 488, 408, 392, 440, 424,
+    88, 72, 120, 104, 24, 8, 56, 40,
+    216, 200, 248, 232, 152, 136, 184, 168,
+    1376, 1312, 1504, 1440, 1120, 1056, 1248, 1184,
+    1888, 1824, 2016, 1952, 1632, 1568, 1760, 1696,
+    688, 656, 752, 720, 560, 528, 624, 592,
+    944, 912, 1008, 976, 816, 784, 880, 848
+)
+# Low and high bytes of the little-endian PCM16 value of each A-law sample, for use with bytes.translate.
+_ALAW_TO_PCM16_LOW = bytes(value & 0xFF for value in ALAW_TO_PCM16)
+_ALAW_TO_PCM16_HIGH = bytes((value >> 8) & 0xFF for value in ALAW_TO_PCM16)
+
+def alaw_to_pcm16(alaw_chunk):
+    """
+    Convert ALAW audio data to PCM16.
+
+    Args:
+        alaw_chunk (bytes): The ALAW data to convert.
+
+    Returns:
+        bytes: The converted PCM16 data, little-endian.
+    
+    References:
+        https://en.wikipedia.org/wiki/G.711#A-law_algorithm
+        https://web.archive.org/web/20110714000731/http://hazelware.luggle.com/tutorials/mulawcompression.html
+    Notes:
+        In my video files, audio blocks seem to all be alaw 8000Hz mono, with 160 samples that represent 20ms of audio.
+        There is an unknown 4 byte header/padding before the alaw data. 0x00 01 50 00
+        Works on any length, so the data of many blocks can be joined and converted in one call.
+    """
+    if not isinstance(alaw_chunk, (bytes, bytearray)):
+        alaw_chunk = bytes(alaw_chunk)
+    # Look up the low and high byte of every sample at once and interleave them.
+    result = bytearray(len(alaw_chunk) * 2)
+    result[0::2] = alaw_chunk.translate(_ALAW_TO_PCM16_LOW)
+    result[1::2] = alaw_chunk.translate(_ALAW_TO_PCM16_HIGH)
+    return bytes(result)
+
+def valid_file(file_path):
+    """
+    Check if a file is a valid HX file.
+    
+    Args:
+        file_path (pathlib.Path): The path to the file.
+        
+    Returns:
+        bool: True if valid, False otherwise.
+
+    Notes:
+        This is a simple check to see if the file begins with the magic words 'HXVT' or 'HXVS'.
+    """
+    with file_path.open('rb') as f:
+        magic = f.read(4)
+        if magic == b'HXVT' or magic == b'HXVS':
+            return True
+        else:
+            return False
+
+# File extensions the cameras use. HXVS files are .264 and HXVT files are .265.
+HX_SUFFIXES = ('.264', '.265')
+
+def scan_dir(path: Path, max_depth: int = 6, suffixes=HX_SUFFIXES):
+    """
+    Walk a directory for files with the given extensions.
+
+    Args:
+        path (pathlib.Path): The directory to search.
+        max_depth (int): How many levels of subdirectories to search. 0 is only the directory itself. Default is 6.
+        suffixes (tuple): File extensions to match. Default is HX_SUFFIXES.
+
+    Yields:
+        os.DirEntry: Each matching file, as it is found.
+
+    Notes:
+        Uses os.scandir, so the file type comes from the directory listing and most platforms need no stat per entry.
+        Symlinked directories are not followed, to avoid loops. Directories that can't be read are logged and skipped.
+    """
+    stack = [(os.fspath(path), 0)]
+    while stack:
+        directory, depth = stack.pop()
+        subdirectories = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if depth < max_depth:
+                                subdirectories.append(entry.path)
+                        elif entry.name.endswith(suffixes) and entry.is_file():
+                            yield entry
+                    except OSError as e:
+                        logger.debug(f'Could not read {entry.path}: {e}')
+        except PermissionError:
+            logger.warning(f'Permission denied: {directory}')
+        except FileNotFoundError:
+            logger.warning(f'Directory not found: {directory}')
+        except OSError as e:
+            logger.warning(f'Error reading directory {directory}: {e}')
+        # Reversed so the subdirectories are searched in listing order.
+        stack.extend((subdirectory, depth + 1) for subdirectory in reversed(subdirectories))
+
+def _check_file(file_path):
+    try:
+        return valid_file(file_path)
+    except OSError as e:
+        logger.debug(f'Could not read {file_path}: {e}')
+        return False
+
+def find_hx_files(path: Path, max_depth: int = 6, workers: int = 8, suffixes=HX_SUFFIXES):
+    """
+    Find the HX files in a directory, checking their magic words while the directory is still being searched.
+
+    Args:
+        path (pathlib.Path): The directory to search.
+        max_depth (int): How many levels of subdirectories to search. 0 is only the directory itself. Default is 6.
+        workers (int): Number of files to check at once. Default is 8.
+        suffixes (tuple): File extensions to check. Default is HX_SUFFIXES.
+
+    Yields:
+        pathlib.Path: Each valid HX file, in the order they were found.
+
+    Notes:
+        Each check is an open and a 4 byte read, mostly waiting on the disk, so threads overlap them. Only a few checks
+        per worker run ahead of the file being yielded, so the first files can be converted before the search is
+        done. Pass the generator straight to batch_rewrap, or wrap it in list() to get everything first.
+    """
+    pending = deque()
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for entry in scan_dir(path, max_depth, suffixes):
+            file_path = Path(entry.path)
+            pending.append((file_path, executor.submit(_check_file, file_path)))
+            # Hand over every file that is ready, and wait on the oldest once too many are waiting.
+            while pending and (pending[0][1].done() or len(pending) >= workers * 4):
+                file_path, future = pending.popleft()
+                if future.result():
+                    yield file_path
+        while pending:
+            file_path, future = pending.popleft()
+            if future.result():
+                yield file_path
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+# Bytes at the end of a file searched for the last blocks by file_info. Grows up to MAX_TAIL_WINDOW if needed.
+TAIL_WINDOW = 256 * 1024
+MAX_TAIL_WINDOW = 16 * 1024 * 1024
+
+def _first_timestamp(mm, window=REORDER_WINDOW):
+    # The first video block has the lowest video timestamp, but audio trails video so the first audio block can be
+    # earlier. Walk the headers until both have been seen, or window ms have passed without any audio.
+    offset = 16
+    first = lowest = None
+    seen = set()
+    while offset + 16 <= len(mm):
+        magic, length, timestamp = _BLOCK_HEADER.unpack_from(mm, offset)
+        if magic == b'HXFI':
+            offset += 8 + length
+            continue
+        if magic != b'HXVF' and magic != b'HXAF':
+            break
+        if first is None:
+            first = lowest = timestamp
+        lowest = min(lowest, timestamp)
+        seen.add(magic)
+        if len(seen) == len(_BLOCK_TYPES) or timestamp - first > window:
+            break
+        offset += 16 + length
+    return lowest
+
+def _tail_timestamps(mm, start):
+    # Find the first block header after start that begins an unbroken chain of blocks to the end of the file.
+    # Returns the timestamps of every block in that chain, or None if there isn't one.
+    size = len(mm)
+    for match in _BLOCK_MAGIC.finditer(mm, start):
+        offset = match.start()
+        timestamps = {}
+        while offset + 16 <= size:
+            magic, length, timestamp = _BLOCK_HEADER.unpack_from(mm, offset)
+            if magic == b'HXFI':
+                offset += 8 + length
+            elif magic == b'HXVF' or magic == b'HXAF':
+                timestamps.setdefault(magic, []).append(timestamp)
+                offset += 16 + length
+            else:
+                # Not a real header, or corrupt. Try the next candidate.
+                timestamps = None
+                break
+        if timestamps:
+            return timestamps
+    return None
+
+def _last_timestamp(mm, window=REORDER_WINDOW):
+    # Search backwards from the end of the file in growing windows, resyncing on the block magic words.
+    tail = TAIL_WINDOW
+    while True:
+        start = max(16, len(mm) - tail)
+        timestamps = _tail_timestamps(mm, start)
+        if timestamps:
+            newest = max(max(values) for values in timestamps.values())
+            oldest = min(min(values) for values in timestamps.values())
+            # Need the end of both streams, unless one of them hasn't appeared in window ms and likely doesn't exist.
+            if start == 16 or len(timestamps) == len(_BLOCK_TYPES) or newest - oldest > window:
+                return newest
+        if start == 16 or tail >= MAX_TAIL_WINDOW:
+            return None
+        tail *= 4
+
+def file_info(file_path, full_index: bool = False):
+    """
+    Return basic information about a HX file.
+    
+    Args:
+        file_path (pathlib.Path): The path to the file.
+        full_index (bool): Always index the whole file instead of only reading its start and end. Default is False.
+
+    Returns:
+        dict:   A dictionary containing file information.
+                Keys: 'type', 'width', 'height', 'size', 'duration', 'first_timestamp', 'last_timestamp'
+
+    Notes:
+        Duration is calculated from the timestamps of the first and last block.
+        The index cache is used if it has the file. Otherwise only the first blocks and the blocks at the end of the
+        file are read, so this takes the same time for any size of file. The whole file is only indexed if the end
+        of the file is corrupt.
+    """
+    size = file_path.stat().st_size
+    with file_path.open('rb') as f:
+        magic = f.read(4)
+        if magic == b'HXVT':
+            file_type = 'HXVT'
+        elif magic == b'HXVS':
+            file_type = 'HXVS'
+        else:
+            file_type = 'unknown'
+        width = struct.unpack('<I', f.read(4))[0]
+        height = struct.unpack('<I', f.read(4))[0]
+
+        first_ts = last_ts = None
+        blocks = index_cache.get(file_path) if index_cache and not full_index else None
+        if blocks:
+            first_ts, last_ts = blocks[0].timestamp, blocks[-1].timestamp
+        elif not full_index and magic in VIDEO_CODECS and size > 16:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                first_ts = _first_timestamp(mm)
+                last_ts = _last_timestamp(mm) if first_ts is not None else None
+    if first_ts is None or last_ts is None:
+        # No shortcut. Index the whole file.
+        blocks = get_index(file_path)
+        if not blocks:
+            return None
+        first_ts, last_ts = blocks[0].timestamp, blocks[-1].timestamp
+    duration = last_ts - first_ts
+
+    return {'type': file_type, 'width': width, 'height': height, 'size': size, 'duration': duration,
+            'first_timestamp': first_ts, 'last_timestamp': last_ts}
+
+def file_info_batch(file_paths, workers: int = 8):
+    """
+    Return basic information about many HX files at once.
+
+    Args:
+        file_paths (iterable): The paths of the files.
+        workers (int): Number of files to read at once. Default is 8.
+
+    Yields:
+        tuple: (file_path, info) for each file, in the order given. info is the file_info dict, or None if problem.
+
+    Notes:
+        Reading the start and end of a file is mostly waiting on the disk, so threads are used to overlap the reads.
+    """
+    def info(file_path):
+        try:
+            return file_path, file_info(file_path)
+        except (OSError, struct.error) as e:
+            logger.debug(f'Could not read {file_path}: {e}')
+            return file_path, None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(info, file_paths)
+
+
+# Recording date and time in camera file names, e.g. P230101_120000_120500.265 or 230101_120000_120500P.265 after
+# renaming. YYMMDD, or YYYYMMDD, then HHMMSS.
+_NAME_TIME = re.compile(r'(?<!\d)(\d{6}|\d{8})_(\d{6})(?!\d)')
+_EPOCH = datetime(1970, 1, 1)
+
+def recording_start(file_path: Path, duration: Optional[int] = None):
+    """
+    Return the wall clock time a HX file started recording.
+
+    Args:
+        file_path (pathlib.Path): The path to the file.
+        duration (int): The file's duration in milliseconds, from file_info. Only needed for the fallback.
+
+    Returns:
+        datetime.datetime: The time in the file name if it has one, otherwise the file's modified time less its
+                           duration. In the camera's local time, without a time zone. None if neither is known.
+
+    Notes:
+        The block timestamps count from when the camera started, not a clock, so they can't be used for this.
+    """
+    match = _NAME_TIME.search(file_path.name)
+    if match:
+        date, time_of_day = match.groups()
+        try:
+            return datetime.strptime(date + time_of_day, '%y%m%d%H%M%S' if len(date) == 6 else '%Y%m%d%H%M%S')
+        except ValueError:
+            pass
+    if duration is None:
+        return None
+    try:
+        return datetime.fromtimestamp(file_path.stat().st_mtime) - timedelta(milliseconds=duration)
+    except OSError:
+        return None
+
+def _to_ms(time_value):
+    return (time_value - _EPOCH) // timedelta(milliseconds=1)
+
+def _from_ms(milliseconds):
+    return _EPOCH + timedelta(milliseconds=milliseconds)
+
+class Catalog:
+    """
+    SQLite catalog of the HX files in an archive, so they can be found by recording time without opening them.
+
+    Args:
+        database (pathlib.Path): The database file. Default is catalog.sqlite in the HXVideo cache folder. See
+            default_path.
+
+    Notes:
+        Each row holds the file_info of a file, its size and mtime, and when it started and stopped recording. See
+        recording_start. Times are stored as milliseconds since 1970 in the camera's local time.
+        update only reads files that are new or whose size or mtime changed, a few at a time on threads, and drops
+        files that are gone. query uses an index on the start time, so it stays fast with any number of files.
+        A catalog is used from the thread that opened it. Open one per thread, they can share the database file.
+    """
+    VERSION = 1
+    _COLUMNS = ('path', 'type', 'width', 'height', 'size', 'mtime_ns', 'duration', 'first_timestamp',
+                'last_timestamp', 'start_time', 'end_time')
+
+    def __init__(self, database: Optional[Path] = None):
+        self.database = database if database else self.default_path()
+        self.database.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.database)
+        self.connection.row_factory = sqlite3.Row
+        with self.connection:
+            # WAL lets the GUI and CLI read while another process updates.
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            if self.connection.execute('PRAGMA user_version').fetchone()[0] != self.VERSION:
+                self.connection.execute('DROP TABLE IF EXISTS files')
+                self.connection.execute(f'PRAGMA user_version={self.VERSION}')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, type TEXT, width INTEGER, '
+                'height INTEGER, size INTEGER, mtime_ns INTEGER, duration INTEGER, first_timestamp INTEGER, '
+                'last_timestamp INTEGER, start_time INTEGER, end_time INTEGER)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS files_start ON files (start_time)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS files_duration ON files (duration)')
+
+    @staticmethod
+    def default_path():
+        """
+        Return the default catalog database for this platform.
+
+        Returns:
+            pathlib.Path: HXVIDEO_CATALOG if set, otherwise catalog.sqlite under LOCALAPPDATA or XDG_CACHE_HOME
+                          (~/.cache), next to the index cache.
+        """
+        if os.environ.get('HXVIDEO_CATALOG'):
+            return Path(os.environ['HXVIDEO_CATALOG'])
+        if os.name == 'nt' and os.environ.get('LOCALAPPDATA'):
+            return Path(os.environ['LOCALAPPDATA']) / 'HXVideo' / 'catalog.sqlite'
+        return Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'hxvideo' / 'catalog.sqlite'
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    @staticmethod
+    def _prefix(path):
+        # Rows under a directory, as a range on the primary key. chr(0x10FFFF) sorts after any character in a path.
+        prefix = os.path.join(str(path), '')
+        return prefix, prefix + chr(0x10FFFF)
+
+    def update(self, path: Path, max_depth: int = 6, workers: int = 8):
+        """
+        Add, refresh and remove the files under a directory.
+
+        Args:
+            path (pathlib.Path): The directory to catalog.
+            max_depth (int): How many levels of subdirectories to search. See scan_dir. Default is 6.
+            workers (int): Number of files to read at once. Default is 8.
+
+        Returns:
+            dict: Counts of files, with keys 'added', 'updated', 'unchanged', 'removed' and 'failed'.
+        """
+        path = Path(path).resolve()
+        counts = {'added': 0, 'updated': 0, 'unchanged': 0, 'removed': 0, 'failed': 0}
+        known = {row[0]: (row[1], row[2]) for row in self.connection.execute(
+            'SELECT path, size, mtime_ns FROM files WHERE path >= ? AND path < ?', self._prefix(path))}
+        seen = set()
+        changed = {}
+        for entry in scan_dir(path, max_depth):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            seen.add(entry.path)
+            if known.get(entry.path) == (stat.st_size, stat.st_mtime_ns):
+                counts['unchanged'] += 1
+            else:
+                changed[Path(entry.path)] = stat
+
+        rows = []
+        for file_path, info in file_info_batch(changed, workers):
+            if not info or info['type'] not in ('HXVT', 'HXVS'):
+                counts['failed'] += 1
+                seen.discard(str(file_path))
+                continue
+            counts['updated' if str(file_path) in known else 'added'] += 1
+            start = recording_start(file_path, info['duration'])
+            start_time = _to_ms(start) if start else None
+            stat = changed[file_path]
+            rows.append((str(file_path), info['type'], info['width'], info['height'],
+                         stat.st_size, stat.st_mtime_ns, info['duration'], info['first_timestamp'],
+                         info['last_timestamp'], start_time, start_time + info['duration'] if start else None))
+        removed = [(file,) for file in known if file not in seen]
+        counts['removed'] = len(removed)
+        with self.connection:
+            self.connection.executemany(f'INSERT OR REPLACE INTO files VALUES ({", ".join("?" * len(self._COLUMNS))})', rows)
+            self.connection.executemany('DELETE FROM files WHERE path = ?', removed)
+        return counts
+
+    def query(self, start: Optional[datetime] = None, end: Optional[datetime] = None, under: Optional[Path] = None):
+        """
+        Find the files that were recording at any point between two times.
+
+        Args:
+            start (datetime.datetime): The start of the range, in the camera's local time. Default is no limit.
+            end (datetime.datetime): The end of the range. Default is no limit.
+            under (pathlib.Path): Only files in this directory or below it, e.g. one camera's folder. Default is all.
+
+        Returns:
+            list: A dict per file in recording order, with the keys of file_info plus 'path' (pathlib.Path),
+                  'start_time' and 'end_time' (datetime.datetime).
+
+        Notes:
+            Files without a known start time are only returned when neither start nor end is given.
+        """
+        conditions = []
+        parameters = []
+        if end is not None:
+            conditions.append('start_time < ?')
+            parameters.append(_to_ms(end))
+        if start is not None:
+            # A file overlaps the range if it ends after the start. Bounding start_time by the longest file lets the
+            # index on start_time do the work.
+            longest = self.connection.execute('SELECT MAX(duration) FROM files').fetchone()[0] or 0
+            conditions.append('start_time >= ? AND end_time > ?')
+            parameters += [_to_ms(start) - longest, _to_ms(start)]
+        if under is not None:
+            conditions.append('path >= ? AND path < ?')
+            parameters += self._prefix(Path(under).resolve())
+        where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+        results = []
+        for row in self.connection.execute(f'SELECT * FROM files{where} ORDER BY start_time, path', parameters):
+            result = dict(row)
+            result['path'] = Path(result['path'])
+            del result['mtime_ns']
+            for key in ('start_time', 'end_time'):
+                if result[key] is not None:
+                    result[key] = _from_ms(result[key])
+            results.append(result)
+        return results
+
+
+# Largest block data size that is believed when resynchronizing. Key frames of 4K video are well under this.
+MAX_BLOCK_SIZE = 16 * 1024 * 1024
+
+def _block_end(mm, offset, file_size):
+    # Where the block starting at offset ends, or None if its header doesn't look like a real block.
+    if offset + 8 > file_size:
+        return None
+    magic, length = struct.unpack_from('<4sI', mm, offset)
+    if magic == b'HXFI':
+        end = offset + 8 + length
+    elif magic == b'HXVF' or magic == b'HXAF':
+        end = offset + 16 + length
+        if length == 0:
+            return None
+        # Video data always starts with a start code.
+        if magic == b'HXVF' and mm[offset + 16:offset + 19] != b'\x00\x00\x01' and mm[offset + 16:offset + 20] != b'\x00\x00\x00\x01':
+            return None
+    else:
+        return None
+    if length > MAX_BLOCK_SIZE or end > file_size:
+        return None
+    return end
+
+def _valid_block(mm, offset, file_size):
+    # A block is believed if its header is sane and it is followed by the end of the file or another block magic word.
+    end = _block_end(mm, offset, file_size)
+    if end is None:
+        return False
+    return end == file_size or mm[end:end + 4] in (b'HXVF', b'HXAF', b'HXFI')
+
+def _keep_block(mm, offset, file_size):
+    # Whether recovery keeps the block at offset. A valid block is kept. So is one whose own header and size fit in the
+    # file when only the header after it is damaged, unless a believable block starts inside its data, which means its
+    # size is what was damaged.
+    end = _block_end(mm, offset, file_size)
+    if end is None:
+        return False
+    if end == file_size or mm[end:end + 4] in (b'HXVF', b'HXAF', b'HXFI'):
+        return True
+    return _resync(mm, offset + 16, file_size, end) == end
+
+def _resync(mm, offset, file_size, end=None):
+    # Offset of the next believable block at or after offset and before end, or end (default file_size) if there are
+    # none.
+    end = file_size if end is None else end
+    while True:
+        match = _BLOCK_MAGIC.search(mm, offset, end)
+        if match is None:
+            return end
+        if _valid_block(mm, match.start(), file_size):
+            return match.start()
+        offset = match.start() + 1
+
+def _release_pages(mm, released, offset):
+    # Drop the pages of a read only mapping from released up to MAPPED_WINDOW before offset. They stay in the OS page
+    # cache and are loaded again if used. Returns where the next release starts. Does nothing without madvise.
+    release_to = max(released, (offset - MAPPED_WINDOW) // mmap.PAGESIZE * mmap.PAGESIZE)
+    if release_to > released and hasattr(mmap, 'MADV_DONTNEED'):
+        mm.madvise(mmap.MADV_DONTNEED, released, release_to - released)
+    return release_to
+
+def index_file(file_path, recover: bool = False, skipped: Optional[list] = None):
+    """
+    Index a HX file.
+
+    Args:
+        file_path (pathlib.Path): The path to the file to index.
+        recover (bool): Skip over corrupt data instead of stopping at it. Default is False.
+        skipped (list): If given, the (start, end) byte range of each corrupt or truncated part skipped in recovery is
+            appended.
+
+    Returns:
+        BlockIndex: A BlockIndex of the file's blocks, or None if problem.
+
+    Notes:
+        The file is memory mapped and only the 16 byte block headers, plus the NAL header for video blocks, are read.
+        Payloads are never copied. Audio and video blocks are each collected in file order and then merged by timestamp.
+        Pages behind the headers being read are released as it goes, so at most about 2 * MAPPED_WINDOW of the file is
+        held in memory. The index itself is about 35 bytes per block.
+        Possibly change function to take file path or file object. Could be more flexible that way.
+        Without recover, indexing stops at the first unknown block. With recover, every block must have a sane size
+        and be followed by another block or the end of the file. When one isn't, the next block magic word is found
+        with a regex search over the mapped file and checked the same way, so corrupt ranges are skipped at memory
+        speed. A block cut off by the end of the file is skipped too. A block followed by a damaged header is kept,
+        and the skip starts at the damaged header, unless a believable block starts inside it. Then it is its own size
+        that is damaged and it is skipped instead.
+    """
+    # TODO: Figure out if timestamps are universal or specific to block type. Likely useful for audio sync.
+    video = _StreamColumns()  # Each stream's blocks, in file order.
+    audio = _StreamColumns()
+    unpack_header = _BLOCK_HEADER.unpack_from
+
+    try:
+        with file_path.open('rb') as f:
+            magic = f.read(4)
+            if magic not in VIDEO_CODECS:
+                # File should begin with magic word HXVT or HXVS.
+                # If not, return None
+                return None
+            nalu_type = VIDEO_CODECS[magic].nalu_type
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                file_size = len(mm)
+                # Files have a 16 byte header. Specifies file type, height, and width. Skip this.
+                offset = 16
+                released = 0
+                while offset + 16 <= file_size:
+                    if offset - released > 2 * MAPPED_WINDOW:
+                        released = _release_pages(mm, released, offset)
+                    if recover and not _keep_block(mm, offset, file_size):
+                        resync = _resync(mm, offset + 1, file_size)
+                        _skip(skipped, offset, resync)
+                        offset = resync
+                        continue
+                    magic, length, timestamp = unpack_header(mm, offset)
+                    if magic == b'HXVF':
+                        # Only the start code and NAL header are needed to get the unit type.
+                        # unknown_padding (4 bytes) - Seems to be related to type of video frame ?
+                        nal_type = nalu_type(mm[offset + 16:offset + 16 + min(length, 5)])
+                        stream = video
+                    elif magic == b'HXAF':
+                        # unknown_padding (4 bytes), audio_header (4 bytes), audio_data (length - 4)
+                        nal_type = None
+                        stream = audio
+                    elif magic == b'HXFI':
+                        # Possibly a key frame index, see read_hxfi. Most of this block is 0x00.
+                        # There is no timestamp, data starts after the size.
+                        # Always 0x40 0D 03 00 - 200,000 bytes. Don't add these to the index.
+                        offset += 8 + length
+                        continue
+                    else:
+                        # Found unknown block or reached end of file.
+                        break
+                    stream.append(offset, length, timestamp, -1 if nal_type is None else nal_type)
+                    offset += 16 + length
+                if recover and offset < file_size:
+                    # Less than a block header left.
+                    _skip(skipped, offset, file_size)
+    except Exception as e:
+        return None
+
+    return BlockIndex.from_streams(video, audio)
+
+def _skip(skipped, start, end):
+    logger.debug(f'Skipping {end - start} bytes of corrupt data at offset {start}')
+    if skipped is None:
+        return
+    if skipped and skipped[-1][1] == start:
+        skipped[-1] = (skipped[-1][0], end)
+    else:
+        skipped.append((start, end))
+
+# HXFI entries as decoded so far: 32-bit file offset and timestamp of a key frame. Unused entries are zero.
+_HXFI_ENTRY = struct.Struct('<II')
+
+class SeekTable:
+    """
+    Key frame timestamps and the file offsets to start reading from to decode them.
+
+    Attributes:
+        timestamps (array): Timestamp of each key frame, ascending.
+        offsets (array): Offset of the first block of each key frame, usually the parameter sets before the IRAP picture.
+        source (str): 'HXFI' if read from the file's own index, 'index' if built from a scan of the blocks.
+    """
+    def __init__(self, timestamps=None, offsets=None, source='index'):
+        self.timestamps = timestamps if timestamps is not None else array('I')
+        self.offsets = offsets if offsets is not None else array('Q')
+        self.source = source
+
+    @classmethod
+    def from_index(cls, blocks, codec: VideoCodec = HEVC):
+        """
+        Build a seek table from a BlockIndex.
+
+        Args:
+            blocks (BlockIndex): The index of the file.
+            codec (VideoCodec): The video codec of the file. Default is HEVC.
+
+        Returns:
+            SeekTable: A seek point for every IRAP (HEVC NALU type 19) or IDR (H.264 NALU type 5) frame.
+        """
+        table = cls()
+        start = None
+        for i in range(len(blocks)):
+            if blocks.types[i] != 0:
+                continue
+            nalu_type = blocks.nalu_types[i]
+            if start is None:
+                start = i
+            if nalu_type == codec.keyframe_type:
+                # Start from the parameter sets buffered before the IRAP picture.
+                table.timestamps.append(blocks.timestamps[i])
+                table.offsets.append(blocks.offsets[start])
+            if nalu_type in codec.frame_types:
+                start = None
+        return table
+
+    def lookup(self, timestamp):
+        """
+        Find where to start reading to decode from a timestamp.
+
+        Args:
+            timestamp (int): The camera timestamp to seek to.
+
+        Returns:
+            tuple: (timestamp, offset) of the last key frame at or before the timestamp, or the first key frame if the
+                   timestamp is before it. None if the table is empty.
+        """
+        if not self.timestamps:
+            return None
+        i = max(bisect.bisect_right(self.timestamps, timestamp) - 1, 0)
+        return self.timestamps[i], self.offsets[i]
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __repr__(self):
+        return f'<SeekTable {len(self)} key frames from {self.source}>'
+
+def _find_hxfi(mm):
+    # Check straight after the file header, then the end of the file. Only where the block can be found without a
+    # scan is useful for seeking.
+    size = len(mm)
+    candidates = [16]
+    tail = mm.rfind(b'HXFI', max(16, size - TAIL_WINDOW))
+    if tail != -1:
+        candidates.append(tail)
+    for offset in candidates:
+        if offset + 8 <= size and mm[offset:offset + 4] == b'HXFI':
+            length = struct.unpack_from('<I', mm, offset + 4)[0]
+            if length % _HXFI_ENTRY.size == 0 and offset + 8 + length <= size:
+                return offset
+    return None
+
+def read_hxfi(file_path: Path):
+    """
+    Read the HXFI block of a HX file as a seek table.
+
+    Args:
+        file_path (pathlib.Path): The path to the HX file.
+
+    Returns:
+        SeekTable: The key frames listed in the HXFI block, or None if there isn't one or it can't be decoded.
+
+    Notes:
+        The HXFI layout isn't documented. It is decoded as 8 byte entries of 32-bit offset and timestamp, ending at the
+        first empty entry. Every entry is checked to point at a HXVF block header with the same timestamp and a key
+        frame NAL unit. If any entry fails the layout is assumed to be different and None is returned.
+        Only the HXFI block and the block headers it points to are read.
+    """
+    try:
+        with file_path.open('rb') as f:
+            codec = VIDEO_CODECS.get(f.read(4))
+            if codec is None:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                hxfi_offset = _find_hxfi(mm)
+                if hxfi_offset is None:
+                    return None
+                length = struct.unpack_from('<I', mm, hxfi_offset + 4)[0]
+                table = SeekTable(source='HXFI')
+                for offset, timestamp in _HXFI_ENTRY.iter_unpack(mm[hxfi_offset + 8:hxfi_offset + 8 + length]):
+                    if offset == 0 and timestamp == 0:
+                        break
+                    if offset + 21 > len(mm) or (table.offsets and offset <= table.offsets[-1]):
+                        logger.debug(f'HXFI entry out of range or order in {file_path}: {offset}')
+                        return None
+                    magic, _, block_ts = _BLOCK_HEADER.unpack_from(mm, offset)
+                    if magic != b'HXVF' or block_ts != timestamp or codec.nalu_type(mm[offset + 16:offset + 21]) not in codec.seek_types:
+                        logger.debug(f'HXFI entry does not point to a key frame in {file_path}: {offset}')
+                        return None
+                    table.timestamps.append(timestamp)
+                    table.offsets.append(offset)
+    except (OSError, ValueError, struct.error) as e:
+        logger.debug(f'Could not read HXFI block of {file_path}: {e}')
+        return None
+    return table if table else None
+
+def validate_seek_table(table: SeekTable, blocks: BlockIndex, codec: VideoCodec = HEVC):
+    """
+    Check a seek table against a full scan of the file.
+
+    Args:
+        table (SeekTable): The seek table to check, usually from read_hxfi.
+        blocks (BlockIndex): The index of the same file.
+        codec (VideoCodec): The video codec of the file. Default is HEVC.
+
+    Returns:
+        bool: True if every entry of the table is a key frame found by the scan.
+    """
+    scanned = SeekTable.from_index(blocks, codec)
+    scanned = set(zip(scanned.timestamps, scanned.offsets))
+    return all(entry in scanned for entry in zip(table.timestamps, table.offsets))
+
+def get_seek_table(file_path: Path):
+    """
+    Return a seek table for a HX file, as cheaply as possible.
+
+    Args:
+        file_path (pathlib.Path): The path to the HX file.
+
+    Returns:
+        SeekTable: From the file's HXFI block if it can be decoded, otherwise built from the file's index. None if
+                   the file can't be indexed.
+    """
+    table = read_hxfi(file_path)
+    if table:
+        return table
+    blocks = get_index(file_path)
+    if not blocks:
+        return None
+    return SeekTable.from_index(blocks, file_codec(file_path))
+
+def find_keyframe(file_path: Path, timestamp: int):
+    """
+    Find the key frame to start reading from to get to a timestamp, without reading the whole file if possible.
+
+    Args:
+        file_path (pathlib.Path): The path to the HX file.
+        timestamp (int): The camera timestamp to seek to.
+
+    Returns:
+        tuple: (timestamp, offset) of the last key frame at or before the timestamp. Blocks can be read from the offset
+               with iter_blocks. None if the file has no key frames.
+    """
+    table = get_seek_table(file_path)
+    if not table:
+        return None
+    return table.lookup(timestamp)
+
+# A second is active when its non key frame video is this many times the file's median. Static scenes give tiny
+# P-frames, so their size follows the amount of motion.
+ACTIVITY_THRESHOLD = 3.0
+# Active seconds less than this many milliseconds apart are joined into one window.
+ACTIVITY_MERGE_GAP = 5000
+
+@dataclass
+class ActivityTimeline:
+    """
+    Per bucket video statistics of a HX file, worked out from its index without decoding. See activity_timeline.
+
+    Attributes:
+        bucket (int): Milliseconds covered by each entry of the per bucket columns.
+        duration (int): Milliseconds from the first block to the last.
+        video_bytes (array): Video bytes in each bucket, including key frames and parameter sets.
+        motion_bytes (array): Bytes of the non key frames in each bucket.
+        frames (array): Video frames in each bucket.
+        keyframes (array): Time of each key frame in milliseconds from the start of the file.
+    """
+    bucket: int
+    duration: int
+    video_bytes: array
+    motion_bytes: array
+    frames: array
+    keyframes: array
+
+    def bitrate(self):
+        """Video bitrate of each bucket in bits per second."""
+        scale = 8000 / self.bucket
+        return [size * scale for size in self.video_bytes]
+
+    def fps(self):
+        """Frame rate of each bucket."""
+        scale = 1000 / self.bucket
+        return [count * scale for count in self.frames]
+
+    def keyframe_intervals(self):
+        """Milliseconds between each key frame and the one before it."""
+        return list(map(operator.sub, self.keyframes[1:], self.keyframes))
+
+    def baseline(self):
+        """Median motion_bytes of the buckets that have video. Used to judge activity."""
+        values = sorted(size for size, count in zip(self.motion_bytes, self.frames) if count)
+        if not values:
+            return 0
+        return values[len(values) // 2]
+
+    def active_windows(self, threshold: float = ACTIVITY_THRESHOLD, merge_gap: int = ACTIVITY_MERGE_GAP, min_length: int = 0):
+        """
+        Find the stretches of the file with more motion than usual.
+
+        Args:
+            threshold (float): How many times the baseline a bucket's motion_bytes must reach. Default is ACTIVITY_THRESHOLD.
+            merge_gap (int): Join active buckets less than this many milliseconds apart. Default is ACTIVITY_MERGE_GAP.
+            min_length (int): Leave out windows shorter than this many milliseconds. Default is 0.
+
+        Returns:
+            list: (start, end, peak) tuples in order. start and end are milliseconds from the start of the file and
+                  peak is the highest motion_bytes in the window as a multiple of the baseline.
+        """
+        baseline = max(self.baseline(), 1)
+        limit = baseline * threshold
+        windows = []
+        for i, size in enumerate(self.motion_bytes):
+            if size < limit:
+                continue
+            start = i * self.bucket
+            end = start + self.bucket
+            if windows and start - windows[-1][1] < merge_gap:
+                windows[-1][1] = end
+                windows[-1][2] = max(windows[-1][2], size)
+            else:
+                windows.append([start, end, size])
+        return [(start, min(end, self.duration), peak / baseline) for start, end, peak in windows if end - start >= min_length]
+
+    def as_dict(self, threshold: float = ACTIVITY_THRESHOLD, merge_gap: int = ACTIVITY_MERGE_GAP):
+        """
+        Return the timeline as plain lists, for JSON.
+
+        Returns:
+            dict: Keys 'bucket', 'duration', 'bitrate', 'fps', 'keyframes', 'keyframe_intervals', 'baseline',
+                  'active_windows'.
+        """
+        return {'bucket': self.bucket, 'duration': self.duration, 'bitrate': self.bitrate(), 'fps': self.fps(),
+                'keyframes': list(self.keyframes), 'keyframe_intervals': self.keyframe_intervals(),
+                'baseline': self.baseline(),
+                'active_windows': [list(window) for window in self.active_windows(threshold, merge_gap)]}
+
+# Translate tables from a block type, or a NAL unit type stored as a signed byte, to 1 if it is wanted, else 0.
+_VIDEO_MASK = bytes([1]) + bytes(255)
+
+@functools.lru_cache()
+def _nalu_mask(nalu_types):
+    return bytes(int((value if value < 128 else value - 256) in nalu_types) for value in range(256))
+
+def activity_timeline(file_path: Path, bucket: int = 1000):
+    """
+    Work out a file's bitrate, frame rate and key frames over time from its index, without decoding any video.
+
+    Args:
+        file_path (pathlib.Path): The path to the HX file.
+        bucket (int): Milliseconds per bucket. Default is 1 second.
+
+    Returns:
+        ActivityTimeline: The timeline, or None if the file can't be indexed.
+
+    Notes:
+        Uses the cached index if there is one. Nothing loops over the blocks in Python. Masks of the video blocks,
+        frames and key frames are made from the index's byte columns with bytes.translate. As the index is in timestamp
+        order each bucket is a slice of it, found with a binary search on the timestamps, and summed with
+        itertools.compress and bytes.count. NumPy isn't a dependency, so this uses arrays and itertools. Only the
+        buckets are looped over.
+        Each video block of a frame type is counted as a frame. The cameras write one slice per frame.
+    """
+    blocks = get_index(file_path)
+    if not blocks:
+        return None
+    codec = file_codec(file_path)
+    timestamps = blocks.relative_ts
+    duration = timestamps[-1] if len(blocks) else 0
+    count = duration // bucket + 1
+
+    # One byte per block, 1 where it is a video block, a frame, a key frame, or a frame that isn't a key frame. Only
+    # the last change with motion. Audio blocks have no NAL unit type (-1), so are never frames.
+    is_video = blocks.types.tobytes().translate(_VIDEO_MASK)
+    nalu_types = blocks.nalu_types.tobytes()
+    is_frame = nalu_types.translate(_nalu_mask(codec.frame_types))
+    is_keyframe = nalu_types.translate(_nalu_mask((codec.keyframe_type,)))
+    is_motion = nalu_types.translate(_nalu_mask(tuple(value for value in codec.frame_types if value != codec.keyframe_type)))
+
+    sizes = blocks.sizes
+    video_bytes = array('Q', bytes(8 * count))
+    motion_bytes = array('Q', bytes(8 * count))
+    frames = array('I', bytes(4 * count))
+    start = 0
+    for i in range(count):
+        # Blocks of this bucket.
+        end = bisect.bisect_left(timestamps, (i + 1) * bucket, start)
+        video_bytes[i] = sum(compress(sizes[start:end], is_video[start:end]))
+        motion_bytes[i] = sum(compress(sizes[start:end], is_motion[start:end]))
+        frames[i] = is_frame.count(1, start, end)
+        start = end
+    keyframes = array('q', compress(timestamps, is_keyframe))
+    return ActivityTimeline(bucket, duration, video_bytes, motion_bytes, frames, keyframes)
+
+# A video frame or block of audio ready to be muxed. type is the block type it was built from.
+@dataclass
+class MediaPacket:
+    type: str
+    pts: int
+    duration: int
+    data: bytes
+    keyframe: bool = False
+
+class RewrapStats:
+    """
+    Where the time goes in a rewrap, and how much was read and written.
+
+    Pass one to rewrap_file to fill it in. Nothing is measured when it isn't given.
+
+    Attributes:
+        stages (dict): Stage name to [wall seconds, CPU seconds]. Each stage only counts its own time, not the time of the
+            stages it pulls from. The stages are:
+            index - building or loading the block index or seek table.
+            read - reading and parsing blocks from disk.
+            order - putting blocks read in file order into timestamp order (streaming and clips).
+            packetize - joining NAL units into frames and converting audio from A-law.
+            open - opening the output container and its streams.
+            mux - writing packets with container.mux_one, and closing the output.
+        bytes_read (int): Bytes of blocks read, headers included.
+        blocks_read (int): Blocks read.
+        blocks_skipped (int): Blocks read but left out of the output, like the ones outside a clip.
+        video_packets (int): Video frames written.
+        audio_packets (int): Audio packets written.
+        packet_bytes (int): Payload bytes of the packets written.
+        bytes_copied (int): Payload bytes copied on the way from the file to the muxer. Reading a block into a new bytes
+            object, joining NAL units or converting audio into a new buffer, and copying that into an av.Packet each
+            count once. See packetize_mapped for the path that copies each payload once.
+    """
+    def __init__(self):
+        self.stages = {}
+        self.bytes_read = 0
+        self.blocks_read = 0
+        self.blocks_skipped = 0
+        self.video_packets = 0
+        self.audio_packets = 0
+        self.packet_bytes = 0
+        self.bytes_copied = 0
+        self._stack = []
+        self._wall = 0.0
+        self._cpu = 0.0
+
+    def _charge(self):
+        # Charge the time since the last switch to the stage on top of the stack.
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        if self._stack:
+            totals = self._stack[-1]
+            totals[0] += wall - self._wall
+            totals[1] += cpu - self._cpu
+        self._wall = wall
+        self._cpu = cpu
+
+    def _totals(self, name):
+        return self.stages.setdefault(name, [0.0, 0.0])
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a block of code as a stage. Stages timed inside it are not counted towards it.
+        """
+        self._charge()
+        self._stack.append(self._totals(name))
+        try:
+            yield
+        finally:
+            self._charge()
+            self._stack.pop()
+
+    def timed(self, iterable, name):
+        """
+        Time getting each item of an iterable as a stage.
+
+        Yields:
+            The items of the iterable.
+        """
+        # Called for every block and packet, so this is stage() written out.
+        iterator = iter(iterable)
+        totals = self._totals(name)
+        charge = self._charge
+        stack = self._stack
+        while True:
+            charge()
+            stack.append(totals)
+            item = next(iterator, _END)
+            charge()
+            stack.pop()
+            if item is _END:
+                return
+            yield item
+
+    def timed_blocks(self, blocks, name='read'):
+        """
+        Time and count (Block, bytes) tuples read from disk.
+        """
+        for block, data in self.timed(blocks, name):
+            self.blocks_read += 1
+            self.bytes_read += 16 + len(data)
+            self.bytes_copied += len(data)
+            yield block, data
+
+    def timed_packets(self, packets, name='packetize'):
+        """
+        Time and count MediaPackets on their way to be muxed.
+        """
+        for packet in self.timed(packets, name):
+            if packet.type == 'HXVF':
+                self.video_packets += 1
+            else:
+                self.audio_packets += 1
+            # Built straight into an av.Packet, or built in a buffer and copied into one when muxed.
+            if isinstance(packet.data, av.packet.Packet):
+                size = packet.data.size
+                self.bytes_copied += size
+            else:
+                size = len(packet.data)
+                self.bytes_copied += 2 * size
+            self.packet_bytes += size
+            yield packet
+
+    def as_dict(self):
+        """
+        Returns:
+            dict: The stats as plain types, for JSON or to pass between processes.
+        """
+        return {
+            'stages': {name: {'wall': round(wall, 6), 'cpu': round(cpu, 6)} for name, (wall, cpu) in self.stages.items()},
+            'wall': round(sum(wall for wall, _ in self.stages.values()), 6),
+            'cpu': round(sum(cpu for _, cpu in self.stages.values()), 6),
+            'bytes_read': self.bytes_read,
+            'blocks_read': self.blocks_read,
+            'blocks_skipped': self.blocks_skipped,
+            'video_packets': self.video_packets,
+            'audio_packets': self.audio_packets,
+            'packet_bytes': self.packet_bytes,
+            'bytes_copied': self.bytes_copied,
+        }
+
+    def __repr__(self):
+        return f'RewrapStats({self.as_dict()})'
+
+def combine_stats(stats):
+    """
+    Add up stats from RewrapStats.as_dict, such as every file of a batch.
+
+    Args:
+        stats (iterable): RewrapStats dicts. None is skipped.
+
+    Returns:
+        dict: The totals, in the same layout with a 'files' count added.
+    """
+    total = {'stages': {}, 'wall': 0.0, 'cpu': 0.0, 'bytes_read': 0, 'blocks_read': 0, 'blocks_skipped': 0,
+             'video_packets': 0, 'audio_packets': 0, 'packet_bytes': 0, 'bytes_copied': 0, 'files': 0}
+    for item in stats:
+        if not item:
+            continue
+        for name, times in item['stages'].items():
+            stage = total['stages'].setdefault(name, {'wall': 0.0, 'cpu': 0.0})
+            stage['wall'] = round(stage['wall'] + times['wall'], 6)
+            stage['cpu'] = round(stage['cpu'] + times['cpu'], 6)
+        for key in ('wall', 'cpu'):
+            total[key] = round(total[key] + item[key], 6)
+        for key in ('bytes_read', 'blocks_read', 'blocks_skipped', 'video_packets', 'audio_packets', 'packet_bytes', 'bytes_copied'):
+            total[key] += item.get(key, 0)
+        total['files'] += item.get('files', 1)
+    return total
+
+# Marks the end of an iterator in RewrapStats.timed.
+_END = object()
+
+# With no stats these return what they're given, so an unmeasured rewrap runs exactly as before.
+def _stage(stats, name):
+    return nullcontext() if stats is None else stats.stage(name)
+
+def _timed_blocks(stats, blocks):
+    return blocks if stats is None else stats.timed_blocks(blocks)
+
+def _timed_packets(stats, packets):
+    return packets if stats is None else stats.timed_packets(packets)
+
+def read_header(f):
+    """
+    Read the 16 byte header of a HX file.
+
+    Args:
+        f (file): A binary file object positioned at the start of the file.
+
+    Returns:
+        tuple: (magic, width, height), or None if the header is incomplete.
+    """
+    header = _read_exact(f, 16)
+    if len(header) < 16:
+        return None
+    magic, width, height = struct.unpack_from('<4sII', header)
+    return magic, width, height
+
+def _read_exact(f, size):
+    # Pipes and sockets can return less than asked for. Keep reading until we have it all or reach the end.
+    data = f.read(size)
+    if len(data) == size or not data:
+        return data
+    chunks = [data]
+    remaining = size - len(data)
+    while remaining:
+        data = f.read(remaining)
+        if not data:
+            break
+        chunks.append(data)
+        remaining -= len(data)
+    return b''.join(chunks)
+
+def iter_blocks(f, offset: int = 16, codec: VideoCodec = HEVC):
+    """
+    Read the blocks of a HX file in a single forward pass.
+
+    Args:
+        f (file): A binary file object positioned after the file header. Does not need to be seekable.
+        offset (int): The offset f is positioned at. Only used to fill in Block.offset. Default is 16.
+        codec (VideoCodec): The video codec of the file, to read NAL unit types. Default is HEVC.
+
+    Yields:
+        tuple: (Block, bytes) for each HXVF and HXAF block in file order. The bytes are the block data.
+
+    Notes:
+        Stops at the first unknown block or the end of the file. HXFI blocks are read past and not returned.
+        The blocks do not have relative_ts or duration set. See order_blocks.
+    """
+    while True:
+        header = _read_exact(f, 8)
+        if len(header) < 8:
+            return
+        magic, length = struct.unpack('<4sI', header)
+        if magic == b'HXFI':
+            # Unknown file index block. Read past it, the input may not be seekable.
+            remaining = length
+            while remaining:
+                skipped = len(f.read(min(remaining, STREAM_BUFFER_SIZE)))
+                if not skipped:
+                    return
+                remaining -= skipped
+            offset += 8 + length
+            continue
+        if magic != b'HXVF' and magic != b'HXAF':
+            # Found unknown block or reached end of file.
+            return
+        header = _read_exact(f, 8)
+        if len(header) < 8:
+            return
+        timestamp = struct.unpack_from('<I', header)[0]
+        data = _read_exact(f, length)
+        if magic == b'HXVF':
+            block = Block('HXVF', offset, length, timestamp, nalu_type=codec.nalu_type(data[:5]))
+        else:
+            block = Block('HXAF', offset, length, timestamp)
+        yield block, data
+        offset += 16 + length
+
+def order_blocks(blocks, window: int = REORDER_WINDOW):
+    """
+    Put blocks read in file order into timestamp order, filling in relative_ts and duration.
+
+    Args:
+        blocks (iterable): (Block, bytes) tuples in file order, such as from iter_blocks.
+        window (int): How far in milliseconds audio may trail video in the file. Default is REORDER_WINDOW.
+
+    Yields:
+        tuple: (Block, bytes) in the same order index_file would sort them.
+
+    Notes:
+        Audio blocks trail video blocks in the file, but each stream is in timestamp order. A block is released once
+        the newest block of both streams is later than it, or once it is older than window. Only the blocks inside
+        that window are held in memory.
+        The last block of each type is held until the next one arrives to calculate its duration.
+    """
+    heap = []
+    pending = {}    # Newest block of each type, waiting for its duration.
+    newest_ts = None
+    initial_ts = None
+    for block, data in blocks:
+        previous = pending.get(block.type)
+        if previous:
+            previous[0].duration = block.timestamp - previous[0].timestamp
+            heapq.heappush(heap, (previous[0].timestamp, previous[0].offset, previous))
+        pending[block.type] = (block, data)
+        if newest_ts is None or block.timestamp > newest_ts:
+            newest_ts = block.timestamp
+
+        # Nothing later in either stream can come before the oldest of the pending blocks.
+        bound = min((b.timestamp, b.offset) for b, _ in pending.values()) if len(pending) == len(_BLOCK_TYPES) else None
+        while heap and ((bound and heap[0][:2] < bound) or newest_ts - heap[0][0] > window):
+            item = heapq.heappop(heap)[2]
+            if initial_ts is None:
+                initial_ts = item[0].timestamp
+            item[0].relative_ts = item[0].timestamp - initial_ts
+            yield item
+
+    for item in pending.values():
+        heapq.heappush(heap, (item[0].timestamp, item[0].offset, item))
+    while heap:
+        item = heapq.heappop(heap)[2]
+        if initial_ts is None:
+            initial_ts = item[0].timestamp
+        item[0].relative_ts = item[0].timestamp - initial_ts
+        yield item
+
+def read_blocks(f, blocks):
+    """
+    Read the data of indexed blocks.
+
+    Args:
+        f (file): A seekable binary file object of the HX file.
+        blocks (BlockIndex): The blocks to read.
+
+    Yields:
+        tuple: (Block, bytes) for each block, in index order.
+    """
+    for block in blocks:
+        f.seek(block.offset + 16) # Skip 4 byte header, size, timestamp, and 4 byte unknown data.
+        yield block, f.read(block.size)
+
+# Audio is 8000Hz A-law, one byte per sample.
+AUDIO_SAMPLES_PER_MS = 8
+
+# How far an audio block's timestamp can be from where the audio before it ends and still be joined onto it.
+AUDIO_GAP_TOLERANCE = 10
+
+def packetize(blocks, codec: VideoCodec = HEVC, audio_packet_ms: int = 0):
+    """
+    Turn ordered blocks into packets ready to be muxed.
+
+    Args:
+        blocks (iterable): (Block, bytes) tuples in timestamp order with relative_ts and duration set.
+        codec (VideoCodec): The video codec of the blocks. Default is HEVC.
+        audio_packet_ms (int): Join audio blocks into packets of about this many milliseconds. Default is 0 to keep
+            each 20ms block as its own packet.
+
+    Yields:
+        MediaPacket: A complete video frame or converted block of audio.
+
+    Notes:
+        Video typically has NALU types 32, 33, and 34 that directly proceed type 19. All share the same timestamp.
+        These are buffered and packetized with the video frame data. H.264 is the same with SPS and PPS (7 and 8)
+        before IDR frames (5).
+        Joined audio is converted from A-law in one call. A block only joins the packet before it if it starts where
+        that packet's samples end, within AUDIO_GAP_TOLERANCE. After a gap a new packet starts at the block's own
+        timestamp, so audio stays in sync with the video.
+    """
+    video_buffer = bytearray()
+    video_duration = -1
+    audio_buffer = []   # A-law data of the audio blocks being joined.
+    audio_start = 0
+    audio_samples = 0
+    for block, data in blocks:
+        if block.type == 'HXAF':
+            if audio_packet_ms <= 0:
+                # Skip the 4 byte audio data header.
+                yield MediaPacket('HXAF', block.relative_ts, -1, alaw_to_pcm16(data[4:]))
+                continue
+            if audio_buffer and (abs(block.relative_ts - (audio_start + audio_samples // AUDIO_SAMPLES_PER_MS)) > AUDIO_GAP_TOLERANCE
+                                 or audio_samples >= audio_packet_ms * AUDIO_SAMPLES_PER_MS):
+                yield _audio_packet(audio_start, audio_buffer)
+                audio_buffer = []
+            if not audio_buffer:
+                audio_start = block.relative_ts
+                audio_samples = 0
+            audio_buffer.append(data[4:])
+            audio_samples += len(data) - 4
+        elif block.type == 'HXVF':
+            video_buffer += data
+            if block.nalu_type not in codec.frame_types:
+                # Buffer this data. Will be Packetized and muxed later with video frame data.
+                continue
+            # Nothing follows the last frame to time it. Assume it lasts as long as the one before it.
+            if block.duration != -1:
+                video_duration = block.duration
+            yield MediaPacket('HXVF', block.relative_ts, video_duration, video_buffer, block.nalu_type == codec.keyframe_type)
+            video_buffer = bytearray()
+    if audio_buffer:
+        yield _audio_packet(audio_start, audio_buffer)
+
+def _audio_packet(pts, alaw_data):
+    # One packet for the A-law data of several joined audio blocks, converted in one call.
+    data = b''.join(alaw_data)
+    return MediaPacket('HXAF', pts, len(data) // AUDIO_SAMPLES_PER_MS, alaw_to_pcm16(data))
+
+def _alaw_packet(alaw_data):
+    # Convert A-law straight into a new av.Packet, interleaving the low and high bytes into it.
+    data = alaw_data[0] if len(alaw_data) == 1 else b''.join(alaw_data)
+    packet = av.packet.Packet(len(data) * 2)
+    with memoryview(packet) as target:
+        target[0::2] = data.translate(_ALAW_TO_PCM16_LOW)
+        target[1::2] = data.translate(_ALAW_TO_PCM16_HIGH)
+    return packet
+
+def packetize_mapped(mm, blocks: BlockIndex, codec: VideoCodec = HEVC, audio_packet_ms: int = 0):
+    """
+    Build packets straight from a memory mapped HX file, copying each frame's data once.
+
+    Args:
+        mm (mmap.mmap): The file, mapped for reading.
+        blocks (BlockIndex): The index of the file, from index_file or get_index.
+        codec (VideoCodec): The video codec of the file. Default is HEVC.
+        audio_packet_ms (int): Join audio blocks into packets of about this many milliseconds. Default is 0 to keep
+            each 20ms block as its own packet.
+
+    Yields:
+        MediaPacket: The same packets as packetize, except data is an av.Packet ready to be muxed.
+
+    Notes:
+        The NAL units of a frame are memoryview slices of the mapping until they are copied, once, into an av.Packet
+        of the frame's size. Audio is converted from A-law straight into its av.Packet. Compare packetize, where each
+        block is read into a bytes object, joined into a bytearray and copied again into the av.Packet.
+        Pages more than MAPPED_WINDOW behind are released as it goes, so at most about 2 * MAPPED_WINDOW of the file is
+        held in memory. Only the index, which the caller holds, grows with the file.
+        Blocks in timestamp order only go back in the file by the audio lag, far less than MAPPED_WINDOW.
+    """
+    view = memoryview(mm)
+    units = []          # Slices of the mapping for the NAL units of the frame being built.
+    units_size = 0
+    video_duration = -1
+    audio_buffer = []   # A-law data of the audio blocks being joined.
+    audio_start = 0
+    audio_samples = 0
+    released = 0
+    try:
+        for block_type, offset, size, nalu_type, relative_ts, duration in zip(blocks.types, blocks.offsets, blocks.sizes, blocks.nalu_types, blocks.relative_ts, blocks.durations):
+            start = offset + 16
+            if offset - released > 2 * MAPPED_WINDOW:
+                released = _release_pages(mm, released, offset)
+            if block_type:
+                # Skip the 4 byte audio data header. Slicing the mmap gives bytes, which translate needs.
+                if audio_packet_ms <= 0:
+                    yield MediaPacket('HXAF', relative_ts, -1, _alaw_packet((mm[start + 4:start + size],)))
+                    continue
+                if audio_buffer and (abs(relative_ts - (audio_start + audio_samples // AUDIO_SAMPLES_PER_MS)) > AUDIO_GAP_TOLERANCE
+                                     or audio_samples >= audio_packet_ms * AUDIO_SAMPLES_PER_MS):
+                    yield MediaPacket('HXAF', audio_start, audio_samples // AUDIO_SAMPLES_PER_MS, _alaw_packet(audio_buffer))
+                    audio_buffer = []
+                if not audio_buffer:
+                    audio_start = relative_ts
+                    audio_samples = 0
+                audio_buffer.append(mm[start + 4:start + size])
+                audio_samples += size - 4
+                continue
+            units.append(view[start:start + size])
+            units_size += size
+            if nalu_type not in codec.frame_types:
+                continue
+            if duration != -1:
+                video_duration = duration
+            packet = av.packet.Packet(units_size)
+            with memoryview(packet) as target:
+                position = 0
+                for unit in units:
+                    target[position:position + len(unit)] = unit
+                    position += len(unit)
+                    unit.release()
+            units = []
+            units_size = 0
+            yield MediaPacket('HXVF', relative_ts, video_duration, packet, nalu_type == codec.keyframe_type)
+        if audio_buffer:
+            yield MediaPacket('HXAF', audio_start, audio_samples // AUDIO_SAMPLES_PER_MS, _alaw_packet(audio_buffer))
+    finally:
+        # The mapping can't be closed while any slice of it is alive.
+        for unit in units:
+            unit.release()
+        view.release()
+
+# PyAV 15 can copy codec parameters from a stream without opening an encoder. Older versions always open one.
+STREAM_COPY = int(av.__version__.split('.')[0]) >= 15
+
+# Packets read ahead looking for the first video frame, for its parameter sets. Only audio can come before it.
+_HEADER_PACKETS = 500
+
+def _parameter_sets(data, codec=HEVC):
+    # The parameter set NAL units of an Annex B access unit, or None if it has none.
+    units = [unit for unit in split_nal_units(data) if unit and codec.unit_type(unit) in codec.parameter_set_types]
+    return b''.join(b'\x00\x00\x00\x01' + unit for unit in units) or None
+
+def peek_parameter_sets(packets, codec: VideoCodec = HEVC, limit: int = _HEADER_PACKETS):
+    """
+    Find the parameter sets of the first video frame of a packet stream.
+
+    Args:
+        packets (iterable): MediaPackets, such as from packetize.
+        codec (VideoCodec): The video codec of the packets. Default is HEVC.
+        limit (int): How many packets to read ahead for the first video frame. Default is _HEADER_PACKETS.
+
+    Returns:
+        tuple: (parameter_sets, packets). parameter_sets is the Annex B VPS, SPS and PPS (SPS and PPS for H.264),
+               or None if they weren't found. packets is an iterator of every packet, including the ones read ahead.
+    """
+    packets = iter(packets)
+    buffered = []
+    for packet in packets:
+        buffered.append(packet)
+        if packet.type == 'HXVF':
+            return _parameter_sets(packet.data, codec), chain(buffered, packets)
+        if len(buffered) >= limit:
+            break
+    return None, chain(buffered, packets)
+
+@functools.lru_cache(maxsize=8)
+def _copy_template(parameter_sets, codec_name='hevc'):
+    # Probe the parameter sets as a raw video stream to get codec parameters to copy. This is the slow part of opening
+    # a copy stream, and a camera sends the same parameter sets in every file.
+    container = av.open(io.BytesIO(parameter_sets), format=codec_name)
+    return container, container.streams.video[0]
+
+def _open_output(output_file, format, width, height, parameter_sets=None, codec=HEVC, options=None, audio_codec='pcm_s16le'):
+    container = av.open(output_file, 'w', format=OUTPUT_FORMATS[format], options=options or {})
+    if parameter_sets and STREAM_COPY:
+        # Copy the video as is. The stream header is built from the camera's own parameter sets and only a decoder
+        # context is opened, which does nothing without packets.
+        video_stream = container.add_stream_from_template(_copy_template(parameter_sets, codec.name)[1], opaque=True)
+        video_stream.codec_context.thread_count = 1
+    else:
+        # Older PyAV needs an encoder to add a video stream. It is never used, so open it without any thread pools.
+        video_stream = container.add_stream(codec.encoder, rate=15, options=codec.encoder_options) # Default to 15fps for now. Our samples were VFR so we will use PTS/DTS.
+        video_stream.pix_fmt = "yuv420p"
+    if audio_codec == 'pcm_s16le':
+        audio_stream = container.add_stream('pcm_s16le', rate=8000, layout='mono', format='s16')
+    else:
+        # Encoded audio, for players that can't take PCM. The encoder picks its own sample format.
+        audio_stream = container.add_stream(audio_codec, rate=8000, layout='mono')
+
+    # Set video parameters.
+    video_stream.time_base = Fraction(1, 1000)
+    video_stream.width = width
+    video_stream.height = height
+    if parameter_sets and not STREAM_COPY:
+        # The encoder puts its own parameter sets in the header when it is opened. Open it now and replace them.
+        video_stream.codec_context.open()
+        video_stream.codec_context.extradata = parameter_sets
+
+    # Set audio parameters.
+    audio_stream.time_base = Fraction(1, 1000)
+    audio_stream.rate = 8000
+    audio_stream.layout = 'mono'
+    if audio_codec == 'pcm_s16le':
+        audio_stream.format = 's16'
+    #audio_stream.frame_size = 160 # 20ms of audio at 8000Hz
+    return container, video_stream, audio_stream
+
+def _av_packet(media_packet, stream, packet=None):
+    # packetize_mapped has already built the av.Packet. A packet already given to another output is reused as is, the
+    # muxer only rescales its timing, which is set again below.
+    if packet is None:
+        packet = media_packet.data if isinstance(media_packet.data, av.packet.Packet) else av.packet.Packet(media_packet.data)
+    packet.time_base = Fraction(1, 1000)
+    packet.pts = media_packet.pts
+    packet.dts = media_packet.pts
+    if media_packet.duration != -1:
+        packet.duration = media_packet.duration
+    if media_packet.keyframe:
+        packet.is_keyframe = True
+    packet.stream = stream
+    return packet
+
+def _mux_packets(container, video_stream, audio_stream, packets, packet_hashes=None, hash_algorithm='sha256', codec=HEVC):
+    _mux_outputs([(container, video_stream, audio_stream)], packets, packet_hashes, hash_algorithm, codec)
+
+def _mux_outputs(outputs, packets, packet_hashes=None, hash_algorithm='sha256', codec=HEVC):
+    # Each packet is built once and muxed into every output. The muxers take their own reference to its data, so
+    # another output costs no copy.
+    for media_packet in packets:
+        video = media_packet.type == 'HXVF'
+        if packet_hashes is not None and video:
+            packet_hashes.append(access_unit_hash(media_packet.data, hash_algorithm, codec=codec))
+        packet = None
+        for container, video_stream, audio_stream in outputs:
+            packet = _av_packet(media_packet, video_stream if video else audio_stream, packet)
+            container.mux_one(packet)
+
+def _output_targets(input_file, output_file, format):
+    # Pair each output with its format. Either can be a list, to write several outputs in one pass.
+    formats = [format] if isinstance(format, str) else list(format)
+    if output_file is None:
+        outputs = [input_file.with_suffix('.' + name) for name in formats]
+    elif isinstance(output_file, (list, tuple)):
+        outputs = list(output_file)
+        if len(formats) == 1:
+            # Take each format from its file extension, falling back to the one given.
+            formats = [path.suffix[1:] if path.suffix[1:] in OUTPUT_FORMATS else formats[0] for path in outputs]
+    else:
+        outputs = [output_file]
+    for name in formats:
+        if name not in OUTPUT_FORMATS:
+            raise ValueError('Invalid output format. Please use one of the following: ' + ', '.join(OUTPUT_FORMATS))
+    if not outputs or len(outputs) != len(formats):
+        raise ValueError('Invalid outputs. Give one output file for each format, or none.')
+    if len(set(outputs)) != len(outputs):
+        raise ValueError('Invalid outputs. The same output file is given more than once.')
+    return list(zip(outputs, formats))
+
+def rewrap_file(input_file: Path, output_file: Optional[Path] = None, format: str = 'mkv', overwrite: bool = False, debug: bool = False, streaming: bool = False, packet_hashes: Optional[list] = None, hash_algorithm: str = 'sha256', start: Optional[int] = None, end: Optional[int] = None, stats: Optional[RewrapStats] = None, recover: bool = False, skipped: Optional[list] = None, audio_packet_ms: int = 0, zero_copy: bool = False, csv_file: Optional[Path] = None):
+    """
+    Rewrap a HX file to a new container format.
+
+    Args:
+        input_file (pathlib.Path): The path to the input file.
+        output_file (pathlib.Path): The path to the output file, or a list of paths to write several outputs at once.
+            Default is to keep the same name as input with new extension.
+        format (str): The format to rewrap to, or a list of formats, one for each output. Default is 'mkv'. With a list
+            of output files and one format, each file's format is taken from its extension where it names one.
+        overwrite (bool): Overwrite the output file if it exists. Default is False.
+        debug (bool): Enable debug logging. Default is False.
+        streaming (bool): Read the input in a single forward pass instead of indexing it first. Default is False.
+        packet_hashes (list): If given, the hash of each video access unit is appended as it is written. See verify.
+        hash_algorithm (str): The hashlib algorithm used for packet_hashes. Default is 'sha256'.
+        start (int): Only rewrap from this many milliseconds into the file. Default is the start of the file.
+        end (int): Only rewrap up to this many milliseconds into the file. Default is the end of the file.
+        stats (RewrapStats): If given, filled in with the time spent in each stage and what was read and written.
+        recover (bool): Salvage a corrupt or truncated file by skipping the damaged parts. See index_file. Default is False.
+        skipped (list): If given with recover, the (start, end) byte range of each part skipped is appended.
+        audio_packet_ms (int): Join audio blocks into packets of about this many milliseconds. See packetize. Default is 0
+            for a packet per 20ms block.
+        zero_copy (bool): Memory map the input and build packets from it with one copy each. See packetize_mapped.
+            Default is False.
+        csv_file (pathlib.Path): If given, also write a CSV report of the file's blocks here. See csv_report.
+
+    Returns:
+        bool: True if successful, False otherwise.
+
+    Raises:
+        ValueError: If the output formats or files, or the start and end times, are invalid.
+        FileExistsError: If an output file already exists.
+
+    Notes:
+        Build a new playable file. This will not alter original video data. Audio is converted with no loss.
+        Turning on debug will output raw FFMPEG trace output.
+        Streaming reads every byte once, in order. Best for cold network storage. Otherwise the file is indexed, or the
+        index loaded from the index cache, and then each block is read in timestamp order.
+        With start or end set, only a clip is rewrapped. See rewrap_clip.
+        HXVT (H.265) and HXVS (H.264) files are both supported.
+        Recovery needs to search ahead, so it always indexes the file, without the index cache, even if streaming is
+        set. Frames after a skipped part may show errors until the next key frame. It doesn't apply to clips.
+        zero_copy only changes how an indexed file is read. Clips and streaming read as usual.
+        With several outputs the input is still read once. Each packet is built once and muxed into every output, so
+        MKV, MP4 and TS together cost little more than one of them. The CSV report comes from the same index as the
+        rewrap, so streaming is turned off to write one. For a clip the report still covers the whole file.
+    """
+    if start is not None and start < 0 or end is not None and end <= (start or 0):
+        raise ValueError('Invalid clip. The start must not be negative and the end must be after the start.')
+    targets = _output_targets(input_file, output_file, format)
+    if not overwrite:
+        for target, _ in targets:
+            if target.exists():
+                raise FileExistsError(f'Output file already exists: {target}')
+    outputs, formats = [target for target, _ in targets], [name for _, name in targets]
+    if start is not None or end is not None:
+        if not rewrap_clip(input_file, outputs, formats, start or 0, end, debug, packet_hashes=packet_hashes, hash_algorithm=hash_algorithm, stats=stats, audio_packet_ms=audio_packet_ms):
+            return False
+        return csv_file is None or csv_report(input_file, csv_file)
+    if streaming and not recover and csv_file is None:
+        with input_file.open('rb', buffering=STREAM_BUFFER_SIZE) as f:
+            return rewrap_stream(f, outputs, formats, debug, packet_hashes=packet_hashes, hash_algorithm=hash_algorithm, stats=stats, audio_packet_ms=audio_packet_ms)
+
+    with _stage(stats, 'index'):
+        blocks = index_file(input_file, recover=True, skipped=skipped) if recover else get_index(input_file)
+    if not blocks:
+        # Should we raise error here instead of returning False?
+        return False
+    if csv_file is not None and not csv_report(input_file, csv_file, blocks):
+        return False
+    with input_file.open('rb') as f, debug_logging(debug):
+        magic, width, height = read_header(f)
+        codec = VIDEO_CODECS[magic]
+        if zero_copy:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if stats is not None:
+                    # Nothing is read up front. Pages are loaded as the packets are built.
+                    stats.blocks_read += len(blocks)
+                    stats.bytes_read += 16 * len(blocks) + sum(blocks.sizes)
+                packets = packetize_mapped(mm, blocks, codec, audio_packet_ms)
+                try:
+                    _rewrap_packets(packets, targets, width, height, codec, packet_hashes, hash_algorithm, stats)
+                finally:
+                    packets.close()
+            return True
+        packets = packetize(_timed_blocks(stats, read_blocks(f, blocks)), codec, audio_packet_ms)
+        _rewrap_packets(packets, targets, width, height, codec, packet_hashes, hash_algorithm, stats)
+    return True
+
+def _rewrap_packets(packets, targets, width, height, codec, packet_hashes=None, hash_algorithm='sha256', stats=None):
+    # Open an output for each (output file, format) target and mux every packet into all of them.
+    outputs = []
+    try:
+        with _stage(stats, 'open'):
+            parameter_sets, packets = peek_parameter_sets(_timed_packets(stats, packets), codec)
+            for output_file, format in targets:
+                outputs.append(_open_output(output_file, format, width, height, parameter_sets, codec))
+        with _stage(stats, 'mux'):
+            _mux_outputs(outputs, packets, packet_hashes, hash_algorithm, codec)
+    finally:
+        for container, _, _ in outputs:
+            container.close()
+
+def rewrap_stream(input_stream, output_file, format: str = 'mkv', debug: bool = False, window: int = REORDER_WINDOW, packet_hashes: Optional[list] = None, hash_algorithm: str = 'sha256', stats: Optional[RewrapStats] = None, audio_packet_ms: int = 0):
+    """
+    Rewrap a HX stream to a new container format in a single forward pass.
+
+    Args:
+        input_stream (file): A binary file object at the start of the HX data. Can be a pipe or HTTP response body.
+        output_file (pathlib.Path): The path to the output file, or a writable binary file object. Can be a list to
+            write several outputs. See rewrap_file.
+        format (str): The format to rewrap to, or a list of formats, one for each output. Default is 'mkv'.
+        debug (bool): Enable debug logging. Default is False.
+        window (int): How far in milliseconds audio may trail video. Default is REORDER_WINDOW.
+        packet_hashes (list): If given, the hash of each video access unit is appended as it is written. See verify.
+        hash_algorithm (str): The hashlib algorithm used for packet_hashes. Default is 'sha256'.
+        stats (RewrapStats): If given, filled in with the time spent in each stage and what was read and written.
+        audio_packet_ms (int): Join audio blocks into packets of about this many milliseconds. See packetize. Default is 0
+            for a packet per 20ms block.
+
+    Returns:
+        bool: True if successful, False otherwise.
+
+    Raises:
+        ValueError: If the output formats or files are invalid.
+
+    Notes:
+        Blocks are parsed, ordered, packetized and muxed as they are read. Only the reorder window is held in memory.
+    """
+    targets = _output_targets(None, output_file, format)
+    header = read_header(input_stream)
+    if not header or header[0] not in VIDEO_CODECS:
+        return False
+    magic, width, height = header
+    codec = VIDEO_CODECS[magic]
+    blocks = order_blocks(_timed_blocks(stats, iter_blocks(input_stream, codec=codec)), window)
+    if stats is not None:
+        blocks = stats.timed(blocks, 'order')
+    first = next(blocks, None)
+    if first is None:
+        return False
+    with debug_logging(debug):
+        _rewrap_packets(packetize(chain((first,), blocks), codec, audio_packet_ms), targets, width, height, codec, packet_hashes, hash_algorithm, stats)
+    return True
+
+def clip_blocks(f, seek_table: SeekTable, first_timestamp: int, start: int, end: Optional[int] = None, window: int = REORDER_WINDOW, codec: VideoCodec = HEVC, stats: Optional[RewrapStats] = None):
+    """
+    Read the blocks of a time range of a HX file.
+
+    Args:
+        f (file): A seekable binary file object of the HX file.
+        seek_table (SeekTable): The key frames of the file. See get_seek_table.
+        first_timestamp (int): The timestamp of the start of the file.
+        start (int): Milliseconds from the start of the file to start the clip.
+        end (int): Milliseconds from the start of the file to end the clip. Default is the end of the file.
+        window (int): How far in milliseconds audio may trail video. Default is REORDER_WINDOW.
+        codec (VideoCodec): The video codec of the file. Default is HEVC.
+        stats (RewrapStats): If given, reading and ordering are timed and the blocks left out of the clip counted.
+
+    Yields:
+        tuple: (Block, bytes) in timestamp order, with relative_ts starting at 0 from the key frame.
+
+    Notes:
+        The clip starts at the last key frame at or before start, including its VPS, SPS, and PPS, so it can be decoded
+        without the rest of the file. Reading starts at that key frame and stops once everything before end has been
+        read, plus the audio that trails it. The cost depends on the length of the clip, not the file.
+        Nothing is yielded if end is not after start. A start past the end of the file isn't caught here, see
+        rewrap_clip.
+    """
+    if end is not None and end <= start:
+        return
+    key_frame = seek_table.lookup(first_timestamp + start)
+    if key_frame is None:
+        return
+    key_timestamp, offset = key_frame
+    end_timestamp = None if end is None else first_timestamp + end
+    f.seek(offset)
+    # Audio from before the key frame is still being read after it.
+    blocks = ((block, data) for block, data in _timed_blocks(stats, iter_blocks(f, offset, codec)) if block.timestamp >= key_timestamp)
+    blocks = order_blocks(blocks, window)
+    if stats is None:
+        for block, data in blocks:
+            if end_timestamp is not None and block.timestamp >= end_timestamp:
+                return
+            yield block, data
+        return
+
+    kept = 0
+    try:
+        for block, data in stats.timed(blocks, 'order'):
+            if end_timestamp is not None and block.timestamp >= end_timestamp:
+                return
+            kept += 1
+            yield block, data
+    finally:
+        stats.blocks_skipped += stats.blocks_read - kept
+
+def rewrap_clip(input_file: Path, output_file: Path, format: str = 'mkv', start: int = 0, end: Optional[int] = None, debug: bool = False, packet_hashes: Optional[list] = None, hash_algorithm: str = 'sha256', stats: Optional[RewrapStats] = None, audio_packet_ms: int = 0):
+    """
+    Rewrap a time range of a HX file to a new container format.
 
     Args:
-        data (bytes): The data to decode.
+        input_file (pathlib.Path): The path to the input file.
+        output_file (pathlib.Path): The path to the output file, or a list of paths. See rewrap_file.
+        format (str): The format to rewrap to, or a list of formats, one for each output. Default is 'mkv'.
+        start (int): Milliseconds from the start of the file to start the clip. Default is 0.
+        end (int): Milliseconds from the start of the file to end the clip. Default is the end of the file.
+        debug (bool): Enable debug logging. Default is False.
+        packet_hashes (list): If given, the hash of each video access unit is appended as it is written. See verify.
+        hash_algorithm (str): The hashlib algorithm used for packet_hashes. Default is 'sha256'.
+        stats (RewrapStats): If given, filled in with the time spent in each stage and what was read and written.
+        audio_packet_ms (int): Join audio blocks into packets of about this many milliseconds. See packetize. Default is 0
+            for a packet per 20ms block.
 
     Returns:
-        int: The type of the NALU.
+        bool: True if successful, False if the file can't be read or the clip is empty.
+
+    Notes:
+        The clip is snapped back to the key frame before start and its timestamps start at 0. See clip_blocks.
+        Key frames are found with get_seek_table, so with a HXFI block or a cached index only the clip is read.
+        A clip that ends before it starts, or starts at or after the last block of the file, is empty. Without this the
+        seek table would snap a start past the end back to the last key frame and write the final GOP.
     """
-    if data[0:3] == b'\x00\x00\x01':
-        unit_type = (data[3] >> 1) & 0x3F
-        return unit_type
-    elif data[0:4] == b'\x00\x00\x00\x01':
-        # This seems to be the expected format in the video files I have examined.
-        unit_type = (data[4] >> 1) & 0x3F
-        return unit_type
-    else:
-        # Return -1 or None if valid NALU padding not found.Not sure which is best yet
-        return None
+    targets = _output_targets(input_file, output_file, format)
+    if end is not None and end <= start:
+        logger.warning(f'Clip of {input_file} is empty: the end ({end}ms) is not after the start ({start}ms)')
+        return False
+    with _stage(stats, 'index'):
+        seek_table = get_seek_table(input_file)
+    if not seek_table:
+        return False
+    with input_file.open('rb') as f:
+        header = read_header(f)
+        if not header or header[0] not in VIDEO_CODECS:
+            return False
+        magic, width, height = header
+        codec = VIDEO_CODECS[magic]
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            first_timestamp = _first_timestamp(mm)
+            last_timestamp = _last_timestamp(mm)
+        if first_timestamp is not None and last_timestamp is not None and start >= last_timestamp - first_timestamp:
+            logger.warning(f'Clip of {input_file} is empty: the start ({start}ms) is past the end of the recording '
+                           f'({last_timestamp - first_timestamp}ms)')
+            return False
+        blocks = clip_blocks(f, seek_table, first_timestamp, start, end, codec=codec, stats=stats)
+        first = next(blocks, None)
+        if first is None:
+            return False
+        with debug_logging(debug):
+            _rewrap_packets(packetize(chain((first,), blocks), codec, audio_packet_ms), targets, width, height, codec, packet_hashes, hash_algorithm, stats)
+    return True
 
-def alaw_to_pcm16(alaw_chunk):
+# Container options for streaming. MP4 is fragmented with the header up front, so nothing needs to seek back, and cut
+# into fragments of at most half a second so playback can start before the first GOP is done.
+STREAM_FORMATS = {
+    'mp4': ('video/mp4', {'movflags': 'frag_keyframe+empty_moov+default_base_moof', 'frag_duration': '500000'}),
+    'ts': ('video/mp2t', {}),
+}
+
+class _ChunkWriter:
+    # Collects what the muxer writes so it can be handed out in chunks. Has no seek, so PyAV treats it as a stream.
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        self.size = 0
+        return data
+
+def stream_file(input_file: Path, format: str = 'mp4', start: Optional[int] = None, chunk_size: int = 64 * 1024):
     """
-    Convert ALAW audio data to PCM16.
+    Remux a HX file on the fly for playback over HTTP.
 
     Args:
-        alaw_chunk (bytes): The ALAW data to convert.
+        input_file (pathlib.Path): The path to the input file.
+        format (str): 'mp4' for fragmented MP4 that browsers can play, or 'ts' for MPEG-TS. Default is 'mp4'.
+        start (int): Start at the key frame at or before this many milliseconds into the file. Default is the start.
+        chunk_size (int): Bytes to collect before yielding a chunk. Default is 64KB.
+
+    Yields:
+        bytes: The output, in order. The first chunk is yielded as soon as the muxer writes anything, the rest once
+               chunk_size bytes are ready.
+
+    Raises:
+        ValueError: If the format is not in STREAM_FORMATS.
 
-    Returns:
-        bytes: The converted PCM16 data.
-    
-    References:
-        https://en.wikipedia.org/wiki/G.711#A-law_algorithm
-        https://web.archive.org/web/20110714000731/http://hazelware.luggle.com/tutorials/mulawcompression.html
     Notes:
-        In my video files, audio blocks seem to all be alaw 8000Hz mono, with 160 samples that represent 20ms of audio.
-        There is an unknown 4 byte header/padding before the alaw data. 0x00 01 50 00
+        Nothing is written to disk and only about one fragment is held in memory, however long the file is.
+        Video is copied as is. Browsers can't play PCM audio, so audio is encoded to AAC, with silence filling any
+        gaps to keep it in sync.
+        Without start the file is read in one forward pass. With start the key frames are found with get_seek_table,
+        which reads a HXFI block or the cached index, or indexes the file once.
+        Closing the generator early, such as when the client disconnects, closes the input and output.
     """
-    ALAW_TO_PCM16 = [
-        -5504, -5248, -6016, -5760, -4480, -4224, -4992, -4736,
-        -7552, -7296, -8064, -7808, -6528, -6272, -7040, -6784,
-        -2752, -2624, -3008, -2880, -2240, -2112, -2496, -2368,
-        -3776, -3648, -4032, -3904, -3264, -3136, -3520, -3392,
-        -22016, -20992, -24064, -23040, -17920, -16896, -19968, -18944,
-        -30208, -29184, -32256, -31232, -26112, -25088, -28160, -27136,
-        -11008, -10496, -12032, -11520, -8960, -8448, -9984, -9472,
-        -15104, -14592, -16128, -15616, -13056, -12544, -14080, -13568,
-        -344, -328, -376, -360, -280, -264, -312, -296,
-        -472, -456, -504, -488, -408, -392, -440, -424,
-        -88, -72, -120, -104, -24, -8, -56, -40,
-        -216, -200, -248, -232, -152, -136, -184, -168,
-        -1376, -1312, -1504, -1440, -1120, -1056, -1248, -1184,
-        -1888, -1824, -2016, -1952, -1632, -1568, -1760, -1696,
-        -688, -656, -752, -720, -560, -528, -624, -592,
-        -944, -912, -1008, -976, -816, -784, -880, -848,
-        5504, 5248, 6016, 5760, 4480, 4224, 4992, 4736,
-        7552, 7296, 8064, 7808, 6528, 6272, 7040, 6784,
-        2752, 2624, 3008, 2880, 2240, 2112, 2496, 2368,
-        3776, 3648, 4032, 3904, 3264, 3136, 3520, 3392,
-        22016, 20992, 24064, 23040, 17920, 16896, 19968, 18944,
-        30208, 29184, 32256, 31232, 26112, 25088, 28160, 27136,
-        11008, 10496, 12032, 11520, 8960, 8448, 9984, 9472,
-        15104, 14592, 16128, 15616, 13056, 12544, 14080, 13568,
-        344, 328, 376, 360, 280, 264, 312, 296,
-        472, 456, 504, 488, 408, 392, 440, 424,
-        88, 72, 120, 104, 24, 8, 56, 40,
-        216, 200, 248, 232, 152, 136, 184, 168,
-        1376, 1312, 1504, 1440, 1120, 1056, 1248, 1184,
-        1888, 1824, 2016, 1952, 1632, 1568, 1760, 1696,
-        688, 656, 752, 720, 560, 528, 624, 592,
-        944, 912, 1008, 976, 816, 784, 880, 848
-    ]
-    result = bytearray()
-    for byte in alaw_chunk:
-        pcm_value = ALAW_TO_PCM16[byte]
-        # Convert to little-endian bytes
-        result.extend(pcm_value.to_bytes(2, 'little', signed=True))
-    return bytes(result)
+    if format not in STREAM_FORMATS:
+        raise ValueError('Invalid stream format. Please use one of the following: ' + ', '.join(STREAM_FORMATS))
+    options = STREAM_FORMATS[format][1]
+    writer = _ChunkWriter()
 
-def valid_file(file_path):
+    with input_file.open('rb', buffering=STREAM_BUFFER_SIZE) as f:
+        header = read_header(f)
+        if not header or header[0] not in VIDEO_CODECS:
+            return
+        magic, width, height = header
+        codec = VIDEO_CODECS[magic]
+        if start:
+            seek_table = get_seek_table(input_file)
+            if not seek_table:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                first_timestamp = _first_timestamp(mm)
+            blocks = clip_blocks(f, seek_table, first_timestamp, start, codec=codec)
+        else:
+            blocks = order_blocks(iter_blocks(f, codec=codec))
+        parameter_sets, packets = peek_parameter_sets(packetize(blocks, codec, audio_packet_ms=100), codec)
+        container, video_stream, audio_stream = _open_output(writer, format, width, height, parameter_sets, codec, options, 'aac')
+        try:
+            audio_samples = None    # Samples of audio encoded so far, counted from the first audio packet.
+            threshold = 1           # Send the header and first fragment straight away, then wait for full chunks.
+            for media_packet in packets:
+                if media_packet.type == 'HXVF':
+                    container.mux(_av_packet(media_packet, video_stream))
+                else:
+                    pcm = media_packet.data
+                    start_sample = media_packet.pts * AUDIO_SAMPLES_PER_MS
+                    if audio_samples is None:
+                        audio_samples = start_sample
+                    elif start_sample > audio_samples + AUDIO_GAP_TOLERANCE * AUDIO_SAMPLES_PER_MS:
+                        # Fill the gap with silence so the audio after it lines up with the video.
+                        pcm = bytes((start_sample - audio_samples) * 2) + pcm
+                    frame = av.AudioFrame(format='s16', layout='mono', samples=len(pcm) // 2)
+                    frame.planes[0].update(pcm)
+                    frame.sample_rate = 8000
+                    frame.time_base = Fraction(1, 8000)
+                    frame.pts = audio_samples
+                    audio_samples += len(pcm) // 2
+                    for packet in audio_stream.encode(frame):
+                        container.mux(packet)
+                if writer.size >= threshold:
+                    yield writer.take()
+                    threshold = chunk_size
+            for packet in audio_stream.encode(None):
+                container.mux(packet)
+        finally:
+            container.close()
+    data = writer.take()
+    if data:
+        yield data
+
+# Default thumbnail width in pixels. The height keeps the aspect ratio of the video.
+THUMBNAIL_WIDTH = 320
+# JPEG quality for thumbnails, as an FFmpeg qscale from 2 (best) to 31.
+THUMBNAIL_QUALITY = 3
+
+def _keyframe_data(mm, offset, codec=HEVC):
+    # Collect the parameter sets and IRAP picture of the key frame starting at a seek table offset. Only block headers
+    # and the key frame's own data are touched. Audio in between is stepped over and reading stops at the next frame.
+    size = len(mm)
+    units = []
+    keyframe_ts = None
+    while offset + 16 <= size:
+        magic, length, timestamp = _BLOCK_HEADER.unpack_from(mm, offset)
+        if magic == b'HXFI':
+            offset += 8 + length
+            continue
+        start = offset + 16
+        offset = start + length
+        if magic == b'HXAF':
+            continue
+        if magic != b'HXVF' or offset > size:
+            break
+        nalu_type = codec.nalu_type(mm[start:start + 5])
+        if keyframe_ts is not None and (timestamp != keyframe_ts or nalu_type != codec.keyframe_type):
+            break
+        if nalu_type in codec.frame_types and nalu_type != codec.keyframe_type:
+            # The offset doesn't point at a key frame.
+            return None
+        units.append(mm[start:offset])
+        if nalu_type == codec.keyframe_type:
+            keyframe_ts = timestamp
+    return b''.join(units) if keyframe_ts is not None else None
+
+def _decode_keyframe(data, codec, width, height):
+    # A decoder per key frame, so they can run on separate threads. PyAV releases the GIL while decoding.
+    ctx = av.CodecContext.create(codec.name, 'r')
+    ctx.thread_count = 1
+    frames = ctx.decode(av.packet.Packet(data)) + ctx.decode(None)
+    if not frames:
+        return None
+    return frames[0].reformat(width=width, height=height, format='yuvj420p')
+
+def _pick_keyframes(timestamps, interval=None, count=None):
+    # Indexes into the key frame timestamps. With interval, the first key frame at least interval ms after the last
+    # one picked. With count, spread evenly from the first key frame to the last.
+    if count is not None:
+        if count <= 0:
+            return []
+        if count >= len(timestamps):
+            return list(range(len(timestamps)))
+        if count == 1:
+            return [0]
+        return [round(i * (len(timestamps) - 1) / (count - 1)) for i in range(count)]
+    picked = []
+    next_ts = None
+    for i, timestamp in enumerate(timestamps):
+        if next_ts is None or timestamp >= next_ts:
+            picked.append(i)
+            next_ts = timestamp + interval
+    return picked
+
+def keyframe_thumbnails(input_file: Path, interval: Optional[int] = 10000, count: Optional[int] = None, width: int = THUMBNAIL_WIDTH, workers: int = 4):
     """
-    Check if a file is a valid HX file.
-    
+    Decode thumbnails from the key frames of a HX file, without decoding anything else.
+
     Args:
-        file_path (pathlib.Path): The path to the file.
-        
+        input_file (pathlib.Path): The path to the input file.
+        interval (int): Take a key frame about every this many milliseconds. Default is 10 seconds.
+        count (int): Take this many key frames spread evenly over the file instead of using interval. Default is None.
+        width (int): Thumbnail width in pixels. Default is THUMBNAIL_WIDTH.
+        workers (int): Threads decoding key frames at once. Default is 4.
+
     Returns:
-        bool: True if valid, False otherwise.
+        list: (milliseconds, av.VideoFrame) tuples in order, where milliseconds is the key frame's time from the start
+              of the file and the frame is scaled to width in yuvj420p. Empty if the file can't be read.
 
     Notes:
-        This is a simple check to see if the file begins with the magic words 'HXVT' or 'HXVS'.
+        Key frames are found with get_seek_table, so a file with a HXFI block or a cached index isn't scanned. Only
+        the parameter sets and IRAP picture (IDR for H.264) of each picked key frame are read from the file, and each
+        is decoded on its own, so there is no need to decode the frames in between.
+        Key frames that can't be read or decoded are left out.
     """
-    with file_path.open('rb') as f:
-        magic = f.read(4)
-        if magic == b'HXVT' or magic == b'HXVS':
-            return True
-        else:
-            return False
+    if interval is None and count is None:
+        raise ValueError('Either interval or count is required.')
+    seek_table = get_seek_table(input_file)
+    if not seek_table:
+        return []
+    with input_file.open('rb') as f:
+        header = read_header(f)
+        if not header or header[0] not in VIDEO_CODECS:
+            return []
+        magic, video_width, video_height = header
+        codec = VIDEO_CODECS[magic]
+        if not video_width or not video_height:
+            return []
+        # Even dimensions for yuv420p.
+        width = max(2, width // 2 * 2)
+        height = max(2, round(width * video_height / video_width / 2) * 2)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            first_timestamp = _first_timestamp(mm)
+            picked = _pick_keyframes(seek_table.timestamps, interval, count)
+
+            def thumbnail(i):
+                data = _keyframe_data(mm, seek_table.offsets[i], codec)
+                if data is None:
+                    return None
+                try:
+                    return _decode_keyframe(data, codec, width, height)
+                except av.error.FFmpegError as e:
+                    logger.debug(f'Could not decode key frame at {seek_table.offsets[i]}: {e}')
+                    return None
 
-def file_info(file_path):
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+                frames = list(executor.map(thumbnail, picked))
+    return [(seek_table.timestamps[i] - first_timestamp, frame) for i, frame in zip(picked, frames) if frame is not None]
+
+def _write_jpeg(frame, output_file, quality=THUMBNAIL_QUALITY):
+    encoder = av.CodecContext.create('mjpeg', 'w')
+    encoder.width = frame.width
+    encoder.height = frame.height
+    encoder.pix_fmt = 'yuvj420p'
+    encoder.time_base = Fraction(1, 1)
+    # FFmpeg's -q:v, in lambda units.
+    encoder.options = {'flags': '+qscale', 'global_quality': str(quality * 118)}
+    packets = encoder.encode(frame) + encoder.encode(None)
+    with open(output_file, 'wb') as f:
+        for packet in packets:
+            f.write(bytes(packet))
+
+def save_thumbnails(input_file: Path, output_dir: Path, interval: int = 10000, width: int = THUMBNAIL_WIDTH, workers: int = 4):
     """
-    Return basic information about a HX file.
-    
+    Write a JPEG thumbnail about every interval milliseconds of a HX file. See keyframe_thumbnails.
+
     Args:
-        file_path (pathlib.Path): The path to the file.
+        input_file (pathlib.Path): The path to the input file.
+        output_dir (pathlib.Path): The directory to write to. Files are named after the input and the time into it in
+            milliseconds, e.g. P230101_120000_000065000.jpg.
+        interval (int): Milliseconds between thumbnails. Default is 10 seconds.
+        width (int): Thumbnail width in pixels. Default is THUMBNAIL_WIDTH.
+        workers (int): Threads decoding key frames at once. Default is 4.
 
     Returns:
-        dict:   A dictionary containing file information.
-                Keys: 'type', 'width', 'height', 'size', 'duration'
+        list: The paths of the thumbnails written, in order. Empty if the file can't be read.
+    """
+    written = []
+    for milliseconds, frame in keyframe_thumbnails(input_file, interval, width=width, workers=workers):
+        output_file = output_dir / f'{input_file.stem}_{max(milliseconds, 0):09d}.jpg'
+        _write_jpeg(frame, output_file)
+        written.append(output_file)
+    return written
 
-    Notes:
-        Duration is calculated from the timestamps of the first and last block.
+def contact_sheet(input_file: Path, output_file: Path, columns: int = 4, rows: int = 4, width: int = THUMBNAIL_WIDTH, workers: int = 4):
+    """
+    Write a JPEG grid of thumbnails spread evenly over a HX file. See keyframe_thumbnails.
 
+    Args:
+        input_file (pathlib.Path): The path to the input file.
+        output_file (pathlib.Path): The JPEG file to write.
+        columns (int): Thumbnails across. Default is 4.
+        rows (int): Thumbnails down. Fewer rows are used if the file has fewer key frames. Default is 4.
+        width (int): Width of each thumbnail in pixels. Default is THUMBNAIL_WIDTH.
+        workers (int): Threads decoding key frames at once. Default is 4.
+
+    Returns:
+        bool: True if successful, False if no key frames could be decoded.
     """
-    size = file_path.stat().st_size
-    with file_path.open('rb') as f:
-        magic = f.read(4)
-        if magic == b'HXVT':
-            file_type = 'HXVT'
-        elif magic == b'HXVS':
-            file_type = 'HXVS'
-        else:
-            file_type = 'unknown'
-        width = struct.unpack('<I', f.read(4))[0]
-        height = struct.unpack('<I', f.read(4))[0]
-    blocks = index_file(file_path)
-    if not blocks:
-        return None
-    duration = blocks[-1].timestamp - blocks[0].timestamp
+    thumbnails = keyframe_thumbnails(input_file, count=columns * rows, width=width, workers=workers)
+    if not thumbnails:
+        return False
+    rows = -(-len(thumbnails) // columns)
+    first = thumbnails[0][1]
+    # FFmpeg's tile filter lays the frames out, and pads a short last row with black.
+    graph = av.filter.Graph()
+    source = graph.add_buffer(width=first.width, height=first.height, format='yuvj420p', time_base=Fraction(1, 1))
+    tile = graph.add('tile', f'{columns}x{rows}:padding=4:margin=4')
+    sink = graph.add('buffersink')
+    source.link_to(tile)
+    tile.link_to(sink)
+    graph.configure()
+    for i, (_, frame) in enumerate(thumbnails):
+        frame.pts = i
+        graph.push(frame)
+    graph.push(None)
+    _write_jpeg(graph.pull(), output_file)
+    return True
+
+def parse_time(text: str) -> int:
+    """
+    Parse a time into milliseconds.
+
+    Args:
+        text (str): Seconds, MM:SS, or HH:MM:SS. Seconds can have a fraction, e.g. 1:02:03.5
+
+    Returns:
+        int: The time in milliseconds.
 
-    return {'type': file_type, 'width': width, 'height': height, 'size': size, 'duration': duration}
+    Raises:
+        ValueError: If the time can't be parsed.
+    """
+    parts = text.strip().split(':')
+    if len(parts) > 3 or not all(parts):
+        raise ValueError(f'Invalid time: {text}')
+    seconds = 0.0
+    for part in parts:
+        try:
+            value = float(part)
+        except ValueError:
+            raise ValueError(f'Invalid time: {text}') from None
+        if value < 0:
+            raise ValueError(f'Invalid time: {text}')
+        seconds = seconds * 60 + value
+    return round(seconds * 1000)
 
+@dataclass
+class ConvertResult:
+    input_file: Path
+    output_file: Path
+    success: bool
+    error: Optional[str] = None
+    input_size: int = 0
+    output_size: int = 0
+    elapsed: float = 0.0
+    verified: Optional[bool] = None
+    stats: Optional[dict] = None
+    skipped: Optional[list] = None
 
-def index_file(file_path):
+def convert_file(input_file: Path, output_file: Path, format: str = 'mkv', overwrite: bool = False, debug: bool = False, streaming: bool = False, verify_output: bool = False, start: Optional[int] = None, end: Optional[int] = None, stats: bool = False, recover: bool = False, audio_packet_ms: int = 0, zero_copy: bool = False):
     """
-    Index a HX file.
+    Rewrap a single file and report the outcome instead of raising.
 
     Args:
-        file_path (pathlib.Path): The path to the file to index.
+        input_file (pathlib.Path): The path to the input file.
+        output_file (pathlib.Path): The path to the output file.
+        format (str): The format to rewrap to. Default is 'mkv'.
+        overwrite (bool): Overwrite the output file if it exists. Default is False.
+        debug (bool): Enable debug logging. Default is False.
+        streaming (bool): Read the input in a single forward pass. Default is False.
+        verify_output (bool): Verify the output against the input after converting. Default is False.
+        start (int): Only convert from this many milliseconds into the file. Default is the start of the file.
+        end (int): Only convert up to this many milliseconds into the file. Default is the end of the file.
+        stats (bool): Measure the rewrap and put a RewrapStats dict in the result. Default is False.
+        recover (bool): Skip corrupt parts of the file and list them in the result. Default is False.
+        audio_packet_ms (int): Join audio blocks into packets of about this many milliseconds. See packetize. Default is 0
+            for a packet per 20ms block.
+        zero_copy (bool): Build packets straight from a memory map of the input. See packetize_mapped. Default is False.
 
     Returns:
-        list: A list of Block objects, or None if problem.
+        ConvertResult: The outcome of the conversion.
+    """
+    result = ConvertResult(input_file, output_file, False)
+    started = time.perf_counter()
+    try:
+        result.input_size = input_file.stat().st_size
+        # Hash the video while it is written so verification only needs to read the output.
+        input_hashes = [] if verify_output else None
+        rewrap_stats = RewrapStats() if stats else None
+        result.skipped = [] if recover else None
+        result.success = rewrap_file(input_file, output_file, format, overwrite=overwrite, debug=debug, streaming=streaming, packet_hashes=input_hashes, start=start, end=end, stats=rewrap_stats, recover=recover, skipped=result.skipped, audio_packet_ms=audio_packet_ms, zero_copy=zero_copy)
+        if rewrap_stats is not None:
+            result.stats = rewrap_stats.as_dict()
+        if not result.success:
+            result.error = 'Could not read file.'
+    except Exception as e:
+        result.success = False
+        result.error = str(e) or type(e).__name__
+    if result.success:
+        result.output_size = output_file.stat().st_size
+        if verify_output:
+            try:
+                result.verified = verify(input_file, output_file, mode='packet', input_hashes=input_hashes)
+            except Exception as e:
+                result.verified = False
+                result.error = f'Verification failed: {e}'
+    result.elapsed = time.perf_counter() - started
+    return result
+
+def batch_rewrap(jobs, format: str = 'mkv', workers: Optional[int] = None, overwrite: bool = False, debug: bool = False, streaming: bool = False, verify_output: bool = False, start: Optional[int] = None, end: Optional[int] = None, stats: bool = False, recover: bool = False, audio_packet_ms: int = 0, zero_copy: bool = False):
+    """
+    Rewrap many files at once across a pool of processes.
+
+    Args:
+        jobs (iterable): (input_file, output_file) path pairs. Can be a generator, it is consumed as workers free up.
+        format (str): The format to rewrap to. Default is 'mkv'.
+        workers (int): Number of conversions to run at once. Default is the number of CPUs. 1 runs in this process.
+        overwrite (bool): Overwrite output files that exist. Default is False.
+        debug (bool): Enable debug logging. Default is False.
+        streaming (bool): Read each input in a single forward pass. Default is False.
+        verify_output (bool): Verify each output against its input after converting. Default is False.
+        start (int): Only convert from this many milliseconds into each file. Default is the start of the file.
+        end (int): Only convert up to this many milliseconds into each file. Default is the end of the file.
+        stats (bool): Measure each rewrap and put a RewrapStats dict in its result. Default is False.
+        recover (bool): Skip corrupt parts of each file and list them in its result. Default is False.
+        audio_packet_ms (int): Join audio blocks into packets of about this many milliseconds. See packetize. Default is 0
+            for a packet per 20ms block.
+        zero_copy (bool): Build packets straight from a memory map of each input. See packetize_mapped. Default is False.
+
+    Yields:
+        ConvertResult: The result of each file as it finishes. Not necessarily in job order.
 
     Notes:
-        Possibly change function to take file path or file object. Could be more flexible that way.
+        Only a few jobs per worker are submitted ahead, so a long job list is never fully materialized.
+        Closing the generator early cancels every conversion that has not started.
     """
-    blocks = []
-    # TODO: Figure out if timestamps are universal or specific to block type. Likely useful for audio sync.
-    # TODO: Add support for h264 files.
-    video_initial_ts = -1
-    audio_initial_ts = -1
-    initial_ts = -1
-    previous_video_block = None # Used to calculate duration of video blocks.
-    previous_audio_block = None # Used to calculate duration of audio blocks.
+    if format not in OUTPUT_FORMATS:
+        raise ValueError('Invalid output format. Please use one of the following: ' + ', '.join(OUTPUT_FORMATS))
+    workers = workers or os.cpu_count() or 1
+    options = (format, overwrite, debug, streaming, verify_output, start, end, stats, recover, audio_packet_ms, zero_copy)
+    if workers == 1:
+        for input_file, output_file in jobs:
+            yield convert_file(input_file, output_file, *options)
+        return
 
+    jobs = iter(jobs)
+    executor = ProcessPoolExecutor(max_workers=workers)
+    running = {}
     try:
-        with file_path.open('rb') as f:
-            offset = 0
-            magic = f.read(4)
-            if not magic or len(magic) < 4 or magic != b'HXVT':
-                # File should begin with magic word HXVT.
-                # If not, return None
-                return None
-            
-            # Files have a 16 byte header. Specifies file type, height, and width. Skip this.
-            f.seek(16)
-            while True:
-                magic = f.read(4)
-
-                if magic == b'HXAF':
-                    offset = f.tell() - 4
-                    length = struct.unpack('<I', f.read(4))[0]
-                    timestamp = struct.unpack('<I', f.read(4))[0]
-                    #unknown_padding = f.read(4)
-                    #audio_header = f.read(4)
-                    #audio_data = f.read(length - 4)
-                    f.seek(4 + length, 1)
-                    block = Block('HXAF', offset, length, timestamp)
-                    blocks.append(block)
-                elif magic == b'HXVF':
-                    offset = f.tell() - 4
-                    length = struct.unpack('<I', f.read(4))[0]
-                    timestamp = struct.unpack('<I', f.read(4))[0]
-                    unknown_padding = f.read(4) # Seems to be related to type of video frame ?
-                    data = f.read(length)
-                    nal_type = h265_nalu_type(data)
-                    block = Block('HXVF', offset, length, timestamp, nalu_type=nal_type)
-                    blocks.append(block)
-                elif magic == b'HXFI':
-                    # Unknown how to decode this block yet. Possibly some type of file index?
-                    # Most of this block is 0x00
-                    # TODO: Figure this out.
-                    offset = f.tell() - 4
-                    length = struct.unpack('<I', f.read(4))[0] # Always 0x40 0D 03 00 - 200,000 bytes
-                    f.seek(length, 1)
-                    block = Block('HXFI', offset, length, -1)
-                    #blocks.append(block) - Don't add these to the list for now.
-                else:
-                    # Found unknown block or reached end of file.
+        while True:
+            # Keep every worker busy with a couple of jobs queued behind it.
+            for input_file, output_file in jobs:
+                running[executor.submit(convert_file, input_file, output_file, *options)] = (input_file, output_file)
+                if len(running) >= workers * 2:
                     break
-    except Exception as e:
-        return None
-    
-    # Sort blocks by timestamp. Audio blocks trail video blocks. If timestamps are universal, this will order them correctly.
-    # If timestamps are not universal this is not needed.
-    blocks.sort(key=lambda x: x.timestamp)
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                input_file, output_file = running.pop(future)
+                try:
+                    yield future.result()
+                except Exception as e:
+                    # The worker process itself failed.
+                    yield ConvertResult(input_file, output_file, False, error=str(e) or type(e).__name__)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
 
-    # Calculate the relative timestamp for each block.
-    # If timestamps are not universal could probably just do this in the block processing loop.
-    for block in blocks:
-        if initial_ts == -1:
-            initial_ts = block.timestamp
-            block.relative_ts = 0
-        else:
-            block.relative_ts = block.timestamp - initial_ts
-        # Alternate code if timestamps are independent.
-        # if block.type == 'HXAF':
-        #     if audio_initial_ts == -1:
-        #         audio_initial_ts = block.timestamp
-        #         block.relative_ts = 0
-        #     else:
-        #         block.relative_ts = block.timestamp - audio_initial_ts
-        # elif block.type == 'HXVF':
-        #     if video_initial_ts == -1:
-        #         video_initial_ts = block.timestamp
-        #         block.relative_ts = 0
-        #     else:
-        #         block.relative_ts = block.timestamp - video_initial_ts
-        
-        # This is to calculate the duration of video blocks for muxing. Seems setting PTS/DTS might not be enough.
-        # This should only be needed for video blocks as audio are constant 20ms blocks.
-        if block.type == 'HXVF':
-            if previous_video_block:
-                previous_video_block.duration = block.timestamp - previous_video_block.timestamp
-                previous_video_block = block
-            else:
-                previous_video_block = block
-        elif block.type == 'HXAF':
-            if previous_audio_block:
-                previous_audio_block.duration = block.timestamp - previous_audio_block.timestamp
-                previous_audio_block = block
-            else:
-                previous_audio_block = block
-    return blocks
+# How often watch_folder searches for new files, and how long a file must stop changing before it is converted.
+WATCH_INTERVAL = 2.0
+WATCH_SETTLE = 5.0
 
-def rewrap_file(input_file: Path, output_file: Optional[Path] = None, format: str = 'mkv', overwrite: bool = False, debug: bool = False):
+def watch_folder(input_dir: Path, output_dir: Optional[Path] = None, format: str = 'mkv', max_depth: int = 0, workers: Optional[int] = None, verify_output: bool = False, interval: float = WATCH_INTERVAL, settle: float = WATCH_SETTLE, stop: Optional[threading.Event] = None):
     """
-    Rewrap a HX file to a new container format.
+    Watch a directory and convert new HX files as they finish arriving.
 
     Args:
-        input_file (pathlib.Path): The path to the input file.
-        output_file (pathlib.Path): The path to the output file. Default is to keep the same name as input with new extension.
+        input_dir (pathlib.Path): The directory to watch.
+        output_dir (pathlib.Path): Where to write the converted files. Default is input_dir. Files in subdirectories
+            are written to the same subdirectories under it.
+        format (str): The format to rewrap to. Default is 'mkv'.
+        max_depth (int): How many levels of subdirectories to watch. Default is 0, only input_dir itself.
+        workers (int): Number of conversions to run at once. Default is the number of CPUs.
+        verify_output (bool): Verify each output against its input after converting. Default is False.
+        interval (float): Seconds between searches. Default is WATCH_INTERVAL.
+        settle (float): Seconds a file's size and modified time must stay the same before it is converted, so files
+            still being copied or uploaded are left alone. Default is WATCH_SETTLE.
+        stop (threading.Event): Set it to stop watching. Conversions already started are finished. Default is None to
+            watch until the generator is closed.
+
+    Yields:
+        ConvertResult: The result of each file as it finishes.
+
+    Notes:
+        Polls with scan_dir, so it works the same on local disks, network shares and every OS. A file is skipped if its
+        output already exists, so restarting never converts a file again. A file that failed is only tried again if it
+        changes. Files that aren't HX files are remembered and not checked again until they change.
+    """
+    if format not in OUTPUT_FORMATS:
+        raise ValueError('Invalid output format. Please use one of the following: ' + ', '.join(OUTPUT_FORMATS))
+    input_dir = Path(input_dir)
+    output_dir = Path(output_dir or input_dir)
+    workers = workers or os.cpu_count() or 1
+    changing = {}   # Path to ((size, mtime), when it was first seen that way) for files waiting to settle.
+    handled = {}    # Path to the (size, mtime) it had when it was converted or rejected.
+    running = {}
+    executor = ProcessPoolExecutor(max_workers=workers)
+    startup = True
+    try:
+        while stop is None or not stop.is_set():
+            now = time.monotonic()
+            present = set()
+            for entry in scan_dir(input_dir, max_depth):
+                file_path = Path(entry.path)
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                signature = (stat.st_size, stat.st_mtime_ns)
+                if handled.get(file_path) == signature:
+                    continue
+                present.add(file_path)
+                previous = changing.get(file_path)
+                if previous is None or previous[0] != signature:
+                    # Files already there when watching starts count as quiet since settle ago, so a backlog is
+                    # converted on the next search if it still hasn't changed.
+                    changing[file_path] = (signature, now - settle if startup and previous is None else now)
+                    continue
+                # Unchanged since the last search. Settled once it has been quiet long enough. The modified time can't
+                # be trusted for this, as copies that keep it (cp -p, rsync -t) make a growing file look old.
+                if now - previous[1] < settle:
+                    continue
+                if len(running) >= workers * 2:
+                    # Keep the rest waiting here instead of queuing every file in a large backlog.
+                    continue
+                del changing[file_path]
+                handled[file_path] = signature
+                # Subdirectories are mirrored, as cameras reuse the same file names in each date folder.
+                output_file = output_dir / file_path.relative_to(input_dir).with_suffix('.' + format)
+                if output_file.exists():
+                    logger.debug(f'Skipping {file_path}, {output_file} already exists')
+                    continue
+                if not _check_file(file_path):
+                    logger.debug(f'Skipping {file_path}, not a HX file')
+                    continue
+                logger.debug(f'Converting {file_path}')
+                try:
+                    output_file.parent.mkdir(parents=True, exist_ok=True)
+                except OSError as e:
+                    yield ConvertResult(file_path, output_file, False, error=str(e) or type(e).__name__)
+                    continue
+                running[executor.submit(convert_file, file_path, output_file, format, verify_output=verify_output)] = (file_path, output_file)
+            # Forget files that were removed or renamed before they settled.
+            for file_path in [file_path for file_path in changing if file_path not in present]:
+                del changing[file_path]
+            startup = False
+
+            if not running:
+                if stop is not None:
+                    stop.wait(interval)
+                else:
+                    time.sleep(interval)
+                continue
+            done, _ = wait(running, timeout=interval, return_when=FIRST_COMPLETED)
+            for future in done:
+                input_file, output_file = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = ConvertResult(input_file, output_file, False, error=str(e) or type(e).__name__)
+                yield result
+
+        # Stopped. Finish what was started.
+        for future in list(running):
+            input_file, output_file = running.pop(future)
+            try:
+                yield future.result()
+            except Exception as e:
+                yield ConvertResult(input_file, output_file, False, error=str(e) or type(e).__name__)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+# Largest jump in camera timestamps between the end of one clip and the start of the next that is still continuous.
+CONCAT_MAX_GAP = 1000
+
+@dataclass
+class ConcatSegment:
+    input_file: Path
+    first_timestamp: Optional[int] = None
+    last_timestamp: Optional[int] = None
+    start_pts: Optional[int] = None     # Where the clip starts in the output, in milliseconds.
+    gap: Optional[int] = None           # Milliseconds since the end of the previous clip. None for the first clip.
+    continuous: bool = False            # The clip carries on from the previous clip without a break.
+    error: Optional[str] = None         # Why the clip was left out.
+
+def _clip_order(file_path: Path):
+    # Camera names sort by date and time once the A or P prefix is moved out of the way. See get_newname.
+    return str(get_newname(file_path))
+
+def order_clips(input_files, workers: int = 8):
+    """
+    Put HX files in chronological order.
+
+    Args:
+        input_files (iterable): Paths to HX files.
+        workers (int): Number of files to read at once. Default is 8.
+
+    Returns:
+        list: (path, info) tuples in recording order, where info is from file_info, or None if it couldn't be read.
+
+    Notes:
+        Files are ordered by name with get_newname, then by first block timestamp. Only the start and end of each
+        file is read.
+    """
+    clips = list(file_info_batch(input_files, workers))
+    clips.sort(key=lambda clip: (_clip_order(clip[0]), clip[1]['first_timestamp'] if clip[1] else 0))
+    return clips
+
+def concat_files(input_files, output_file: Path, format: str = 'mkv', overwrite: bool = False, debug: bool = False, max_gap: int = CONCAT_MAX_GAP, window: int = REORDER_WINDOW, packet_hashes: Optional[list] = None, hash_algorithm: str = 'sha256', audio_packet_ms: int = 0):
+    """
+    Join HX files into a single continuous output.
+
+    Args:
+        input_files (iterable): Paths to the HX files. They are put in recording order, see order_clips.
+        output_file (pathlib.Path): The path to the output file.
         format (str): The format to rewrap to. Default is 'mkv'.
         overwrite (bool): Overwrite the output file if it exists. Default is False.
         debug (bool): Enable debug logging. Default is False.
+        max_gap (int): Largest gap in milliseconds between clips that still counts as continuous. Default is CONCAT_MAX_GAP.
+        window (int): How far in milliseconds audio may trail video. Default is REORDER_WINDOW.
+        packet_hashes (list): If given, the hash of each video access unit is appended as it is written. See verify.
+        hash_algorithm (str): The hashlib algorithm used for packet_hashes. Default is 'sha256'.
+        audio_packet_ms (int): Join audio blocks into packets of about this many milliseconds. See packetize. Default is 0
+            for a packet per 20ms block.
 
-    Returns:
-        bool: True if successful, False otherwise.
+    Yields:
+        ConcatSegment: Each clip once it has been written, or with error set if it was left out.
 
     Raises:
         ValueError: If the output format is invalid.
         FileExistsError: If the output file already exists.
 
     Notes:
-        Build a new playable file. This will not alter original video data. Audio is converted with no loss.
-        Turning on debug will output raw FFMPEG trace output.
-        TODO: Add support for h264 files.
-    """
-    # Valid output formats. Add more after testing. Currently represented as file extension. 
-    valid_formats = ['mkv', 'mp4', 'ts']
-    if format not in valid_formats:
-        raise ValueError('Invalid output format. Please use one of the following: ' + ', '.join(valid_formats))
-    if debug:
-        enable_debug()
-    else:
-        disable_logging()
-    if not output_file:
-        #output_file = input_file.rsplit('.', 1)[0] + '.' + format
-        output_file = input_file.with_suffix('.' + format)
-    #print(f'Output file: {output_file}')
+        Each clip is read in a single forward pass like rewrap_stream, so only the reorder window is held in memory.
+        Continuous clips keep the spacing of their camera timestamps. After a gap, a timestamp reset, or clips that
+        overlap, the next clip starts straight after the previous one and the gap is reported.
+        Clips must have the same type and size as the first clip. Others are left out.
+        Closing the generator early finishes the output with the clips written so far.
+    """
+    if format not in OUTPUT_FORMATS:
+        raise ValueError('Invalid output format. Please use one of the following: ' + ', '.join(OUTPUT_FORMATS))
     if not overwrite and output_file.exists():
         raise FileExistsError(f'Output file already exists: {output_file}')
-    blocks = index_file(input_file)
-    if not blocks:
-        # Should we raise error here instead of returning False?
-        return False
-    container = av.open(output_file, 'w')
-    video_stream = container.add_stream('libx265', rate=15, options={'x265-params': 'log_level=none'}) # Default to 15fps for now. Our samples were VFR so we will use PTS/DTS.
-    audio_stream = container.add_stream('pcm_s16le', rate=8000, layout='mono', format='s16')
 
-    with input_file.open('rb') as f:
-        f.seek(4) # Skip the initial HXVT block.
+    container = None
+    header = None
+    previous = None     # Segment of the last clip written.
+    end_pts = 0         # Output time just after the last packet written.
+    try:
+        for input_file, info in order_clips(input_files):
+            segment = ConcatSegment(input_file)
+            if not info or info['type'] not in ('HXVT', 'HXVS'):
+                segment.error = 'Not a supported HX file.'
+                yield segment
+                continue
+            if header and info['type'] != header[0]:
+                segment.error = f'File type {info["type"]} does not match {header[0]}.'
+                yield segment
+                continue
+            if header and (info['width'], info['height']) != header[1:]:
+                segment.error = f'Video size {info["width"]}x{info["height"]} does not match {header[1]}x{header[2]}.'
+                yield segment
+                continue
 
-        # Set video parameters.
-        video_stream.time_base = Fraction(1, 1000)
-        video_stream.pix_fmt = "yuv420p"
-        video_width = struct.unpack('<I', f.read(4))[0]
-        video_stream.width = video_width
-        video_height = struct.unpack('<I', f.read(4))[0]
-        video_stream.height = video_height
-
-        # Set audio parameters.
-        audio_stream.time_base = Fraction(1, 1000)
-        audio_stream.rate = 8000
-        audio_stream.layout = 'mono'
-        audio_stream.format = 's16'
-        #audio_stream.frame_size = 160 # 20ms of audio at 8000Hz
+            with input_file.open('rb', buffering=STREAM_BUFFER_SIZE) as f:
+                magic, width, height = read_header(f)
+                codec = VIDEO_CODECS[magic]
+                blocks = order_blocks(iter_blocks(f, codec=codec), window)
+                first = next(blocks, None)
+                if first is None:
+                    segment.error = 'No blocks found.'
+                    yield segment
+                    continue
+                segment.first_timestamp = first[0].timestamp
 
-        # Create a buffer to hold video data until a complete frame is found.
-        video_buffer = bytearray()
+                # Place the clip on the output timeline, never before anything already written.
+                start_pts = end_pts
+                if previous:
+                    segment.gap = segment.first_timestamp - previous.last_timestamp
+                    segment.continuous = 0 <= segment.gap <= max_gap
+                    if segment.continuous:
+                        start_pts = max(previous.start_pts + segment.first_timestamp - previous.first_timestamp, end_pts)
+                    else:
+                        logger.debug(f'Gap of {segment.gap}ms before {input_file}')
+                segment.start_pts = start_pts
 
-        for block in blocks:
-            #print(f'Processing block: {block.type} - Timestamp: {block.timestamp} - Offset: {block.offset} - Size: {block.size}')
-            if block.type == 'HXAF':
-                f.seek(block.offset + 20) # Skip 4 byte header, size, offset, and 4 byte data header.
-                data = f.read(block.size - 4)
-                pcm_audio = alaw_to_pcm16(data)
-                packet = av.packet.Packet(pcm_audio)
-                packet.time_base = Fraction(1, 1000)
-                packet.pts = block.relative_ts
-                packet.dts = block.relative_ts
-                packet.stream = audio_stream
-                container.mux_one(packet)
-            elif block.type == 'HXVF':
-                f.seek(block.offset + 16) # Skip 4 byte header, size, offset, and 4 byte unknown data (possibly frame type).
-                data = f.read(block.size)
-                video_buffer.extend(data)
-                nalu_type = h265_nalu_type(data)
-                #print(f'NALU Type: {nalu_type}')
-                if nalu_type not in (1, 19):
-                    # Buffer this data. Will be Packetized and muxed later with video frame data.
-                    # Video typically has NALU types 32, 33, and 34 that directly proceed type 19. All share the same timestamp.
-                    #print(f'Added block to buffer - Offset: {block.offset} NAL type: {nalu_type}')
-                    continue
-                packet = av.packet.Packet(video_buffer)
-                packet.time_base = Fraction(1, 1000)
-                packet.pts = block.relative_ts
-                packet.dts = block.relative_ts
-                if block.duration != -1:
-                    packet.duration = block.duration
-                packet.stream = video_stream
-                container.mux_one(packet)
-                video_buffer.clear()
-                #print(f'Video packet: {packet} - NALU Type: {nalu_type} - Timestamp: {block.relative_ts} - Offset: {block.offset}')
-    container.close()
-    return True
+                last = {}
+                frame_duration = [1]
+                def shifted(packets):
+                    for packet in packets:
+                        last[packet.type] = packet
+                        if packet.type == 'HXVF' and packet.duration > 0:
+                            frame_duration[0] = packet.duration
+                        packet.pts += start_pts
+                        yield packet
+                packets = shifted(packetize(chain((first,), blocks), codec, audio_packet_ms))
+                with debug_logging(debug):
+                    if container is None:
+                        header = (info['type'], width, height)
+                        parameter_sets, packets = peek_parameter_sets(packets, codec)
+                        container, video_stream, audio_stream = _open_output(output_file, format, width, height, parameter_sets, codec)
+                    _mux_packets(container, video_stream, audio_stream, packets, packet_hashes, hash_algorithm, codec)
+
+            segment.last_timestamp = segment.first_timestamp + max(packet.pts for packet in last.values()) - start_pts
+            for packet in last.values():
+                # Audio blocks are 8000Hz, 2 bytes per sample. The last video frame lasts as long as the one before it.
+                length = len(packet.data) // 16 if packet.type == 'HXAF' else frame_duration[0]
+                end_pts = max(end_pts, packet.pts + length)
+            previous = segment
+            yield segment
+    finally:
+        if container is not None:
+            container.close()
 
-def csv_report(input_path: Path, output_path: Optional[Path] = None):
+def csv_report(input_path: Path, output_path: Optional[Path] = None, blocks: Optional[BlockIndex] = None):
     """
     Generate a CSV report of a HX file.
 
     Args:
         file_path (Path): The path to the file to report on.
         output_file (Path): The path to save the report. Default is to use the same name as input with .csv extension.
+        blocks (BlockIndex): The file's index, if it has already been read. Default is to get it with get_index.
 
     Returns:
         bool: True if successful, False otherwise.
@@ -397,7 +3122,8 @@ def csv_report(input_path: Path, output_path: Optional[Path] = None):
         output_path = input_path.with_suffix('.csv')
     if output_path.is_dir():
         output_path = output_path / f'{input_path.stem}.csv'
-    blocks = index_file(input_path)
+    if blocks is None:
+        blocks = get_index(input_path)
     if not blocks:
         return False
     with output_path.open('w', newline='') as f:
@@ -477,15 +3203,152 @@ def rename_files(directory: Path):
                 continue
     return True
 
-def verify(file1: Path, file2: Path, algorithm: str = 'sha256', output_path: Optional[Path] = None):
+# Access unit delimiters are added by some muxers (MPEG-TS) and carry no picture data. Ignored when hashing.
+def split_nal_units(data, length_size: int = 0):
+    """
+    Split an access unit into its NAL units.
+
+    Args:
+        data (bytes): The access unit. Annex B (start code prefixed) or length prefixed.
+        length_size (int): Size of the length prefix of each NAL unit. Default is 0 to detect it.
+
+    Returns:
+        list: The NAL units, without start codes or length prefixes.
+
+    Notes:
+        Data that starts with a start code is treated as Annex B, otherwise as 4 byte length prefixed like MP4 and MKV.
+        Trailing zero bytes before a start code are dropped as muxers don't keep them.
+    """
+    data = bytes(data)
+    if not length_size and (data[:3] == b'\x00\x00\x01' or data[:4] == b'\x00\x00\x00\x01'):
+        units = []
+        start = data.find(b'\x00\x00\x01')
+        while start != -1:
+            start += 3
+            end = data.find(b'\x00\x00\x01', start)
+            unit = data[start:] if end == -1 else data[start:end]
+            units.append(unit.rstrip(b'\x00'))
+            start = end
+        return units
+
+    length_size = length_size or 4
+    units = []
+    offset = 0
+    while offset + length_size <= len(data):
+        length = int.from_bytes(data[offset:offset + length_size], 'big')
+        offset += length_size
+        units.append(data[offset:offset + length])
+        offset += length
+    return units
+
+def access_unit_hash(data, algorithm: str = 'sha256', length_size: int = 0, codec: VideoCodec = HEVC):
+    """
+    Hash the NAL units of a video access unit, ignoring how they are framed.
+
+    Args:
+        data (bytes): The access unit. Annex B or length prefixed.
+        algorithm (str): The hashlib algorithm to use. Default is 'sha256'.
+        length_size (int): Size of the length prefix of each NAL unit. Default is 0 to detect it.
+        codec (VideoCodec): The video codec of the access unit. Default is HEVC.
+
+    Returns:
+        str: The hex digest.
+
+    Notes:
+        The same frame hashes the same whether it was read from a HX file or demuxed from MKV, MP4 or TS.
+    """
+    digest = hashlib.new(algorithm)
+    for unit in split_nal_units(data, length_size):
+        if unit and codec.unit_type(unit) == codec.aud_type:
+            continue
+        digest.update(len(unit).to_bytes(4, 'big'))
+        digest.update(unit)
+    return digest.hexdigest()
+
+def packet_hashes(file_path: Path, algorithm: str = 'sha256'):
+    """
+    Hash every video access unit of a HX file or converted video file, without decoding.
+
+    Args:
+        file_path (pathlib.Path): A HX file or any container PyAV can open.
+        algorithm (str): The hashlib algorithm to use. Default is 'sha256'.
+
+    Returns:
+        list: The hex digest of each access unit, in decode order.
+
+    Raises:
+        ValueError: If a HX file can't be indexed.
+    """
+    if valid_file(file_path):
+        codec = file_codec(file_path)
+        blocks = get_index(file_path)
+        if not blocks:
+            raise ValueError(f'Could not index {file_path}')
+        with file_path.open('rb') as f:
+            video_blocks = (block for block in blocks if block.type == 'HXVF')
+            return [access_unit_hash(packet.data, algorithm, codec=codec) for packet in packetize(read_blocks(f, video_blocks), codec)]
+
+    hashes = []
+    with av.open(str(file_path)) as container:
+        stream = container.streams.video[0]
+        codec = H264 if stream.codec_context.name == 'h264' else HEVC
+        extradata = stream.codec_context.extradata
+        # hvcC and avcC extradata record the size of the NAL length prefixes.
+        length_size = 0
+        if extradata and extradata[0] == 1:
+            if codec is HEVC and len(extradata) > 22:
+                length_size = (extradata[21] & 0x03) + 1
+            elif codec is H264 and len(extradata) > 4:
+                length_size = (extradata[4] & 0x03) + 1
+        for packet in container.demux(stream):
+            if packet.size:
+                hashes.append(access_unit_hash(bytes(packet), algorithm, length_size, codec))
+    return hashes
+
+def _verify_packets(file1, file2, algorithm, output_path, input_hashes, concurrent):
+    algorithm = algorithm.lower().replace('/', '_')
+    if algorithm not in hashlib.algorithms_available:
+        raise ValueError('Invalid algorithm. Please use one of the hashlib algorithms.')
+    if input_hashes is not None:
+        file1_hashes = input_hashes
+        file2_hashes = packet_hashes(file2, algorithm)
+    elif concurrent:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            file1_future = executor.submit(packet_hashes, file1, algorithm)
+            file2_hashes = packet_hashes(file2, algorithm)
+            file1_hashes = file1_future.result()
+    else:
+        file1_hashes = packet_hashes(file1, algorithm)
+        file2_hashes = packet_hashes(file2, algorithm)
+
+    if output_path and output_path.is_dir():
+        for file, hashes in ((file1, file1_hashes), (file2, file2_hashes)):
+            with (output_path / f'{file.name}.packethash').open('x') as f:
+                f.write(''.join(f'{i},{digest}\n' for i, digest in enumerate(hashes)))
+
+    if len(file1_hashes) != len(file2_hashes):
+        # Files have different number of frames. They do not match.
+        logger.debug(f'Files {file1} and {file2} do not match. Different number of frames.')
+        return False
+    for i, (hash1, hash2) in enumerate(zip(file1_hashes, file2_hashes)):
+        if hash1 != hash2:
+            logger.debug(f'Files {file1} and {file2} do not match. Frame {i} does not match.')
+            return False
+    logger.debug(f'Files {file1} and {file2} match.')
+    return True
+
+def verify(file1: Path, file2: Path, algorithm: str = 'sha256', output_path: Optional[Path] = None, mode: str = 'framehash', input_hashes: Optional[list] = None, concurrent: bool = True):
     """
-    Compare two files using FFmpeg's framehash.
+    Compare two files using FFmpeg's framehash, or by hashing their video packets.
 
     Args:
         file1 (Path): The path of file1.
         file2 (Path): The path of file2.
         algorithm (str): The hash algorithm to use. Default is 'sha256'. See ffmpeg documentation for supported algorithms.
         output (Path): The path to save the framehash output. Default is None (does not save). 
+        mode (str): 'framehash' to decode both files with FFmpeg, or 'packet' to compare video packets in process.
+        input_hashes (list): Packet mode only. Hashes of file1 already collected by rewrap_file, so file1 isn't read.
+        concurrent (bool): Packet mode only. Hash both files at the same time. Default is True.
 
     Returns:
         bool: True if files match, False otherwise.
@@ -493,15 +3356,21 @@ def verify(file1: Path, file2: Path, algorithm: str = 'sha256', output_path: Opt
     Raises:
         FileNotFoundError: If FFmpeg is not found on the system or if either file does not exist.
         RuntimeError: If FFmpeg returns an error.
-        ValueError: If an invalid algorithm is used.
+        ValueError: If an invalid algorithm or mode is used.
         FileExistsError: If the output framehash file already exists.
 
     Notes:
-        This function requires the system have FFmpeg installed and be accessible from the PATH environment.
+        Framehash mode requires the system have FFmpeg installed and be accessible from the PATH environment.
+        The video is stream copied, so packet mode compares each access unit's NAL units without decoding anything.
+        Either file can be a HX file or a converted file. Packet mode uses hashlib algorithm names.
     """
     
     if not file1.is_file() or not file2.is_file():
         raise FileNotFoundError('One or both files do not exist.')
+    if mode == 'packet':
+        return _verify_packets(file1, file2, algorithm, output_path, input_hashes, concurrent)
+    if mode != 'framehash':
+        raise ValueError("Invalid mode. Please use 'framehash' or 'packet'.")
     if algorithm.upper() not in ('MD5', 'MURMUR3', 'RIPEMD128', 'RIPEMD160', 'RIPEMD256', 'RIPEMD320', 'SHA160', 'SHA224', 'SHA256', 'SHA512/224', 'SHA512/256', 'SHA384', 'SHA512', 'CRC32', 'ADLER32'):
         raise ValueError('Invalid algorithm. Please use one of the supported FFmpeg framhash algorithms.')
     
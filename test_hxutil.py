@@ -0,0 +1,45 @@
+import pytest
+
+import hxgen
+import hxutil
+
+FIRST_TIMESTAMP = 1000000
+
+
+@pytest.fixture(scope='module')
+def hx_file(tmp_path_factory):
+    # 20 seconds of synthetic HEVC, with a HXFI block so clips use the seek table.
+    file_path = tmp_path_factory.mktemp('hx') / 'clip.265'
+    hxgen.write_hx(file_path, 20000, 160, 120, hxfi='end', start_timestamp=FIRST_TIMESTAMP)
+    return file_path
+
+
+@pytest.fixture(autouse=True)
+def no_index_cache(monkeypatch):
+    monkeypatch.setattr(hxutil, 'index_cache', None)
+
+
+def test_clip_inside_file(hx_file, tmp_path):
+    output_file = tmp_path / 'clip.mkv'
+    assert hxutil.rewrap_clip(hx_file, output_file, start=5000, end=9000)
+    assert output_file.stat().st_size > 0
+
+
+@pytest.mark.parametrize('start', [20000, 50000])
+def test_clip_past_end(hx_file, tmp_path, start):
+    output_file = tmp_path / 'clip.mkv'
+    assert hxutil.rewrap_clip(hx_file, output_file, start=start) is False
+    assert hxutil.rewrap_file(hx_file, output_file, start=start) is False
+    assert not output_file.exists()
+
+
+@pytest.mark.parametrize('start, end', [(9000, 5000), (5000, 5000)])
+def test_clip_inverted_range(hx_file, tmp_path, start, end):
+    output_file = tmp_path / 'clip.mkv'
+    assert hxutil.rewrap_clip(hx_file, output_file, start=start, end=end) is False
+    assert not output_file.exists()
+    with pytest.raises(ValueError):
+        hxutil.rewrap_file(hx_file, output_file, start=start, end=end)
+    seek_table = hxutil.get_seek_table(hx_file)
+    with hx_file.open('rb') as f:
+        assert list(hxutil.clip_blocks(f, seek_table, FIRST_TIMESTAMP, start, end)) == []